@@ -16,7 +16,7 @@ spring_layout_kwargs = dict(
 plot_data, _ = get_graph_data(file, spring_layout_kwargs)
 IMAGE_DIR = Path(__file__).parent / "assets"
 for node in plot_data["nodes"]:
-    cc_name = node["data"]["name"].split(":")[-1]
+    cc_name = node["data"]["token"]
     img_file = f"https://raw.githubusercontent.com/jmmshn/vacation_routing/main/assets/{cc_name}.png"
     node["data"]["image"] = str(img_file)
 style_sheet = [
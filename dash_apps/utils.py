@@ -1,12 +1,17 @@
+from pathlib import Path
 from pprint import pprint
 import numpy as np
 from networkx.drawing.layout import spring_layout
 from networkx.readwrite import json_graph
-from entropic.liquidity import exchange_function, exchange_line
+from entropic.liquidity import exchange_fit, path_output
+from entropic.cache import FitCache
 from entropic.core import DEXA
 import pandas as pd
 import plotly.express as px
 
+# fits of the price impact chart, reused as the slider moves
+_FIT_CACHE = FitCache()
+
 
 def _modify_nodes(data, positions):
     """Add label and position to each node"""
@@ -14,10 +19,13 @@ def _modify_nodes(data, positions):
         node["data"]["label"] = node["data"]["id"]
         x, y = positions[node["data"]["id"]]
         node["position"] = {"x": x, "y": y}
-        node["classes"] = f'dex_{node["data"]["name"].split(":")[0]}'
+        node["classes"] = f'dex_{node["data"]["chain"]}'
 
     for edge in data["edges"]:
         edge["data"]["id"] = edge["data"]["source"] + "-" + edge["data"]["target"]
+        if "key" in edge["data"]:
+            # parallel pools between the same nodes need distinct ids
+            edge["data"]["id"] += f'-{edge["data"]["key"]}'
         if edge["data"].get("isBridge", False):
             edge["classes"] = "bridge"
 
@@ -29,24 +37,34 @@ def get_graph_data(file, spring_layout_kwargs=None):
     Additional information can be added to the final graph by modifying modifying the graph plotting dictionary.
 
     Args:
-        file (str): The path to the json file.
+        file (str): The path to the json file, or to a snapshot directory written by
+            DEXA.save_snapshot.
         spring_layout_kwargs (dict): The kwargs to pass to the spring layout.
     Returns:
         plot_data: The plotting information for the graph.
         graph: the nx graph object
     """
     spring_layout_kwargs = spring_layout_kwargs or {}
-    router = DEXA.from_file(file)
-    G = router.graph.copy()
-    rm_bunch = [[u, v] for u, v in G.edges() if u.split(":")[0] != v.split(":")[0]]
-    G.remove_edges_from(rm_bunch)
+    if Path(file).is_dir():
+        router = DEXA.load_snapshot(file)
+    else:
+        router = DEXA.from_file(file)
+    graph = router.to_networkx()
+    G = graph.copy()
+    G.remove_edges_from(router.bridge_edges())
     positions = spring_layout(
         G, k=140, iterations=25, weight="weight", scale=10, **spring_layout_kwargs
     )
 
-    plot_data = json_graph.cytoscape_data(router.graph)["elements"]
+    plot_data = json_graph.cytoscape_data(graph)["elements"]
+    names = [node["data"]["id"] for node in plot_data["nodes"]]
+    for node, chain, token in zip(
+        plot_data["nodes"], router.chain_of(names), router.token_of(names)
+    ):
+        node["data"]["chain"] = chain
+        node["data"]["token"] = token
     _modify_nodes(plot_data, positions=positions)
-    return plot_data, router.graph
+    return plot_data, graph
 
 
 def get_price_impact_curve(edge_data, amt):
@@ -63,11 +81,10 @@ def get_price_impact_curve(edge_data, amt):
     if edge_data:
         liq_1 = edge_data["source_liquidity"]
         liq_2 = edge_data["target_liquidity"]
-        xx, yy = exchange_function(liq_1, liq_2, amt=amt)
-        slope, intercept, price = exchange_line(
-            liq_1, liq_2, amt=amt, slippage=0.95
-        )
-        yy_fit = slope * xx + intercept
+        xx = np.linspace(0, amt, 100)
+        yy = path_output(xx, liq_1, liq_2)
+        # the DCP compliant curve the split optimizer works with
+        yy_fit = exchange_fit(xx, liq1=liq_1, liq2=liq_2, cache=_FIT_CACHE)
     else:
         xx = np.linspace(0, amt, 100)
         yy = xx
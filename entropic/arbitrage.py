@@ -0,0 +1,226 @@
+# %%
+from collections import deque
+from dataclasses import dataclass
+import logging
+from typing import List, Set
+import numpy as np
+from entropic.graph import CSRGraph
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ArbitrageCycle:
+    """
+    A closed loop of swaps that returns more of the starting token than it used
+    Args:
+        nodes: The nodes visited, the first node is repeated at the end
+        edges: The edge used for each swap
+        profit: The relative gain of one trip around the loop, rate * (1 - fee) multiplied
+            over the swaps, minus one
+    """
+
+    nodes: list
+    edges: List[int]
+    profit: float
+
+
+class ArbitrageDetector:
+    """
+    Negative-cycle detection over the log exchange rates of a CSRGraph.
+    Each edge u -> v with exchange rate r and fee f gives two arcs, u -> v weighted
+    -log(r * (1 - f)) and v -> u weighted -log((1 / r) * (1 - f)), so a cycle with negative
+    total weight is a profitable loop of swaps. Edges without a positive rate are skipped.
+
+    run() is a batched Bellman-Ford pass over the arc arrays, relaxing every arc at once per
+    round. update() patches the arcs of some edges and restarts the relaxation from the touched
+    nodes only (SPFA), reusing the distances of the previous pass.
+    """
+
+    def __init__(self, graph: CSRGraph, fee_scale: float = 1.0, check_every: int = 8):
+        """
+        Args:
+            graph: The graph, with "rate" and "fee" edge columns
+            fee_scale: Multiplies the fee column to get the fee as a fraction, e.g. 1e-4 for
+                fees given in basis points
+            check_every: Number of relaxation rounds between two searches for cycles
+        """
+        self.graph = graph
+        self.fee_scale = fee_scale
+        self.check_every = check_every
+        num_edges = graph.num_edges
+        self.arc_edge = np.concatenate([np.arange(num_edges)] * 2)
+        self.arc_src = np.concatenate([graph.u, graph.v]).astype(np.int64)
+        self.arc_dst = np.concatenate([graph.v, graph.u]).astype(np.int64)
+        self.weights = np.empty(2 * num_edges)
+        self._set_arc_weights(np.arange(num_edges))
+        self.dist = np.zeros(graph.num_nodes)
+        self.pred = np.full(graph.num_nodes, -1, dtype=np.int64)
+        self.cycles: List[ArbitrageCycle] = []
+
+    def _set_arc_weights(self, edges: np.ndarray):
+        """
+        Recompute the weights of both arcs of some edges
+        """
+        num_edges = self.graph.num_edges
+        data = self.graph.edge_data
+        rate = data["rate"][edges].astype(np.float64)
+        fee = np.nan_to_num(data["fee"][edges].astype(np.float64)) * self.fee_scale
+        valid = np.isfinite(rate) & (rate > 0) & (fee < 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_rate = np.where(valid, np.log(np.where(valid, rate, 1)), 0.0)
+            log_keep = np.log1p(-np.clip(fee, 0, 1))
+        self.weights[edges] = np.where(valid, -log_rate - log_keep, np.inf)
+        self.weights[edges + num_edges] = np.where(valid, log_rate - log_keep, np.inf)
+
+    def run(self) -> List[ArbitrageCycle]:
+        """
+        Full batched Bellman-Ford pass from a virtual source connected to every node
+        Returns:
+            The profitable cycles found, best first
+        """
+        num_nodes = self.graph.num_nodes
+        self.dist = np.zeros(num_nodes)
+        self.pred = np.full(num_nodes, -1, dtype=np.int64)
+        usable = np.isfinite(self.weights)
+        src, dst, w = self.arc_src[usable], self.arc_dst[usable], self.weights[usable]
+        arcs = np.flatnonzero(usable)
+        for rounds in range(1, num_nodes + 1):
+            cand = self.dist[src] + w
+            order = np.lexsort((cand, dst))
+            sorted_dst = dst[order]
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = sorted_dst[1:] != sorted_dst[:-1]
+            best = order[first]
+            improved = cand[best] < self.dist[dst[best]] - 1e-12
+            if not improved.any():
+                break
+            nodes = dst[best][improved]
+            self.dist[nodes] = cand[best][improved]
+            self.pred[nodes] = arcs[best][improved]
+            if rounds % self.check_every == 0 and len(self._cycle_nodes()):
+                break
+        self.cycles = self._collect_cycles()
+        return self.cycles
+
+    def update(self, edges) -> List[ArbitrageCycle]:
+        """
+        Patch the arcs of some edges after their rate or fee changed and relax only from the
+        touched nodes
+        Args:
+            edges: The ids of the changed edges
+        Returns:
+            The profitable cycles found, best first
+        """
+        edges = np.unique(np.asarray(edges, dtype=np.int64))
+        num_edges = self.graph.num_edges
+        arcs = np.concatenate([edges, edges + num_edges])
+        old = self.weights[arcs].copy()
+        self._set_arc_weights(edges)
+        new = self.weights[arcs]
+
+        # labels that were built on an arc that got more expensive are no longer valid,
+        # reset the whole pred subtree below such arcs to the virtual source
+        roots = np.flatnonzero(np.isin(self.pred, arcs[new > old])).tolist()
+        reset: Set[int] = set()
+        if roots:
+            children = {}
+            for node, arc in enumerate(self.pred.tolist()):
+                if arc >= 0:
+                    children.setdefault(int(self.arc_src[arc]), []).append(node)
+            stack = roots
+            while stack:
+                node = stack.pop()
+                if node not in reset:
+                    reset.add(node)
+                    stack.extend(children.get(node, []))
+            reset_ids = np.fromiter(reset, dtype=np.int64)
+            self.dist[reset_ids] = 0.0
+            self.pred[reset_ids] = -1
+
+        indptr, indices, _ = self.graph.adjacency()
+        seeds = set(self.arc_src[arcs].tolist())
+        for node in reset:
+            seeds.update(indices[indptr[node] : indptr[node + 1]])
+        self._spfa(seeds)
+        self.cycles = self._collect_cycles()
+        return self.cycles
+
+    def _spfa(self, seeds):
+        """
+        Queue-based relaxation from the seed nodes, stopping once a cycle shows up in the
+        pred graph
+        """
+        indptr, indices, slot_edge = self.graph.adjacency()
+        num_edges, num_nodes = self.graph.num_edges, self.graph.num_nodes
+        u = self.graph.u.tolist()
+        weights = self.weights.tolist()
+        dist = self.dist.tolist()
+        pred = self.pred.tolist()
+        queue = deque(sorted(seeds))
+        queued = set(queue)
+        relaxed = 0
+        while queue:
+            node = queue.popleft()
+            queued.discard(node)
+            for slot in range(indptr[node], indptr[node + 1]):
+                e, nbr = slot_edge[slot], indices[slot]
+                arc = e if u[e] == node else e + num_edges
+                nd = dist[node] + weights[arc]
+                if nd < dist[nbr] - 1e-12:
+                    dist[nbr], pred[nbr] = nd, arc
+                    relaxed += 1
+                    if nbr not in queued:
+                        queue.append(nbr)
+                        queued.add(nbr)
+            if relaxed >= num_nodes:
+                relaxed = 0
+                self.dist[:], self.pred[:] = dist, pred
+                if len(self._cycle_nodes()):
+                    return
+        self.dist[:], self.pred[:] = dist, pred
+
+    def _cycle_nodes(self) -> np.ndarray:
+        """
+        One node on every cycle of the pred graph, found by pointer jumping
+        """
+        num_nodes = self.graph.num_nodes
+        parent = np.where(self.pred >= 0, self.arc_src[np.maximum(self.pred, 0)], -1)
+        has_parent = parent >= 0
+        jump = np.where(has_parent, parent, np.arange(num_nodes))
+        for _ in range(max(1, int(np.ceil(np.log2(num_nodes + 1)))) + 1):
+            jump = jump[jump]
+        # after enough jumps every node that reaches a cycle lands on it
+        landed = np.unique(jump[has_parent])
+        return landed[has_parent[landed]]
+
+    def _collect_cycles(self) -> List[ArbitrageCycle]:
+        """
+        Walk the cycles of the pred graph and keep the ones that are profitable with the
+        current weights
+        """
+        cycles, seen = [], set()
+        pred = self.pred.tolist()
+        for start in self._cycle_nodes().tolist():
+            arcs, node, visited = [], start, set()
+            while node not in visited:
+                visited.add(node)
+                arc = pred[node]
+                if arc < 0:
+                    break
+                arcs.append(arc)
+                node = int(self.arc_src[arc])
+            if node != start or not arcs:
+                continue
+            arcs = arcs[::-1]
+            key = frozenset(arcs)
+            total = float(self.weights[arcs].sum())
+            if key in seen or not total < -1e-12:
+                continue
+            seen.add(key)
+            nodes = [int(self.arc_src[a]) for a in arcs] + [start]
+            edges = self.arc_edge[arcs].tolist()
+            cycles.append(ArbitrageCycle(nodes, edges, float(np.expm1(-total))))
+        return sorted(cycles, key=lambda c: c.profit, reverse=True)
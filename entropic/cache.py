@@ -0,0 +1,252 @@
+# %%
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional
+import numpy as np
+from entropic.liquidity import exchange_fit_params_batch
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with an optional time to live.
+    Counts hits, misses and evictions (entries dropped because the cache was full or
+    because they expired).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: Maximum number of entries kept
+            ttl: Number of seconds an entry stays valid, None to keep entries until evicted
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and not self._expired(item)
+
+    def _expired(self, item: tuple) -> bool:
+        return item[1] is not None and item[1] <= time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Look up a key, marking it as recently used
+        Args:
+            key: The key
+            default: Returned when the key is missing or expired
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        if self._expired(item):
+            del self._data[key]
+            self.evictions += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Store a value, evicting the least recently used entries if the cache is full
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """
+        Drop every entry for which predicate(key, value) is True
+        Returns:
+            The number of entries dropped
+        """
+        stale = [k for k, (value, _) in self._data.items() if predicate(k, value)]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+
+    def clear(self):
+        self._data.clear()
+
+    def values(self) -> list:
+        """
+        The values of the entries that have not expired, without marking them as used
+        """
+        return [
+            value
+            for value, expires in self._data.values()
+            if not self._expired((value, expires))
+        ]
+
+    @property
+    def stats(self) -> dict:
+        """
+        The cache counters along with the current size and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def grid_hash(x) -> str:
+    """
+    A short digest of the values of an amount grid
+    """
+    data = np.ascontiguousarray(x, dtype=np.float64)
+    return hashlib.sha1(data.tobytes()).hexdigest()[:16]
+
+
+class FitCache:
+    """
+    Memoizes the (A, B, C, D) parameters of exchange curve fits.
+    The fit of y = A * sqrt(B * x + C) + D to an exchange curve scales exactly with liq2 (A
+    and D are proportional to it), so entries are stored for liq2 = 1 and keyed by the grid
+    hash and liq1 quantized on a log scale: liquidities within a relative tolerance share
+    an entry, fitted at the centre of their bucket. Misses are fitted together with one call
+    to the fitter.
+    The entries live in a bounded LRUCache and can be saved to, and loaded back from, an npz
+    file so that they survive restarts.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100_000,
+        rel_tol: float = 1e-3,
+        path=None,
+        fitter: Callable = exchange_fit_params_batch,
+    ):
+        """
+        Args:
+            maxsize: Maximum number of fits kept in memory
+            rel_tol: Relative width of the liq1 buckets
+            path: An npz file the entries are loaded from if it exists and saved to by save()
+            fitter: Called as fitter(x, liq1, liq2) with arrays of liquidities, returns the
+                (n, 4) parameters and the fit errors like exchange_fit_params_batch
+        """
+        if rel_tol <= 0:
+            raise ValueError("rel_tol must be positive")
+        self.rel_tol = rel_tol
+        self.path = None if path is None else Path(path)
+        self.fitter = fitter
+        self.fits = 0
+        self._step = np.log1p(rel_tol)
+        self._cache = LRUCache(maxsize)
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def _buckets(self, liq1: np.ndarray) -> np.ndarray:
+        return np.round(np.log(liq1) / self._step).astype(np.int64)
+
+    def params(self, x, liq1, liq2) -> np.ndarray:
+        """
+        The fit parameters of the exchange curves of some pools on an amount grid
+        Args:
+            x: The amounts the fit is made on
+            liq1: The liquidity of the source asset of each pool, a float or an array
+            liq2: The liquidity of the destination asset of each pool
+        Returns:
+            The (n, 4) matrix of A, B, C, D
+        """
+        liq1 = np.atleast_1d(np.asarray(liq1, dtype=np.float64))
+        liq2 = np.atleast_1d(np.asarray(liq2, dtype=np.float64))
+        liq1, liq2 = np.broadcast_arrays(liq1, liq2)
+        if np.any(liq1 <= 0):
+            raise ValueError("Liquidities must be positive")
+        digest = grid_hash(x)
+        buckets = self._buckets(liq1)
+        unit = np.empty((len(liq1), 4))
+        missing = {}
+        for i, bucket in enumerate(buckets.tolist()):
+            found = self._cache.get((digest, bucket))
+            if found is None:
+                missing.setdefault(bucket, []).append(i)
+            else:
+                unit[i] = found
+        if missing:
+            keys = list(missing)
+            centres = np.exp(np.array(keys) * self._step)
+            fitted, _ = self.fitter(x, centres, np.ones_like(centres))
+            self.fits += len(keys)
+            for bucket, row in zip(keys, fitted):
+                self._cache.put((digest, bucket), row)
+                unit[missing[bucket]] = row
+        scale = np.column_stack([liq2, np.ones_like(liq2), np.ones_like(liq2), liq2])
+        return unit * scale
+
+    @property
+    def stats(self) -> dict:
+        """
+        The counters of the in-memory cache and the number of fits made
+        """
+        return {**self._cache.stats, "fits": self.fits}
+
+    def _file(self, path) -> Path:
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given here or when the FitCache was made")
+        return Path(path)
+
+    def save(self, path=None):
+        """
+        Write the cached fits to an npz file
+        Args:
+            path: The file, the one given at construction by default
+        """
+        path = self._file(path)
+        items = [(key, value[0]) for key, value in self._cache._data.items()]
+        params = np.array([row for _, row in items], dtype=np.float64).reshape(-1, 4)
+        # through a file handle, np.savez would otherwise add .npz to the name
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                rel_tol=self.rel_tol,
+                grids=np.array([key[0] for key, _ in items], dtype="U16"),
+                buckets=np.array([key[1] for key, _ in items], dtype=np.int64),
+                params=params,
+            )
+
+    def load(self, path=None) -> int:
+        """
+        Add the fits of an npz file written by save, skipping it if it was made with a
+        different tolerance
+        Returns:
+            The number of fits loaded
+        """
+        path = self._file(path)
+        with np.load(path) as data:
+            if not np.isclose(float(data["rel_tol"]), self.rel_tol):
+                _logger.warning(f"Ignoring {path}, it was saved with another rel_tol")
+                return 0
+            buckets = data["buckets"].tolist()
+            for digest, bucket, row in zip(
+                data["grids"].tolist(), buckets, data["params"]
+            ):
+                self._cache.put((digest, bucket), row)
+        return len(buckets)
@@ -1,11 +1,26 @@
 # %%
-from itertools import islice
 import logging
-from typing import Callable
+from typing import Callable, Dict, List, Optional, Tuple
 import networkx as nx
+import numpy as np
 from monty.json import MSONable
 from monty.serialization import loadfn
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from entropic.arbitrage import ArbitrageCycle, ArbitrageDetector
+from entropic.flow import EdgeFlow, edge_flow_model
+from entropic.cache import LRUCache
+from entropic.graph import ChainIndex, CSRGraph
+from entropic.loaders import (
+    graph_from_lists,
+    graph_from_rows,
+    is_row_format,
+    load_graph,
+    load_rows,
+)
+from entropic.overlay import ChainOverlay
+from entropic.routing import AmountRoute, AmountRouter, Quote, Router
+from entropic.snapshot import load_snapshot, save_snapshot
+from entropic.paths import PathEngine, RouteIndex, k_shortest_paths_batch
 
 __author__ = "jmmshn" "Ajk009"
 
@@ -15,59 +30,542 @@ _logger = logging.getLogger(__name__)
 @dataclass
 class DEXA(MSONable):
     """
-    DEX Aggregator Represented as a graph
+    DEX Aggregator Represented as a graph.
+    The graph is either held as a nx.Graph or, for large graphs, as an array-backed CSRGraph.
+    Results of get_pathways are kept in route_cache, which can be replaced by an LRUCache
+    with a different size or time to live.
     """
 
-    graph: nx.Graph
+    graph: Optional[nx.Graph] = None
+    csr: Optional[CSRGraph] = None
+    liq_frac: float = 1
+    settings: Optional[dict] = None
+    _nx_view: Optional[CSRGraph] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    route_cache: LRUCache = field(
+        default_factory=LRUCache, init=False, repr=False, compare=False
+    )
+    _engines: Dict[Optional[str], PathEngine] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _indexes: Dict[Optional[str], RouteIndex] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _overlays: Dict[Optional[str], ChainOverlay] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _amount_routers: Dict[float, AmountRouter] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _routers: Dict[tuple, Router] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _weight_funcs: Dict[str, Tuple[Callable, bool]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _arbitrage: Optional[ArbitrageDetector] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _arbitrage_dirty: set = field(
+        default_factory=set, init=False, repr=False, compare=False
+    )
+    _version: int = field(default=0, init=False, repr=False, compare=False)
 
     @classmethod
-    def from_list(cls, edge_list, node_list) -> "DEXA":
+    def from_list(cls, edge_list, node_list, backend="networkx", liq_frac=1) -> "DEXA":
         """
         Creates a graph from a list of dicts
         Args:
             edge_list: A list of dicts, each dict representing an edge
             node_list: A list of dicts, each dict representing a node
+            backend: "networkx" for a nx.Graph or "csr" for the compact array-backed graph
+            liq_frac: The fraction of liquidity allowed to be moved through each edge
         Returns:
             A instance of DEXA
         """
-        graph = nx.Graph()
-        for edge_dict in edge_list:
-            # make sure the original data is preserved
-            edge_kwargs = edge_dict.copy()
-            edge_kwargs.pop("u")
-            edge_kwargs.pop("v")
-            graph.add_edge(edge_dict["u"], edge_dict["v"], **edge_kwargs)
-
-        for node_dict in node_list:
-            graph.nodes[node_dict["name"]].update(node_dict)
-        for u, v, d in graph.edges(data=True):
-            d["source_liquidity"] = graph.nodes[u].get("liquidity", 0)
-            d["target_liquidity"] = graph.nodes[v].get("liquidity", 0)
-        return cls(graph)
+        graph = graph_from_lists(
+            edge_list, node_list, liq_frac=liq_frac, backend=backend
+        )
+        if backend == "csr":
+            return cls(csr=graph, liq_frac=liq_frac)
+        return cls(graph, liq_frac=liq_frac)
 
     @classmethod
-    def from_file(cls, filename, liq_frac=1):
+    def from_rows(cls, rows, settings=None, liq_frac=1) -> "DEXA":
         """
-        Creates a graph from a file
+        Creates a graph from (venue, source, destination, speed, fee, liquidity, rate) pool
+        rows, see entropic.loaders.graph_from_rows. Parallel pools are kept as separate
+        edges, so the array-backed backend is always used.
+        Args:
+            rows: The pool rows
+            settings: The settings block classifying the chains, DEXs and bridges
+            liq_frac: The fraction of liquidity allowed to be moved through each edge
+        Returns:
+            A instance of DEXA
+        """
+        graph = graph_from_rows(rows, settings, liq_frac=liq_frac)
+        return cls(csr=graph, liq_frac=liq_frac, settings=settings)
+
+    @classmethod
+    def from_file(cls, filename, liq_frac=1, backend="networkx"):
+        """
+        Creates a graph from a file with either "edges" and "nodes" lists or the
+        "settings" and "data" rows written by scripts/generate_test_data.py, the latter
+        always being loaded with the array-backed backend (see from_rows).
+        JSON files, compressed or not, are streamed so that only one edge, node or row is
+        decoded at a time.
         Args:
             filename: A filename
             liq_frac: The fraction of liquidity allowed to be moved through each edge
+            backend: "networkx" for a nx.Graph or "csr" for the compact array-backed graph
         Returns:
             A graph
         """
-        full_data = loadfn(filename)
-        return cls.from_list(full_data["edges"], full_data["nodes"])
+        if ".json" not in str(filename).lower():
+            full_data = loadfn(filename)
+            if "data" in full_data:
+                return cls.from_rows(
+                    full_data["data"], full_data.get("settings"), liq_frac=liq_frac
+                )
+            return cls.from_list(
+                full_data["edges"],
+                full_data["nodes"],
+                backend=backend,
+                liq_frac=liq_frac,
+            )
+        if is_row_format(filename):
+            graph, settings = load_rows(filename, liq_frac=liq_frac)
+            return cls(csr=graph, liq_frac=liq_frac, settings=settings)
+        graph = load_graph(filename, liq_frac=liq_frac, backend=backend)
+        if backend == "csr":
+            return cls(csr=graph, liq_frac=liq_frac)
+        return cls(graph, liq_frac=liq_frac)
+
+    def save_snapshot(self, path):
+        """
+        Save the graph as a binary snapshot that load_snapshot opens without parsing,
+        see entropic.snapshot
+        Args:
+            path: The snapshot directory
+        """
+        save_snapshot(
+            self._view(), path, {"liq_frac": self.liq_frac, "settings": self.settings}
+        )
+
+    @classmethod
+    def load_snapshot(cls, path, mmap=True) -> "DEXA":
+        """
+        Open a snapshot written by save_snapshot. The graph is always loaded with the
+        array-backed backend, use to_networkx for a nx.Graph.
+        Args:
+            path: The snapshot directory
+            mmap: Memory-map the arrays so that processes share them through the page cache
+        Returns:
+            A instance of DEXA
+        """
+        graph, metadata = load_snapshot(path, mmap=mmap)
+        return cls(
+            csr=graph,
+            liq_frac=metadata.get("liq_frac", 1),
+            settings=metadata.get("settings"),
+        )
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        Get the graph as a nx.Graph, regardless of the backend used
+        """
+        if self.graph is not None:
+            return self.graph
+        return self.csr.to_networkx()
+
+    def _view(self) -> CSRGraph:
+        """
+        The CSRGraph used by the path searches, built once from the nx.Graph if needed
+        """
+        if self.csr is not None:
+            return self.csr
+        if self._nx_view is None:
+            self._nx_view = CSRGraph.from_networkx(self.graph)
+        return self._nx_view
+
+    def _engine(self, weight: Optional[str]) -> PathEngine:
+        """
+        The k-shortest-paths engine for a weight column, reused until the weights change
+        """
+        engine = self._engines.get(weight)
+        if engine is None:
+            view = self._view()
+            engine = self._engines[weight] = PathEngine(view, view.edge_weights(weight))
+        return engine
 
-    def assign_weight(self, weight_func: Callable):
+    def assign_weight(self, weight_func: Callable, name="weight", vectorized=False):
         """
         Assigns a weight to each edge in the graph using the available fee and liquidity data
         Args:
-            weight_func: A function that takes a fee and 1/liquidity and returns a weight
+            weight_func: A function that takes a fee and 1/liquidity and returns a weight.
+                It is called once per edge with the dict of edge attributes, or once in total
+                with a dict of NumPy columns (fee, source_liquidity, target_liquidity, rate, ...)
+                when vectorized is True, in which case it must return an array of weights.
+            name: The edge attribute the weights are stored under, several weighting schemes
+                can be kept side by side and picked with the weight argument of get_pathways
+            vectorized: Whether weight_func works on whole columns
+        """
+        view = self._view()
+        if vectorized:
+            weights = self._vector_weights(weight_func, view.edge_data)
+        elif self.graph is not None:
+            weights = [weight_func(d) for _, _, d in self.graph.edges(data=True)]
+        else:
+            weights = [weight_func(d) for d in view.iter_edge_dicts()]
+        view.edge_data[name] = np.asarray(weights, dtype=np.float64)
+        if self.graph is not None:
+            for (_, _, d), w in zip(
+                self.graph.edges(data=True), view.edge_data[name].tolist()
+            ):
+                d[name] = w
+        self._weight_funcs[name] = (weight_func, vectorized)
+        self._engines.pop(name, None)
+        # routers hold on to the engine of their weight
+        for key in [key for key in self._routers if key[0] == name]:
+            del self._routers[key]
+        self.invalidate_routes()
+        if name in self._indexes:
+            self.build_route_index(name)
+        if name in self._overlays:
+            self.build_overlay(name)
+
+    def _vector_weights(self, weight_func: Callable, columns: dict) -> np.ndarray:
+        size = len(next(iter(columns.values()))) if columns else 0
+        weights = np.asarray(weight_func(columns), dtype=np.float64)
+        return np.broadcast_to(weights, (size,)).copy()
+
+    def build_route_index(self, weight="weight", workers=None) -> RouteIndex:
+        """
+        Precompute the distances and next hops between all pairs of nodes, after which
+        get_pathways answers single path queries by table lookup. The index is kept up to
+        date by update_edges and update_nodes.
+        Args:
+            weight: The edge attribute used as path cost
+            workers: Number of processes used for the build, None to build in process
+        Returns:
+            The RouteIndex
+        """
+        index = RouteIndex.build(self._engine(weight).matrix, workers=workers)
+        self._indexes[weight] = index
+        return index
+
+    def build_overlay(self, weight="weight") -> ChainOverlay:
+        """
+        Precompute the best intra-chain paths between the bridge endpoints of every chain,
+        after which get_pathways(..., hierarchical=True) searches the much smaller overlay
+        of bridge endpoints. The overlay is kept up to date by update_edges and update_nodes,
+        a change inside one chain only recomputes that chain.
+        Args:
+            weight: The edge attribute used as path cost
+        Returns:
+            The ChainOverlay
+        """
+        view = self._view()
+        overlay = ChainOverlay(view, view.edge_weights(weight))
+        self._overlays[weight] = overlay
+        return overlay
+
+    def _edge_attrs(self, e: int) -> dict:
+        """
+        The attribute dict of an edge of the CSR view, as passed to the weight functions
+        """
+        view = self._view()
+        if self.csr is not None:
+            return view.edge_dict(e)
+        return self.graph.edges[view.nodes[view.u[e]], view.nodes[view.v[e]]]
+
+    def _set_edge_attr(self, e: int, key: str, value):
+        view = self._view()
+        view.set_edge_value(e, key, value)
+        if self.graph is not None:
+            self.graph.edges[view.nodes[view.u[e]], view.nodes[view.v[e]]][key] = value
+
+    def update_edges(self, batch):
+        """
+        Patch the attributes of existing edges in place. Only the weights of the touched edges
+        are recomputed and the cached shortest-path trees are repaired instead of rebuilt.
+        Args:
+            batch: A list of dicts with the "u" and "v" of an edge and the attributes to change.
+                For graphs with parallel edges an "edge" id selects a single one of them.
+        """
+        view = self._view()
+        touched, columns = set(), set()
+        for edge_dict in batch:
+            attrs = {
+                k: val for k, val in edge_dict.items() if k not in ("u", "v", "edge")
+            }
+            if "edge" in edge_dict:
+                edges = [edge_dict["edge"]]
+            else:
+                edges = view.edge_ids(*view.ids([edge_dict["u"], edge_dict["v"]]))
+            if not edges:
+                raise KeyError(f"No edge between {edge_dict['u']} and {edge_dict['v']}")
+            for e in edges:
+                for key, value in attrs.items():
+                    self._set_edge_attr(e, key, value)
+            touched.update(edges)
+            columns.update(attrs)
+        self._reweight(sorted(touched), columns)
+
+    def update_nodes(self, batch):
+        """
+        Patch the attributes of existing nodes in place. A change of liquidity, scaled by
+        liq_frac, is copied onto the source_liquidity and target_liquidity of the incident
+        edges only.
+        Args:
+            batch: A list of dicts with the "name" of a node and the attributes to change
+        """
+        view = self._view()
+        touched = set()
+        for node_dict in batch:
+            (i,) = view.ids([node_dict["name"]])
+            for key, value in node_dict.items():
+                if key == "name":
+                    continue
+                view.set_node_value(i, key, value)
+                if self.graph is not None:
+                    self.graph.nodes[node_dict["name"]][key] = value
+            if "liquidity" not in node_dict:
+                continue
+            liquidity = node_dict["liquidity"] * self.liq_frac
+            for e in view.incident_edges(i).tolist():
+                if view.u[e] == i:
+                    self._set_edge_attr(e, "source_liquidity", liquidity)
+                if view.v[e] == i:
+                    self._set_edge_attr(e, "target_liquidity", liquidity)
+                touched.add(e)
+        self._reweight(sorted(touched), {"source_liquidity", "target_liquidity"})
+
+    def _reweight(self, edges, columns):
+        """
+        Recompute the weights of some edges after their attributes changed, then repair the
+        path engines and drop the cached routes that may have changed.
+        Args:
+            edges: The ids of the changed edges
+            columns: The names of the changed attributes
+        """
+        if not edges:
+            return
+        view = self._view()
+        columns = set(columns)
+        if self._arbitrage is not None:
+            self._arbitrage_dirty.update(edges)
+        self._amount_routers.clear()
+        self._routers.clear()
+        for name, (weight_func, vectorized) in self._weight_funcs.items():
+            if vectorized:
+                weights = self._vector_weights(
+                    weight_func, {k: col[edges] for k, col in view.edge_data.items()}
+                ).tolist()
+            else:
+                weights = [weight_func(self._edge_attrs(e)) for e in edges]
+            for e, w in zip(edges, weights):
+                self._set_edge_attr(e, name, w)
+            columns.add(name)
+        increased, decreased = [], False
+        for name, overlay in self._overlays.items():
+            if name not in columns:
+                continue
+            weights = view.edge_weights(name)[edges]
+            old_weights = overlay.weights[edges]
+            overlay.update(edges, weights)
+            # hierarchical routes are cached without a path engine to report the changes
+            for e, old, new in zip(edges, old_weights.tolist(), weights.tolist()):
+                if new != old:
+                    increased.append((view.nodes[view.u[e]], view.nodes[view.v[e]]))
+                    decreased = decreased or new < old
+        for name, engine in self._engines.items():
+            if name not in columns:
+                continue
+            changes = engine.update_weights(edges, view.edge_weights(name)[edges])
+            if name in self._indexes:
+                self._indexes[name].update(changes)
+            for a, b, old, new in changes:
+                increased.append((view.nodes[a], view.nodes[b]))
+                decreased = decreased or new < old
+        self.invalidate_routes(None if decreased else increased)
+
+    def find_arbitrage_cycles(self, fee_scale=1.0, incremental=True):
+        """
+        Find loops of swaps whose exchange rates multiply to more than one after fees, using
+        negative-cycle detection on -log(rate * (1 - fee)). The first call runs a full
+        batched Bellman-Ford pass; later calls only relax from the edges changed by
+        update_edges and update_nodes since the previous call.
+        Args:
+            fee_scale: Multiplies the fee to get a fraction, e.g. 1e-4 for basis points
+            incremental: Reuse the previous pass, set to False to force a full pass
+        Returns:
+            A list of ArbitrageCycle, most profitable first
+        """
+        view = self._view()
+        detector = self._arbitrage
+        if detector is None or detector.fee_scale != fee_scale or not incremental:
+            detector = self._arbitrage = ArbitrageDetector(view, fee_scale=fee_scale)
+            detector.run()
+        elif self._arbitrage_dirty:
+            detector.update(sorted(self._arbitrage_dirty))
+        self._arbitrage_dirty.clear()
+        return [
+            ArbitrageCycle(view.names(c.nodes), c.edges, c.profit)
+            for c in detector.cycles
+        ]
+
+    def best_routes_for_amount(
+        self, source, target, amount, k=1, fee_scale=1.0, max_hops=None
+    ) -> List[AmountRoute]:
+        """
+        Find the paths that deliver the most of the target asset for an amount of the source
+        asset, composing exchange_function pool by pool, instead of the cheapest paths by an
+        additive weight. See entropic.routing.AmountRouter for the search.
+        Args:
+            source: The source node
+            target: The target node
+            amount: The amount of the source asset to swap
+            k: Total number of paths to report
+            fee_scale: Multiplies the fee to get a fraction, e.g. 1e-4 for basis points
+            max_hops: The maximum number of pools on a path, None for no limit
+        Returns:
+            A list of AmountRoute with node names, highest output first
+        """
+        view = self._view()
+        router = self._amount_routers.get(fee_scale)
+        if router is None:
+            router = self._amount_routers[fee_scale] = AmountRouter(view, fee_scale)
+        source_id, target_id = view.ids([source, target])
+        routes = router.best_routes(source_id, target_id, amount, k, max_hops=max_hops)
+        return [AmountRoute(view.names(r.nodes), r.edges, r.amount_out) for r in routes]
+
+    def quote(
+        self, source, target, amount, k=3, weight="weight", fee_scale=1.0
+    ) -> Quote:
+        """
+        Quote a swap end to end: find the k shortest paths, collapse each into one pool,
+        split the amount over them and estimate the output, see entropic.routing.Router
+        Args:
+            source: The source node
+            target: The target node
+            amount: The amount of the source asset to swap
+            k: Total number of paths to split over
+            weight: The edge attribute used as path cost, see get_pathways
+            fee_scale: Multiplies the fee to get a fraction, e.g. 1e-4 for basis points
+        Returns:
+            A Quote with node names and the time spent in each stage
+        """
+        view = self._view()
+        router = self._routers.get((weight, fee_scale))
+        if router is None:
+            router = Router(self._engine(weight), fee_scale)
+            self._routers[(weight, fee_scale)] = router
+        source_id, target_id = view.ids([source, target])
+        quote = router.quote(source_id, target_id, amount, k)
+        quote.nodes = [view.names(ip) for ip in quote.nodes]
+        return quote
+
+    def optimize_flow(
+        self, source, target, amount, k=3, weight="weight", fee_scale=1.0, solver=None
+    ) -> EdgeFlow:
+        """
+        Route an amount through the pools of the k shortest paths as one flow problem, so
+        that paths sharing a pool share its liquidity, see entropic.flow.edge_flow_model
+        Args:
+            source: The source node
+            target: The target node
+            amount: The amount of the source asset to swap
+            k: Number of candidate paths whose pools are used
+            weight: The edge attribute used as path cost, see get_pathways
+            fee_scale: Multiplies the fee to get a fraction, e.g. 1e-4 for basis points
+            solver: The cvxpy solver, None for the cvxpy default
+        Returns:
+            An EdgeFlow with node names as tails and heads
         """
-        for _, _, d in self.graph.edges(data=True):
-            d["weight"] = weight_func(d)
+        view = self._view()
+        paths = [view.ids(ip) for ip in self.get_pathways(source, target, k, weight)]
+        if not paths:
+            raise ValueError(f"No path between {source} and {target}")
+        flow = edge_flow_model(view, paths, amount, fee_scale=fee_scale, solver=solver)
+        flow.tails = view.names(flow.tails)
+        flow.heads = view.names(flow.heads)
+        return flow
 
-    def get_pathways(self, source, target, num_of_paths):
+    def invalidate_routes(self, edges=None):
+        """
+        Drop cached results of get_pathways after the edge weights changed.
+        Only routes that use one of the given edges are dropped, which is enough when the
+        weights of those edges went up. When weights went down any route can change, so
+        leave edges as None to bump the graph version and drop everything.
+        Args:
+            edges: A list of (u, v) node pairs whose weights increased
+        """
+        if edges is None:
+            self._version += 1
+            self.route_cache.invalidate(lambda key, _: key[-1] != self._version)
+            return
+        changed = {frozenset(pair) for pair in edges}
+        self.route_cache.invalidate(lambda _, value: not changed.isdisjoint(value[1]))
+
+    def chain_index(self) -> ChainIndex:
+        """
+        The integer chain and token ids of the nodes, see entropic.graph.ChainIndex
+        """
+        return self._view().chain_index()
+
+    def nodes_on_chain(self, chain: str) -> List[str]:
+        """
+        The nodes living on a chain
+        Args:
+            chain: The chain name
+        Returns:
+            The node names
+        """
+        view = self._view()
+        return view.names(view.chain_index().chain_nodes(chain))
+
+    def token_instances(self, token: str) -> List[str]:
+        """
+        The nodes holding a token, one per chain it lives on
+        """
+        view = self._view()
+        return view.names(view.chain_index().token_nodes(token))
+
+    def bridge_edges(self) -> List[Tuple[str, str]]:
+        """
+        The edges flagged isBridge or joining two chains, one entry per parallel edge
+        """
+        view = self._view()
+        edges = view.chain_index().bridge_edges
+        return list(zip(view.names(view.u[edges]), view.names(view.v[edges])))
+
+    def chain_of(self, names) -> List[Optional[str]]:
+        """
+        The chain of some nodes
+        Args:
+            names: The node names
+        Returns:
+            The chain names, None where unknown
+        """
+        view = self._view()
+        return view.chain_index().chain_of(view.ids(names))
+
+    def token_of(self, names) -> List[str]:
+        """
+        The token held by some nodes, the node name without its chain prefix
+        Args:
+            names: The node names
+        Returns:
+            The token names
+        """
+        view = self._view()
+        return view.chain_index().token_of(view.ids(names))
+
+    def get_pathways(
+        self, source, target, num_of_paths, weight="weight", hierarchical=False
+    ):
         """
         Find the list the shortest path between two nodes. If liquidity is exhausted then look
         for the next shortest path.
@@ -75,13 +573,74 @@ class DEXA(MSONable):
             source: The source node
             target: The target node
             num_of_paths: Total number of paths to report
+            weight: The edge attribute used as path cost, edges without it count as 1.
+                Use None to count hops.
+            hierarchical: Search the chain overlay (see build_overlay, built on first use)
+                instead of the whole graph
         Returns:
             A list of nodes representing the shortest path
         """
+        key = (source, target, num_of_paths, weight, self._version)
+        if hierarchical:
+            key = key[:-1] + ("hierarchical", self._version)
+        cached = self.route_cache.get(key)
+        if cached is None:
+            view = self._view()
+            source_id, target_id = view.ids([source, target])
+            if hierarchical:
+                overlay = self._overlays.get(weight) or self.build_overlay(weight)
+                paths = overlay.k_shortest_paths(source_id, target_id, num_of_paths)
+            elif num_of_paths == 1 and weight in self._indexes:
+                best = self._indexes[weight].path(source_id, target_id)
+                paths = [] if best is None else [best]
+            else:
+                paths = self._engine(weight).k_shortest_paths(
+                    source_id, target_id, num_of_paths
+                )
+            cached = self._cache_routes(key, [view.names(ip) for ip in paths])
+        return [list(ip) for ip in cached[0]]
 
-        def k_shortest_paths(G, source, target, k, weight=None):
-            return list(
-                islice(nx.shortest_simple_paths(G, source, target, weight=weight), k)
+    def get_pathways_batch(self, queries, workers=None, weight="weight"):
+        """
+        Find the shortest paths for many (source, target, num_of_paths) queries at once.
+        Queries that share a source are solved together from a single shortest-path tree and
+        the groups can be spread over a process pool that receives the graph once per worker.
+        Args:
+            queries: A list of (source, target, num_of_paths) tuples
+            workers: Number of processes, None to solve the queries in process
+            weight: The edge attribute used as path cost, see get_pathways
+        Returns:
+            The list of paths of every query, in the order of the queries
+        """
+        results = [None] * len(queries)
+        groups: Dict[str, list] = {}
+        for i, (source, target, num_of_paths) in enumerate(queries):
+            cached = self.route_cache.get(
+                (source, target, num_of_paths, weight, self._version)
             )
+            if cached is not None:
+                results[i] = [list(ip) for ip in cached[0]]
+            else:
+                groups.setdefault(source, []).append((i, target, num_of_paths))
 
-        return k_shortest_paths(self.graph, source, target, num_of_paths)
+        view = self._view()
+        tasks = [
+            (view.node_index[source], [(view.node_index[t], k) for _, t, k in items])
+            for source, items in groups.items()
+        ]
+        outputs = k_shortest_paths_batch(self._engine(weight), tasks, workers=workers)
+        for (source, items), paths_per_query in zip(groups.items(), outputs):
+            for (i, target, num_of_paths), paths in zip(items, paths_per_query):
+                key = (source, target, num_of_paths, weight, self._version)
+                cached = self._cache_routes(key, [view.names(ip) for ip in paths])
+                results[i] = [list(ip) for ip in cached[0]]
+        return results
+
+    def _cache_routes(self, key, paths):
+        """
+        Store the paths of a query in the route cache along with the hops they use
+        """
+        hops = {frozenset(hop) for ip in paths for hop in zip(ip[:-1], ip[1:])}
+        cached = (paths, hops)
+        self.route_cache.put(key, cached)
+        return cached
@@ -0,0 +1,125 @@
+# %%
+from dataclasses import dataclass
+import logging
+from typing import List, Optional
+import cvxpy as cp
+import numpy as np
+from scipy.sparse import csr_matrix
+from entropic.graph import CSRGraph
+from entropic.liquidity import exchange_function
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EdgeFlow:
+    """
+    The optimal flow of an amount through a set of pools
+    Args:
+        edges: The pool of each arc
+        tails: The node each arc takes its input from
+        heads: The node each arc pays out to
+        inputs: The amount sent into each arc
+        outputs: The amount each arc pays out
+        amount_out: The net amount reaching the target
+    """
+
+    edges: np.ndarray
+    tails: np.ndarray
+    heads: np.ndarray
+    inputs: np.ndarray
+    outputs: np.ndarray
+    amount_out: float
+
+
+def path_arcs(graph: CSRGraph, paths: List[List[int]]) -> tuple:
+    """
+    The distinct (pool, direction) arcs used by a set of node paths, taking every parallel
+    pool of a hop
+    Returns:
+        The pool ids and whether each arc goes from u to v
+    """
+    arcs = {}
+    for path in paths:
+        for a, b in zip(path[:-1], path[1:]):
+            for e in graph.edge_ids(a, b):
+                arcs.setdefault((e, bool(graph.u[e] == a)), None)
+    edges = np.array([e for e, _ in arcs], dtype=np.int64)
+    forward = np.array([f for _, f in arcs], dtype=bool)
+    return edges, forward
+
+
+def edge_flow_model(
+    graph: CSRGraph,
+    paths: List[List[int]],
+    amount: float,
+    fee_scale: float = 1.0,
+    solver: Optional[str] = None,
+) -> EdgeFlow:
+    """
+    Route an amount through the pools of some candidate paths as a flow problem. Unlike
+    convex_model, which gives each path its own curve, every pool is one variable here, so
+    paths sharing a pool share its liquidity and the problem grows with the number of
+    distinct pools rather than with paths times hops.
+    With f_a the input of arc a and out_a = L2 - L1 * L2 / (L1 + (1 - fee) * f_a) its output
+    (concave), the problem is
+        maximize    net inflow of the target
+        subject to  N_in @ out - N_out @ f + supply >= 0
+    where N_in and N_out are the sparse node-arc incidence matrices of the arc heads and
+    tails and supply holds the amount at the source: no node passes on more than it gets.
+    Args:
+        graph: The graph, with "source_liquidity", "target_liquidity" and "fee" columns
+        paths: The candidate node paths, all from the same source to the same target
+        amount: The amount of the source asset to swap
+        fee_scale: Multiplies the fee column to get the fee as a fraction
+        solver: The cvxpy solver, None for the cvxpy default
+    Returns:
+        The EdgeFlow, with outputs recomputed exactly from the optimal inputs
+    """
+    source, target = paths[0][0], paths[0][-1]
+    edges, forward = path_arcs(graph, paths)
+    data = graph.edge_data
+    liq_u = np.nan_to_num(data["source_liquidity"].astype(np.float64))[edges]
+    liq_v = np.nan_to_num(data["target_liquidity"].astype(np.float64))[edges]
+    fee = np.nan_to_num(data["fee"].astype(np.float64))[edges] * fee_scale
+    keep = np.clip(1 - fee, 0, 1)
+    liq1 = np.where(forward, liq_u, liq_v)
+    liq2 = np.where(forward, liq_v, liq_u)
+    usable = (liq1 > 0) & (liq2 > 0) & (keep > 0)
+    edges, forward = edges[usable], forward[usable]
+    liq1, liq2, keep = liq1[usable], liq2[usable], keep[usable]
+    tails = np.where(forward, graph.u[edges], graph.v[edges])
+    heads = np.where(forward, graph.v[edges], graph.u[edges])
+
+    nodes = np.unique(np.concatenate([tails, heads, [source, target]]))
+    tail_local = np.searchsorted(nodes, tails)
+    head_local = np.searchsorted(nodes, heads)
+    n, m = len(nodes), len(edges)
+    ones = np.ones(m)
+    outgoing = csr_matrix((ones, (tail_local, np.arange(m))), shape=(n, m))
+    incoming = csr_matrix((ones, (head_local, np.arange(m))), shape=(n, m))
+    supply = np.zeros(n)
+    supply[np.searchsorted(nodes, source)] = 1.0
+
+    # in units of the amount, with each arc's output as a fraction of its reserve
+    f = cp.Variable(m, nonneg=True)
+    ratio = liq1 / amount
+    out = cp.multiply(
+        liq2 / amount, 1 - cp.multiply(ratio, cp.inv_pos(ratio + cp.multiply(keep, f)))
+    )
+    balance = incoming @ out - outgoing @ f
+    problem = cp.Problem(
+        cp.Maximize(balance[np.searchsorted(nodes, target)]),
+        [balance + supply >= 0],
+    )
+    problem.solve(solver=solver)
+    if f.value is None:
+        raise ValueError("No Feasible solution for edge flow model")
+
+    inputs = np.maximum(f.value, 0) * amount
+    outputs = exchange_function(inputs * keep, liq1, liq2)
+    received = np.bincount(heads == target, weights=outputs, minlength=2)[1]
+    spent = np.bincount(tails == target, weights=inputs, minlength=2)[1]
+    return EdgeFlow(edges, tails, heads, inputs, outputs, float(received - spent))
@@ -0,0 +1,472 @@
+# %%
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Union
+import networkx as nx
+import numpy as np
+from monty.json import MSONable
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+EDGE_COLUMNS = ("fee", "liquidity", "rate", "source_liquidity", "target_liquidity")
+
+
+def _to_column(values: list) -> np.ndarray:
+    """
+    Convert a list of attribute values into a NumPy column.
+    Missing values are stored as NaN for numeric columns, False for boolean columns
+    and None for everything else.
+    """
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (bool, np.bool_)) for v in present):
+        return np.array([bool(v) for v in values], dtype=bool)
+    if all(
+        isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_))
+        for v in present
+    ):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _set_value(columns: Dict[str, np.ndarray], size: int, index, key: str, value):
+    """
+    Write a value into a column, creating the column or widening it to an object column
+    if the value does not fit its dtype.
+    """
+    column = columns.get(key)
+    if column is None:
+        column = columns[key] = _to_column([None] * size)
+    is_bool = isinstance(value, (bool, np.bool_))
+    is_number = isinstance(value, (int, float, np.number)) and not is_bool
+    fits = (column.dtype == bool and is_bool) or (
+        column.dtype == np.float64 and (is_number or value is None)
+    )
+    if not fits and column.dtype != object:
+        column = columns[key] = column.astype(object)
+    column[index] = np.nan if value is None and column.dtype == np.float64 else value
+
+
+def _from_column(column: np.ndarray, index: int):
+    """
+    Read a single value back from a column, returning None for missing entries.
+    """
+    value = column[index]
+    if column.dtype == object:
+        return value
+    if column.dtype == np.float64 and np.isnan(value):
+        return None
+    return value.item()
+
+
+class _GraphBuilder:
+    """
+    Accumulates edges and nodes one at a time and turns them into columns.
+    Nodes get dense integer ids in order of first appearance. Each edge keeps the orientation
+    it was first given with, so directional data such as the exchange rate stays meaningful.
+    Unless parallel edges are allowed, a repeated node pair updates the existing edge the same
+    way nx.Graph.add_edge does.
+    """
+
+    def __init__(self, multi: bool = False):
+        self.multi = multi
+        self.index: Dict[str, int] = {}
+        self.u: List[int] = []
+        self.v: List[int] = []
+        self.pairs: Dict[tuple, int] = {}
+        self.edge_columns: Dict[str, list] = {}
+        self.node_columns: Dict[str, list] = {}
+
+    def node_id(self, name: str) -> int:
+        idx = self.index.get(name)
+        if idx is None:
+            idx = self.index[name] = len(self.index)
+        return idx
+
+    def add_edge(self, u: str, v: str, attrs: dict):
+        a, b = self.node_id(u), self.node_id(v)
+        pair = (a, b) if a < b else (b, a)
+        eid = None if self.multi else self.pairs.get(pair)
+        if eid is None:
+            eid = len(self.u)
+            self.u.append(a)
+            self.v.append(b)
+            self.pairs[pair] = eid
+        for key, value in attrs.items():
+            column = self.edge_columns.setdefault(key, [])
+            column.extend([None] * (len(self.u) - len(column)))
+            column[eid] = value
+
+    def add_node(self, name: str, attrs: dict):
+        idx = self.node_id(name)
+        for key, value in attrs.items():
+            if key == "name":
+                continue
+            column = self.node_columns.setdefault(key, [])
+            column.extend([None] * (len(self.index) - len(column)))
+            column[idx] = value
+
+    def build(self) -> "CSRGraph":
+        num_edges, num_nodes = len(self.u), len(self.index)
+        edge_data = {
+            k: _to_column(col + [None] * (num_edges - len(col)))
+            for k, col in self.edge_columns.items()
+        }
+        for k in EDGE_COLUMNS:
+            edge_data.setdefault(k, np.full(num_edges, np.nan))
+        node_data = {
+            k: _to_column(col + [None] * (num_nodes - len(col)))
+            for k, col in self.node_columns.items()
+        }
+        return CSRGraph(
+            nodes=list(self.index),
+            u=np.array(self.u, dtype=np.int32),
+            v=np.array(self.v, dtype=np.int32),
+            edge_data=edge_data,
+            node_data=node_data,
+            multi=self.multi,
+        )
+
+
+def _group(ids: np.ndarray, size: int):
+    """
+    Sort item positions by group id, returning the order and the CSR-style offsets of
+    each group, items with a negative id are left out
+    """
+    valid = np.flatnonzero(ids >= 0)
+    order = valid[np.argsort(ids[valid], kind="stable")]
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ids[valid], minlength=size), out=offsets[1:])
+    return order, offsets
+
+
+class ChainIndex:
+    """
+    Integer chain and token ids of every node, parsed once from "Chain:Token" node names
+    (or from the "chain" node column when present), with lookups of the nodes on a chain,
+    the instances of a token across chains and the bridge edges.
+    Bridge edges are the edges flagged isBridge and the edges joining two different chains.
+    """
+
+    def __init__(self, graph: "CSRGraph"):
+        """
+        Args:
+            graph: The graph to index
+        """
+        chain_column = graph.node_data.get("chain")
+        chain_of, token_of = [], []
+        for i, name in enumerate(graph.nodes):
+            name = str(name)
+            prefix, sep, suffix = name.partition(":")
+            chain = chain_column[i] if chain_column is not None else None
+            if chain is None or (isinstance(chain, float) and np.isnan(chain)):
+                chain = prefix if sep else None
+            chain_of.append(chain)
+            token_of.append(suffix if sep else name)
+        self.chains: List[str] = sorted({c for c in chain_of if c is not None})
+        self.tokens: List[str] = sorted(set(token_of))
+        self.chain_ids = {c: i for i, c in enumerate(self.chains)}
+        self.token_ids = {t: i for i, t in enumerate(self.tokens)}
+        self.chain_id = np.array(
+            [self.chain_ids.get(c, -1) for c in chain_of], dtype=np.int32
+        )
+        self.token_id = np.array([self.token_ids[t] for t in token_of], dtype=np.int32)
+        self._chain_order, self._chain_offsets = _group(self.chain_id, len(self.chains))
+        self._token_order, self._token_offsets = _group(self.token_id, len(self.tokens))
+        cu, cv = self.chain_id[graph.u], self.chain_id[graph.v]
+        flagged = graph.edge_data.get("isBridge")
+        if flagged is None:
+            flagged = np.zeros(graph.num_edges, dtype=bool)
+        elif flagged.dtype != bool:
+            flagged = np.array([x is True for x in flagged.tolist()], dtype=bool)
+        self.bridge_mask = flagged | ((cu != cv) & (cu >= 0) & (cv >= 0))
+        self.bridge_edges = np.flatnonzero(self.bridge_mask)
+
+    def chain_nodes(self, chain: Union[str, int]) -> np.ndarray:
+        """
+        The ids of the nodes on a chain, given by name or chain id
+        """
+        c = chain if isinstance(chain, (int, np.integer)) else self.chain_ids[chain]
+        return self._chain_order[self._chain_offsets[c] : self._chain_offsets[c + 1]]
+
+    def token_nodes(self, token: Union[str, int]) -> np.ndarray:
+        """
+        The ids of the instances of a token on every chain, given by name or token id
+        """
+        t = token if isinstance(token, (int, np.integer)) else self.token_ids[token]
+        return self._token_order[self._token_offsets[t] : self._token_offsets[t + 1]]
+
+    def chain_of(self, nodes) -> List[Optional[str]]:
+        """
+        The chain name of some nodes
+        Args:
+            nodes: The node ids
+        Returns:
+            The chain names, None where unknown
+        """
+        return [self.chains[c] if c >= 0 else None for c in self.chain_id[nodes]]
+
+    def token_of(self, nodes) -> List[str]:
+        """
+        The token of some nodes
+        Args:
+            nodes: The node ids
+        Returns:
+            The token names
+        """
+        return [self.tokens[t] for t in self.token_id[nodes]]
+
+
+@dataclass(eq=False)
+class CSRGraph(MSONable):
+    """
+    Compact undirected graph with integer node ids, a CSR adjacency and one NumPy column
+    per edge/node attribute.
+    Args:
+        nodes: The node names, the position in the list is the node id
+        u: The first endpoint of each edge
+        v: The second endpoint of each edge
+        edge_data: Edge attribute columns, each of length num_edges
+        node_data: Node attribute columns, each of length num_nodes
+        multi: Whether parallel edges between the same pair of nodes are allowed
+    """
+
+    nodes: List[str]
+    u: np.ndarray
+    v: np.ndarray
+    edge_data: Dict[str, np.ndarray] = field(default_factory=dict)
+    node_data: Dict[str, np.ndarray] = field(default_factory=dict)
+    multi: bool = False
+
+    def __post_init__(self):
+        self.nodes = list(self.nodes)
+        self.u = np.asarray(self.u, dtype=np.int32)
+        self.v = np.asarray(self.v, dtype=np.int32)
+        self.node_index = {name: i for i, name in enumerate(self.nodes)}
+        self._build_adjacency()
+
+    def _build_adjacency(self):
+        """
+        Build the CSR arrays, every edge is stored twice, once from each endpoint.
+        """
+        num_nodes, num_edges = len(self.nodes), len(self.u)
+        src = np.concatenate([self.u, self.v])
+        dst = np.concatenate([self.v, self.u])
+        eid = np.concatenate([np.arange(num_edges, dtype=np.int32)] * 2)
+        order = np.argsort(src, kind="stable")
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=self.indptr[1:])
+        self.indices = dst[order]
+        self.slot_edge = eid[order]
+        self._adjacency = None
+        self._chain_index = None
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.u)
+
+    @classmethod
+    def from_lists(
+        cls,
+        edge_list: Iterable[dict],
+        node_list: Iterable[dict],
+        multi: bool = False,
+        liq_frac: float = 1,
+    ) -> "CSRGraph":
+        """
+        Creates a graph from the same lists of dicts accepted by DEXA.from_list
+        Args:
+            edge_list: A list of dicts, each dict representing an edge
+            node_list: A list of dicts, each dict representing a node
+            multi: Keep parallel edges instead of merging them
+            liq_frac: The fraction of liquidity allowed to be moved through each edge
+        Returns:
+            A instance of CSRGraph
+        """
+        builder = _GraphBuilder(multi=multi)
+        for edge_dict in edge_list:
+            attrs = {k: val for k, val in edge_dict.items() if k not in ("u", "v")}
+            builder.add_edge(edge_dict["u"], edge_dict["v"], attrs)
+        for node_dict in node_list:
+            builder.add_node(node_dict["name"], node_dict)
+        graph = builder.build()
+        graph.set_endpoint_liquidity(liq_frac)
+        return graph
+
+    @classmethod
+    def from_arrays(
+        cls,
+        nodes: List[str],
+        u: np.ndarray,
+        v: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        slot_edge: np.ndarray,
+        edge_data: Dict[str, np.ndarray],
+        node_data: Dict[str, np.ndarray],
+        multi: bool = False,
+    ) -> "CSRGraph":
+        """
+        Creates a graph from arrays that already hold the CSR adjacency, e.g. memory-mapped
+        from a snapshot, without copying or sorting them again
+        Returns:
+            A instance of CSRGraph
+        """
+        graph = cls.__new__(cls)
+        graph.nodes = list(nodes)
+        graph.u, graph.v = u, v
+        graph.edge_data, graph.node_data = dict(edge_data), dict(node_data)
+        graph.multi = multi
+        graph.node_index = {name: i for i, name in enumerate(graph.nodes)}
+        graph.indptr, graph.indices, graph.slot_edge = indptr, indices, slot_edge
+        graph._adjacency = None
+        graph._chain_index = None
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph: nx.Graph) -> "CSRGraph":
+        """
+        Creates a graph from a networkx graph, keeping the node order. Edges carrying "u" and
+        "v" attributes keep that orientation, otherwise the iteration order of nx is used.
+        Args:
+            graph: A nx.Graph or nx.MultiGraph
+        Returns:
+            A instance of CSRGraph
+        """
+        builder = _GraphBuilder(multi=graph.is_multigraph())
+        for name, attrs in graph.nodes(data=True):
+            builder.add_node(name, attrs)
+        for u, v, attrs in graph.edges(data=True):
+            if (attrs.get("u"), attrs.get("v")) == (v, u):
+                u, v = v, u
+            attrs = {k: val for k, val in attrs.items() if k not in ("u", "v")}
+            builder.add_edge(u, v, attrs)
+        return builder.build()
+
+    def set_endpoint_liquidity(self, liq_frac: float = 1):
+        """
+        Copy the node liquidity onto the source_liquidity and target_liquidity edge columns
+        Args:
+            liq_frac: The fraction of the node liquidity usable by each edge
+        """
+        liquidity = self.node_data.get("liquidity")
+        if liquidity is None:
+            liquidity = np.zeros(self.num_nodes)
+        liquidity = np.nan_to_num(liquidity.astype(np.float64)) * liq_frac
+        self.edge_data["source_liquidity"] = liquidity[self.u]
+        self.edge_data["target_liquidity"] = liquidity[self.v]
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        Build the equivalent networkx graph, e.g. for plotting in the Dash apps
+        Returns:
+            A nx.Graph, or a nx.MultiGraph if parallel edges are allowed
+        """
+        graph = nx.MultiGraph() if self.multi else nx.Graph()
+        for i, name in enumerate(self.nodes):
+            graph.add_node(name, **self.node_dict(i), name=name)
+        for e in range(self.num_edges):
+            u, v = self.nodes[self.u[e]], self.nodes[self.v[e]]
+            graph.add_edge(u, v, **self.edge_dict(e), u=u, v=v)
+        return graph
+
+    def edge_dict(self, e: int) -> dict:
+        """
+        The attributes of a single edge as a dict, missing values are left out
+        """
+        return {
+            k: val
+            for k, val in (
+                (k, _from_column(col, e)) for k, col in self.edge_data.items()
+            )
+            if val is not None
+        }
+
+    def node_dict(self, i: int) -> dict:
+        """
+        The attributes of a single node as a dict, missing values are left out
+        """
+        return {
+            k: val
+            for k, val in (
+                (k, _from_column(col, i)) for k, col in self.node_data.items()
+            )
+            if val is not None
+        }
+
+    def iter_edge_dicts(self):
+        for e in range(self.num_edges):
+            yield self.edge_dict(e)
+
+    def set_edge_value(self, e: int, key: str, value):
+        _set_value(self.edge_data, self.num_edges, e, key, value)
+        if key == "isBridge":
+            self._chain_index = None
+
+    def set_node_value(self, i: int, key: str, value):
+        _set_value(self.node_data, self.num_nodes, i, key, value)
+        if key == "chain":
+            self._chain_index = None
+
+    def chain_index(self) -> ChainIndex:
+        """
+        The chain/token index of the nodes, built on first use
+        """
+        if self._chain_index is None:
+            self._chain_index = ChainIndex(self)
+        return self._chain_index
+
+    def edge_ids(self, a: int, b: int) -> List[int]:
+        """
+        The ids of all the edges between two nodes
+        """
+        indptr, indices, slot_edge = self.adjacency()
+        return [
+            slot_edge[slot]
+            for slot in range(indptr[a], indptr[a + 1])
+            if indices[slot] == b
+        ]
+
+    def incident_edges(self, i: int) -> np.ndarray:
+        """
+        The ids of all the edges touching a node
+        """
+        return np.unique(self.slot_edge[self.indptr[i] : self.indptr[i + 1]])
+
+    def ids(self, names: Iterable[str]) -> List[int]:
+        return [self.node_index[name] for name in names]
+
+    def names(self, ids: Iterable[int]) -> List[str]:
+        return [self.nodes[i] for i in ids]
+
+    def adjacency(self):
+        """
+        The CSR arrays as Python lists, which are much faster than NumPy arrays
+        for the element-by-element access done in the path searches.
+        Returns:
+            indptr, indices and slot_edge lists
+        """
+        if self._adjacency is None:
+            self._adjacency = (
+                self.indptr.tolist(),
+                self.indices.tolist(),
+                self.slot_edge.tolist(),
+            )
+        return self._adjacency
+
+    def edge_weights(self, weight: Optional[str] = None) -> np.ndarray:
+        """
+        Get the weight of every edge, edges without a weight count as 1
+        Args:
+            weight: The name of the edge column to use, None for unit weights
+        """
+        if weight is None or weight not in self.edge_data:
+            return np.ones(self.num_edges)
+        return np.nan_to_num(self.edge_data[weight].astype(np.float64), nan=1.0)
@@ -3,6 +3,10 @@ import numpy as np
 from scipy.optimize import curve_fit
 import cvxpy as cp
 import logging
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 _logger = logging.getLogger(__name__)
 
@@ -23,6 +27,365 @@ def exchange_function(x, liq1: float, liq2: float) -> np.array:
     return liq2 - (k / (liq1 + x))
 
 
+def collapse_path(liq1, liq2, fees=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Collapse a path of constant product pools into one equivalent pool.
+    A hop with fee f pays liq2 * x / (liq1 / (1 - f) + x), i.e. a * x / (b + x), and two such
+    hops compose into a1 * a2 / (b2 + a1) * x / (b1 * b2 / (b2 + a1) + x), which has the
+    same form again. The whole path is therefore exchange_function(x, liq_in, liq_out).
+    Args:
+        liq1: The source liquidity of each hop, the hops along the last axis, extra leading
+            axes hold several paths of the same length
+        liq2: The target liquidity of each hop
+        fees: The fee of each hop as a fraction, None for no fees
+    Returns:
+        The liquidity (liq_in, liq_out) of the equivalent pool
+    """
+    liq1 = np.asarray(liq1, dtype=np.float64)
+    liq2 = np.asarray(liq2, dtype=np.float64)
+    if fees is not None:
+        liq1 = liq1 / (1 - np.asarray(fees, dtype=np.float64))
+    liq1, liq2 = np.broadcast_arrays(liq1, liq2)
+    liq_in, liq_out = liq1[..., 0], liq2[..., 0]
+    for hop in range(1, liq1.shape[-1]):
+        b, a = liq1[..., hop], liq2[..., hop]
+        denom = b + liq_out
+        liq_in, liq_out = liq_in * b / denom, liq_out * a / denom
+    return liq_in, liq_out
+
+
+def path_output(x, liq_in, liq_out) -> np.ndarray:
+    """
+    The amount received for x through a collapsed path, see collapse_path
+    """
+    return exchange_function(np.asarray(x, dtype=np.float64), liq_in, liq_out)
+
+
+def marginal_price(x, liq_in, liq_out) -> np.ndarray:
+    """
+    The derivative of the output of a collapsed path, i.e. the price paid for the next unit
+    after x has been swapped
+    """
+    x = np.asarray(x, dtype=np.float64)
+    return liq_in * liq_out / (liq_in + x) ** 2
+
+
+def price_impact(x, liq_in, liq_out) -> np.ndarray:
+    """
+    The relative loss of swapping x through a collapsed path compared to the spot price,
+    1 - output / (x * spot price), which for a constant product pool is x / (liq_in + x)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    return x / (liq_in + x)
+
+
+def _impact_terms(liq1, liq2, fees, dtype) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The source liquidity of every pool, the fee term liq1 * f / (1 - f) of its impact and
+    which pools are empty
+    """
+    liq1 = np.asarray(liq1, dtype=np.float64).ravel()
+    liq2 = np.broadcast_to(np.asarray(liq2, dtype=np.float64), liq1.shape)
+    fees = np.zeros_like(liq1) if fees is None else np.broadcast_to(fees, liq1.shape)
+    empty = (liq1 <= 0) | (liq2 <= 0) | (fees >= 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fee_depth = np.where(empty, 0.0, liq1 * fees / np.where(empty, 1.0, 1 - fees))
+    return liq1.astype(dtype), fee_depth.astype(dtype), empty
+
+
+def _impact_block(amounts, liq1, fee_depth, empty, out) -> np.ndarray:
+    """
+    Write the impacts of some pools into out without temporaries, as
+    1 / (1 + liq1 / (liq1 * f / (1 - f) + x)) which keeps its precision for small impacts
+    """
+    np.add(fee_depth[:, None], amounts, out=out)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(liq1[:, None], out, out=out)
+    np.add(out, 1, out=out)
+    np.reciprocal(out, out=out)
+    out[empty] = 1.0
+    return out
+
+
+def price_impact_matrix(amounts, liq1, liq2, fees=None, dtype=np.float64) -> np.ndarray:
+    """
+    The price impact of every trade size on every pool in one pass, measured against the
+    spot price before fees: 1 - (1 - f) * liq1 / (liq1 + (1 - f) * x), i.e. price_impact
+    with the fee paid included. It is f for a vanishing trade and goes to 1 as f goes to 1.
+    The impact of a constant product pool does not depend on liq2, which only marks empty
+    pools: those, and pools that keep the whole input as fee, get an impact of 1.
+    Use iter_price_impact or pools_over_impact when the whole matrix does not fit in memory.
+    Args:
+        amounts: The trade sizes, in units of the source asset of each pool
+        liq1: The liquidity of the source asset of each pool
+        liq2: The liquidity of the destination asset of each pool
+        fees: The fee of each pool as a fraction, None for no fee
+        dtype: The dtype of the result, e.g. np.float32 to halve the memory
+    Returns:
+        The (n_pools, n_amounts) impacts
+    """
+    amounts = np.asarray(amounts, dtype=dtype).ravel()
+    liq1, fee_depth, empty = _impact_terms(liq1, liq2, fees, dtype)
+    result = np.empty((len(liq1), len(amounts)), dtype=dtype)
+    return _impact_block(amounts, liq1, fee_depth, empty, result)
+
+
+def iter_price_impact(
+    amounts, liq1, liq2, fees=None, dtype=np.float64, chunk_size: int = 1 << 16
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    The rows of price_impact_matrix a block of pools at a time. The same buffer is reused for
+    every block, so the memory stays at chunk_size * len(amounts) values; copy a block to
+    keep it past the next iteration.
+    Args:
+        amounts: The trade sizes, in units of the source asset of each pool
+        liq1: The liquidity of the source asset of each pool
+        liq2: The liquidity of the destination asset of each pool
+        fees: The fee of each pool as a fraction, None for no fee
+        dtype: The dtype of the blocks
+        chunk_size: Number of pools per block
+    Returns:
+        An iterator of (index of the first pool, (n, n_amounts) impacts) pairs
+    """
+    amounts = np.asarray(amounts, dtype=dtype).ravel()
+    liq1, fee_depth, empty = _impact_terms(liq1, liq2, fees, dtype)
+    buffer = np.empty((min(chunk_size, len(liq1)), len(amounts)), dtype=dtype)
+    for start in range(0, len(liq1), chunk_size):
+        rows = slice(start, start + chunk_size)
+        out = buffer[: len(liq1[rows])]
+        yield start, _impact_block(
+            amounts, liq1[rows], fee_depth[rows], empty[rows], out
+        )
+
+
+def pools_over_impact(
+    amounts,
+    liq1,
+    liq2,
+    threshold: float,
+    fees=None,
+    dtype=np.float64,
+    chunk_size: int = 1 << 16,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The pools where one of the trade sizes has an impact above a threshold, found a block of
+    pools at a time with iter_price_impact so that only the selected rows are kept
+    Args:
+        amounts: The trade sizes, in units of the source asset of each pool
+        liq1: The liquidity of the source asset of each pool
+        liq2: The liquidity of the destination asset of each pool
+        threshold: The largest acceptable impact
+        fees: The fee of each pool as a fraction, None for no fee
+        dtype: The dtype of the computation
+        chunk_size: Number of pools per block
+    Returns:
+        The indices of those pools and their (n, n_amounts) impacts
+    """
+    indices, impacts = [], []
+    for start, block in iter_price_impact(amounts, liq1, liq2, fees, dtype, chunk_size):
+        over = np.flatnonzero((block > threshold).any(axis=1))
+        indices.append(start + over)
+        impacts.append(block[over])
+    if not indices:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, np.size(amounts)), dtype=dtype)
+    return np.concatenate(indices), np.concatenate(impacts)
+
+
+class OutputTables:
+    """
+    Lookup tables of the output of many constant product pools, for quotes that can trade
+    a small bounded error for speed.
+    Every pool has a grid of input amounts, x = 0 followed by points log-spaced between
+    min_ratio and max_ratio times its (fee adjusted) source liquidity, and its outputs on
+    that grid, both stored as contiguous (n_pools, points + 1) arrays. A lookup finds the
+    grid interval from the logarithm of the amount and interpolates linearly; amounts past
+    the end of the grid are computed exactly.
+    The output is concave, so the interpolation never overestimates it and its error on an
+    interval [a, b] is at most (b - a)^2 / 8 * max|y''| = (b - a)^2 * L1 * L2 / (4 (L1 + a)^3).
+    A change of the destination liquidity only scales the output and is applied exactly. A
+    change of the source liquidity from the one a table was built with adds at most
+    L2 * |L1 - L1'| / (sqrt(L1) + sqrt(L1'))^2 to the error, and the table of a pool is only
+    rebuilt once its source liquidity moves by more than rebuild_tol.
+    """
+
+    def __init__(
+        self,
+        liq1,
+        liq2,
+        fees=None,
+        points: int = 256,
+        min_ratio: float = 1e-4,
+        max_ratio: float = 1e2,
+        rebuild_tol: float = 0.01,
+    ):
+        """
+        Args:
+            liq1: The liquidity of the source asset of each pool
+            liq2: The liquidity of the destination asset of each pool
+            fees: The fee of each pool as a fraction, None for no fee
+            points: Number of log-spaced grid points per pool
+            min_ratio: The first grid point as a fraction of the source liquidity
+            max_ratio: The last grid point as a multiple of the source liquidity
+            rebuild_tol: Relative move of the source liquidity that triggers a rebuild
+        """
+        self.ratios = np.logspace(np.log10(min_ratio), np.log10(max_ratio), points)
+        self._log_min = np.log(min_ratio)
+        self._log_step = (np.log(max_ratio) - self._log_min) / (points - 1)
+        self.rebuild_tol = rebuild_tol
+        self.rebuilds = 0
+        self.liq1 = self._depth(liq1, fees)
+        self.liq2 = np.broadcast_to(
+            np.asarray(liq2, dtype=np.float64), self.liq1.shape
+        ).copy()
+        n = len(self.liq1)
+        self.built_liq1 = self.liq1.copy()
+        self.built_liq2 = self.liq2.copy()
+        self.xs = np.zeros((n, points + 1))
+        self.ys = np.zeros((n, points + 1))
+        self.slopes = np.zeros((n, points))
+        self.table_error = np.zeros(n)
+        self._inv_depth = np.zeros(n)
+        self._scale = np.zeros(n)
+        self._bound = np.zeros(n)
+        self._build(np.arange(n))
+
+    @classmethod
+    def from_graph(cls, graph, fee_scale: float = 1.0, **kwargs) -> "OutputTables":
+        """
+        The tables of both directions of every edge of a graph: row e swaps from u to v and
+        row num_edges + e from v to u
+        Args:
+            graph: A CSRGraph with "source_liquidity", "target_liquidity" and "fee" columns
+            fee_scale: Multiplies the fee column to get the fee as a fraction
+            kwargs: Passed on to OutputTables
+        """
+        data = graph.edge_data
+        liq_u = np.nan_to_num(data["source_liquidity"].astype(np.float64))
+        liq_v = np.nan_to_num(data["target_liquidity"].astype(np.float64))
+        fee = np.clip(np.nan_to_num(data["fee"].astype(np.float64)) * fee_scale, 0, 1)
+        return cls(
+            np.concatenate([liq_u, liq_v]),
+            np.concatenate([liq_v, liq_u]),
+            np.concatenate([fee, fee]),
+            **kwargs,
+        )
+
+    @staticmethod
+    def _depth(liq1, fees) -> np.ndarray:
+        """
+        The source liquidity with the fee folded in, y = liq2 * x / (liq1 / (1 - f) + x)
+        """
+        liq1 = np.atleast_1d(np.asarray(liq1, dtype=np.float64))
+        if fees is None:
+            return liq1.copy()
+        keep = 1 - np.broadcast_to(np.asarray(fees, dtype=np.float64), liq1.shape)
+        with np.errstate(divide="ignore"):
+            return np.where(keep > 0, liq1 / keep, np.inf)
+
+    def _build(self, rows: np.ndarray):
+        """
+        Recompute the grids, outputs and interpolation errors of some pools
+        """
+        l1, l2 = self.liq1[rows], self.liq2[rows]
+        self.built_liq1[rows], self.built_liq2[rows] = l1, l2
+        alive = (l1 > 0) & np.isfinite(l1) & (l2 > 0)
+        l1, l2 = np.where(alive, l1, 1.0), np.where(alive, l2, 0.0)
+        xs = np.zeros((len(rows), len(self.ratios) + 1))
+        xs[:, 1:] = np.outer(l1, self.ratios)
+        ys = l2[:, None] * xs / (l1[:, None] + xs)
+        width = np.diff(xs, axis=1)
+        curvature = (l1 * l2)[:, None] / (4 * (l1[:, None] + xs[:, :-1]) ** 3)
+        self.xs[rows] = xs
+        self.ys[rows] = ys
+        self.slopes[rows] = np.diff(ys, axis=1) / width
+        self.table_error[rows] = (width * width * curvature).max(axis=1)
+        self._inv_depth[rows] = np.where(alive, 1 / l1, 0.0)
+        self.rebuilds += len(rows)
+        self._refresh(rows)
+
+    def _refresh(self, rows: np.ndarray):
+        """
+        Update the output scale and error bound of some pools after a liquidity change
+        """
+        alive = (
+            (self.liq1[rows] > 0) & np.isfinite(self.liq1[rows]) & (self.liq2[rows] > 0)
+        )
+        alive &= self._inv_depth[rows] > 0
+        built = np.where(alive, self.built_liq2[rows], 1.0)
+        self._scale[rows] = np.where(alive, self.liq2[rows] / built, 0.0)
+        self._bound[rows] = np.where(alive, self._error_bound(rows), 0.0)
+
+    def update(self, rows, liq1, liq2, fees=None) -> np.ndarray:
+        """
+        Change the liquidity of some pools, rebuilding the tables of those whose source
+        liquidity moved by more than rebuild_tol
+        Args:
+            rows: The pools
+            liq1: The new source liquidity of each of them
+            liq2: The new destination liquidity of each of them
+            fees: The new fee of each of them as a fraction, None for no fee
+        Returns:
+            The pools whose tables were rebuilt
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        self.liq1[rows] = self._depth(liq1, fees)
+        self.liq2[rows] = liq2
+        built = self.built_liq1[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            drift = np.abs(self.liq1[rows] / built - 1)
+        stale = rows[~(drift <= self.rebuild_tol)]
+        if len(stale):
+            self._build(stale)
+        self._refresh(rows)
+        return stale
+
+    def _error_bound(self, rows) -> np.ndarray:
+        l1, l2 = self.liq1[rows], self.liq2[rows]
+        b1, b2 = self.built_liq1[rows], self.built_liq2[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scale = l2 / b2
+            drift = l2 * np.abs(l1 - b1) / (np.sqrt(l1) + np.sqrt(b1)) ** 2
+        return scale * self.table_error[rows] + drift
+
+    def error_bound(self, rows=None) -> np.ndarray:
+        """
+        The largest error of a lookup on each pool with its current liquidity
+        """
+        return self._bound if rows is None else self._bound[rows]
+
+    def output(self, rows, amounts) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The approximate output of swapping amounts through pools, broadcasting rows against
+        amounts
+        Args:
+            rows: The pools
+            amounts: The non-negative input amounts, before fees
+        Returns:
+            The outputs and the error bound of each of them
+        """
+        rows, amounts = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(rows, dtype=np.int64)),
+            np.atleast_1d(np.asarray(amounts, dtype=np.float64)),
+        )
+        points = len(self.ratios)
+        with np.errstate(divide="ignore"):
+            position = np.log(amounts * self._inv_depth[rows])
+        # interval j lies between columns j and j + 1, column 0 being x = 0
+        j = np.floor(np.fmax((position - self._log_min) / self._log_step, -1.0)) + 1
+        outside = j >= points
+        j = np.minimum(j, points - 1).astype(np.int64)
+        x0 = np.take(self.xs, rows * (points + 1) + j)
+        y0 = np.take(self.ys, rows * (points + 1) + j)
+        slope = np.take(self.slopes, rows * points + j)
+        y = (y0 + (amounts - x0) * slope) * self._scale[rows]
+        bound = self._bound[rows]
+        if outside.any():
+            l1, l2 = self.liq1[rows[outside]], self.liq2[rows[outside]]
+            y[outside] = l2 * amounts[outside] / (l1 + amounts[outside])
+            bound[outside] = 0.0
+        return y, bound
+
+
 def _fit_func(x, a, b, c, d):
     """
     The functional form we are fitting to
@@ -37,27 +400,220 @@ def _fit_func_dcp(x, a, b, c, d):
     return a * cp.sqrt(b * x + c) + d
 
 
-def exchange_fit(x: np.array, liq1: float, liq2: float) -> np.array:
+def exchange_fit(x: np.array, liq1: float, liq2: float, cache=None) -> np.array:
     """
     Since the exchange function is not DCP compliant we have to fit it to a DCP compliant function
     Args:
         liq1: The liquidity of the source asset
         liq2: The liquidity of the destination asset
+        cache: A FitCache to take the parameters from, see exchange_fit_params
     """
-    popt = exchange_fit_params(x, liq1=liq1, liq2=liq2)
+    popt = exchange_fit_params(x, liq1=liq1, liq2=liq2, cache=cache)
     return _fit_func(x, *popt)
 
 
-def exchange_fit_params(x: np.array, liq1: float, liq2: float) -> np.array:
+def exchange_fit_params(x: np.array, liq1: float, liq2: float, cache=None) -> np.array:
     """
     Get the parameters for the DCP compliant fit function
+    Args:
+        cache: An entropic.cache.FitCache, which fits without curve_fit on a miss and
+            returns the stored parameters on later calls, None to always call curve_fit
     """
+    if cache is not None:
+        return cache.params(x, liq1, liq2)[0]
     y0 = exchange_function(x, liq1=liq1, liq2=liq2)
     popt, _ = curve_fit(_fit_func, x, y0, method="trf")
     return popt
 
 
-def convex_model(amt, A, B, C, D, S):
+def _sqrt_shift(x, c):
+    """
+    sqrt(x + c) - sqrt(c) without the cancellation of the direct difference for large c
+    """
+    return x / (np.sqrt(x + c) + np.sqrt(c))
+
+
+def _project(x, y, c):
+    """
+    Least squares fit of y = a * sqrt(x + c) + d for fixed c, row by row
+    Returns:
+        a, d and the sum of squared residuals of each row
+    """
+    s = _sqrt_shift(x, c[:, None])
+    s_mean, y_mean = s.mean(axis=1), y.mean(axis=1)
+    ds, dy = s - s_mean[:, None], y - y_mean[:, None]
+    var = (ds * ds).sum(axis=1)
+    a = np.where(var > 0, (ds * dy).sum(axis=1) / np.where(var > 0, var, 1), 0.0)
+    b = y_mean - a * s_mean
+    sse = ((dy - a[:, None] * ds) ** 2).sum(axis=1)
+    return a, b - a * np.sqrt(c), sse
+
+
+def exchange_fit_params_batch(
+    x: np.ndarray, liq1, liq2, scan: int = 41, iterations: int = 40
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit y = A * sqrt(B * x + C) + D to many exchange functions at once without a solver.
+    The form only has three independent parameters, so B is fixed to 1. For a given C the
+    best A and D follow from linear least squares, which leaves a one dimensional search
+    over log C: a coarse scan followed by a golden section search, both vectorized over
+    all the curves. Each curve is fitted in units of its own liquidity, where it only
+    depends on x / liq1.
+    Args:
+        x: The amounts the fit is made on, shared by every curve or one row per curve
+        liq1: The liquidity of the source asset of each curve
+        liq2: The liquidity of the destination asset of each curve
+        scan: Number of points of the coarse scan over log C
+        iterations: Number of golden section steps
+    Returns:
+        The (n, 4) matrix of A, B, C, D and the root mean square error of each fit
+    """
+    liq1 = np.atleast_1d(np.asarray(liq1, dtype=np.float64))
+    liq2 = np.atleast_1d(np.asarray(liq2, dtype=np.float64))
+    liq1, liq2 = np.broadcast_arrays(liq1, liq2)
+    x = np.asarray(x, dtype=np.float64)
+    x = np.broadcast_to(x, (len(liq1), x.shape[-1]))
+    xs = x / liq1[:, None]
+    ys = xs / (1 + xs)
+    span = np.log(np.maximum(xs.max(axis=1), 1e-12))
+    lo, hi = span - 20, span + 20
+
+    # coarse scan to bracket the best log C of every curve
+    grid = np.linspace(0, 1, scan)
+    sse = np.stack([_project(xs, ys, np.exp(lo + t * (hi - lo)))[2] for t in grid])
+    best = np.argmin(sse, axis=0)
+    step = (hi - lo) / (scan - 1)
+    left = lo + np.maximum(best - 1, 0) * step
+    right = lo + np.minimum(best + 1, scan - 1) * step
+
+    ratio = (np.sqrt(5) - 1) / 2
+    p = right - ratio * (right - left)
+    q = left + ratio * (right - left)
+    fp = _project(xs, ys, np.exp(p))[2]
+    fq = _project(xs, ys, np.exp(q))[2]
+    for _ in range(iterations):
+        lower = fp < fq
+        right = np.where(lower, q, right)
+        left = np.where(lower, left, p)
+        q_new = np.where(lower, p, left + ratio * (right - left))
+        p_new = np.where(lower, right - ratio * (right - left), q)
+        f_new = _project(xs, ys, np.exp(np.where(lower, p_new, q_new)))[2]
+        fq, fp = np.where(lower, fp, f_new), np.where(lower, f_new, fq)
+        p, q = p_new, q_new
+
+    c = np.exp((left + right) / 2)
+    a, d, sse = _project(xs, ys, c)
+    # back from units of liq1 and liq2
+    params = np.column_stack(
+        [liq2 * a / np.sqrt(liq1), np.ones_like(liq1), c * liq1, liq2 * d]
+    )
+    return params, liq2 * np.sqrt(sse / xs.shape[1])
+
+
+class SplitOptimizer:
+    """
+    The problem of convex_model for a fixed number of curves, built once with cvxpy
+    Parameters so that it is canonicalized on the first solve only; later solves only update
+    the parameter values and warm start from the previous solution when the solver can.
+    The curves enter through the epigraph t_i <= sqrt(B_i * x_i + C_i), y_i = A_i * t_i + D_i,
+    which keeps the problem DPP as long as A and B are non-negative, as they are for fits of
+    increasing concave exchange curves.
+    """
+
+    def __init__(self, n: int, solver: Optional[str] = None):
+        """
+        Args:
+            n: The number of curves
+            solver: The cvxpy solver, None for the cvxpy default
+        """
+        self.n = n
+        self.solver = solver
+        self.amt = cp.Parameter(nonneg=True)
+        self.A = cp.Parameter(n, nonneg=True)
+        self.B = cp.Parameter(n, nonneg=True)
+        self.C = cp.Parameter(n)
+        self.D = cp.Parameter(n)
+        self.S = cp.Parameter(n)
+        self.x = cp.Variable(n)
+        t = cp.Variable(n)
+        y = cp.multiply(self.A, t) + self.D
+        self.problem = cp.Problem(
+            cp.Maximize(cp.sum(y)),
+            [
+                cp.sum(self.x) == self.amt,
+                t <= cp.sqrt(cp.multiply(self.B, self.x) + self.C),
+                y >= cp.multiply(self.S, self.x),
+            ],
+        )
+        self.solves = 0
+        self.compile_time: Optional[float] = None
+        self.last_compile_time: Optional[float] = None
+        self.last_solve_time: Optional[float] = None
+
+    def solve(self, amt, A, B, C, D, S, **solver_options) -> list:
+        """
+        Split an amount over the curves, see convex_model
+        Args:
+            solver_options: Passed on to the solver, e.g. a time limit
+        Returns:
+            x_i: set of x_i
+        """
+        for param, value in zip(
+            (self.amt, self.A, self.B, self.C, self.D, self.S), (amt, A, B, C, D, S)
+        ):
+            param.value = np.broadcast_to(
+                np.asarray(value, dtype=np.float64), param.shape
+            )
+        start = time.perf_counter()
+        self.problem.solve(
+            solver=self.solver, warm_start=self.solves > 0, **solver_options
+        )
+        elapsed = time.perf_counter() - start
+        self.last_compile_time = self.problem.compilation_time
+        self.last_solve_time = elapsed - (self.last_compile_time or 0.0)
+        if self.compile_time is None:
+            self.compile_time = self.last_compile_time
+        self.solves += 1
+        if self.x.value is None:
+            raise ValueError("No Feasible solution for convex model")
+        return self.x.value.tolist()
+
+    @property
+    def timings(self) -> dict:
+        """
+        The compile time of the first solve and the compile and solve times of the last one
+        """
+        return {
+            "solves": self.solves,
+            "compile": self.compile_time,
+            "last_compile": self.last_compile_time,
+            "last_solve": self.last_solve_time,
+        }
+
+
+_OPTIMIZERS: Dict[tuple, SplitOptimizer] = {}
+
+
+def split_optimizer(n: int, solver: Optional[str] = None) -> SplitOptimizer:
+    """
+    The shared SplitOptimizer for n curves, created on first use
+    """
+    key = (n, solver)
+    if key not in _OPTIMIZERS:
+        _OPTIMIZERS[key] = SplitOptimizer(n, solver=solver)
+    return _OPTIMIZERS[key]
+
+
+def convex_model(
+    amt,
+    A,
+    B,
+    C,
+    D,
+    S,
+    backends: Optional[Sequence[str]] = None,
+    time_limit: Optional[float] = None,
+):
     """
     For a list of curves defined by:
         y_i = A_i * sqrt(B_i * x_i + C_i) + D_i
@@ -66,6 +622,7 @@ def convex_model(amt, A, B, C, D, S):
     Constraints:
         1. sum(x_i) < total
         2. y_i >= S_i * x_i
+    The problem for each number of curves is compiled once, see SplitOptimizer.
     Args:
         amt: total amount of liquidity to be exchanged
         A: set of A_i
@@ -73,22 +630,306 @@ def convex_model(amt, A, B, C, D, S):
         C: set of C_i
         D: set of D_i
         S: set of S_i
+        backends: The fallback order of solve_split, None for the cvxpy default solver
+        time_limit: The wall-clock budget of solve_split in seconds
     Returns:
         x_i: set of x_i
     """
-    # initialize the variables
-    x = cp.Variable(len(A))
-    y = cp.multiply(A, cp.sqrt(cp.multiply(B, x) + C)) + D
+    if backends is None and time_limit is None:
+        return split_optimizer(len(A)).solve(amt, A, B, C, D, S)
+    x, report = solve_split(
+        amt, A, B, C, D, S, backends=backends or BACKENDS, time_limit=time_limit
+    )
+    _logger.debug(f"Split found by {report.backend} in {report.elapsed:.2e} s")
+    return x
+
+
+def _fill_ladder(alpha, beta, lo, hi, amounts) -> np.ndarray:
+    """
+    Solve sum(clip(alpha_i * t - beta_i, lo_i, hi_i)) = amt for t >= 0 exactly, for every
+    amount at once. The sum is piecewise linear and non-decreasing in t, with breakpoints
+    where a term hits a bound, so it is evaluated once at the breakpoints and each amount is
+    interpolated in the segment that contains it.
+    Returns:
+        The clipped x_i at the root of each amount, one row per amount, NaN for amounts that
+        cannot be split within the bounds
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    if np.any(lo > hi):
+        return np.full((len(amounts), len(alpha)), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        points = np.concatenate([[0.0], (lo + beta) / alpha, (hi + beta) / alpha])
+    points = np.unique(points[np.isfinite(points) & (points >= 0)])
+    totals = np.clip(np.outer(points, alpha) - beta, lo, hi).sum(axis=1)
+    j = np.clip(np.searchsorted(totals, amounts), 1, max(len(points) - 1, 1))
+    if len(points) > 1:
+        t0, t1 = points[j - 1], points[j]
+        s0, s1 = totals[j - 1], totals[j]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(s1 > s0, t0 + (t1 - t0) * (amounts - s0) / (s1 - s0), t0)
+    else:
+        t = np.zeros_like(amounts)
+    # past the last breakpoint only the unbounded curves still take flow
+    slope = alpha[np.isinf(hi)].sum()
+    past = amounts > totals[-1]
+    if slope > 0:
+        t = np.where(past, points[-1] + (amounts - totals[-1]) / slope, t)
+    t = np.where(amounts <= totals[0], points[0], t)
+    x = np.clip(np.outer(t, alpha) - beta, lo, hi)
+    infeasible = (amounts < totals[0] * (1 - 1e-12) - 1e-12) | (past & (slope == 0))
+    x[infeasible] = np.nan
+    return x
+
+
+def _fill(alpha, beta, lo, hi, amt) -> np.ndarray:
+    """
+    The split of a single amount, see _fill_ladder
+    """
+    x = _fill_ladder(alpha, beta, lo, hi, [amt])[0]
+    if np.isnan(x).any():
+        raise ValueError("No Feasible solution for convex model")
+    return x
+
+
+def _curve_bounds(A, B, C, D, S) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The interval of x_i where y_i = A_i * sqrt(B_i * x_i + C_i) + D_i is defined and
+    y_i >= S_i * x_i, for A_i, B_i > 0. With u = sqrt(B x + C) the slippage constraint is
+    g(u) = A u + D - S (u^2 - C) / B >= 0, a quadratic in u.
+    """
+    a = -S / B
+    c = D + S * C / B
+    lo_u = np.zeros_like(A)
+    hi_u = np.full_like(A, np.inf)
+    disc = A * A - 4 * a * c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        root = np.sqrt(np.maximum(disc, 0))
+        # S = 0: g is linear and increasing
+        linear = S == 0
+        lo_u = np.where(linear, np.maximum(-D / A, 0), lo_u)
+        # S < 0: g is increasing on u >= 0, feasible past its positive root
+        rising = (S < 0) & (c < 0)
+        lo_u = np.where(rising, (-A + root) / (2 * a), lo_u)
+        # S > 0: g is concave, feasible between its roots
+        falling = S > 0
+        lo_u = np.where(falling, np.maximum((-A + root) / (2 * a), 0), lo_u)
+        hi_u = np.where(falling, (-A - root) / (2 * a), hi_u)
+    empty = falling & ((disc < 0) | (hi_u < 0))
+    lo = np.where(empty, np.inf, (lo_u * lo_u - C) / B)
+    hi = np.where(empty, -np.inf, (hi_u * hi_u - C) / B)
+    return lo, hi
 
-    # Define the problem
-    objective = cp.Maximize(cp.sum(y))
-    constraints = [cp.sum(x) == amt, y >= cp.multiply(S, x)]
-    prob = cp.Problem(objective, constraints)
-    prob.solve()
 
-    if x.value is None:
+def marginal_split(amt, A, B, C, D, S) -> list:
+    """
+    Solve the problem of convex_model without a solver. At the optimum every curve that is
+    not at a bound of its interval has the same marginal output
+        y_i' = A_i * B_i / (2 * sqrt(B_i * x_i + C_i)) = lambda,
+    i.e. x_i = A_i^2 B_i / (4 lambda^2) - C_i / B_i clipped to the interval where the curve is
+    defined and y_i >= S_i * x_i. The clipped x_i are linear in 1 / lambda^2 between
+    breakpoints, which gives the multiplier exactly.
+    Curves that are not increasing and concave (A_i <= 0 or B_i <= 0) are handed to
+    convex_model.
+    Args:
+        amt: total amount of liquidity to be exchanged
+        A: set of A_i
+        B: set of B_i
+        C: set of C_i
+        D: set of D_i
+        S: set of S_i
+    Returns:
+        x_i: set of x_i
+    """
+    A, B, C, D, S = _as_curves(A, B, C, D, S)
+    x = _native_split(amt, A, B, C, D, S)
+    if x is None:
+        _logger.debug("Curves outside of the native split solver, using convex_model")
+        return convex_model(amt, A, B, C, D, S)
+    return x.tolist()
+
+
+def _as_curves(A, B, C, D, S) -> tuple:
+    return tuple(
+        np.broadcast_to(np.asarray(v, dtype=np.float64), (len(A),))
+        for v in (A, B, C, D, S)
+    )
+
+
+def _native_split(amt, A, B, C, D, S) -> Optional[np.ndarray]:
+    """
+    The split of marginal_split, None for curves it does not handle
+    """
+    values = np.concatenate([A, B, C, D, S, [amt]])
+    if np.any(A <= 0) or np.any(B <= 0) or not np.all(np.isfinite(values)):
+        return None
+    lo, hi = _curve_bounds(A, B, C, D, S)
+    return _fill(A * A * B / 4, C / B, lo, hi, amt)
+
+
+def _path_bounds(liq_in, liq_out, S=None) -> tuple:
+    """
+    The alpha, beta, lo and hi of _fill_ladder for constant product paths: the optimal
+    x_i = sqrt(liq_in * liq_out) * t - liq_in with t = 1 / sqrt(lambda), x_i >= 0 and
+    x_i <= liq_out / S_i - liq_in when S_i > 0
+    """
+    S = np.zeros_like(liq_in) if S is None else np.broadcast_to(S, liq_in.shape)
+    with np.errstate(divide="ignore"):
+        hi = np.where(S > 0, liq_out / S - liq_in, np.inf)
+    return np.sqrt(liq_in * liq_out), liq_in, np.zeros_like(liq_in), np.maximum(hi, 0)
+
+
+def marginal_split_paths(amt, liq_in, liq_out, S=None) -> list:
+    """
+    Split an amount over constant product paths, each given by the liquidities of its
+    collapsed pool (see collapse_path), maximizing the total output with x_i >= 0 and
+    y_i >= S_i * x_i. The marginal output of a path is liq_in * liq_out / (liq_in + x)^2,
+    so at the optimum x_i = sqrt(liq_in * liq_out / lambda) - liq_in within the bounds.
+    Args:
+        amt: The amount to split
+        liq_in: The input side liquidity of each path
+        liq_out: The output side liquidity of each path
+        S: The minimum rate of each path, None for no constraint
+    Returns:
+        x_i: The amount sent through each path
+    """
+    liq_in = np.asarray(liq_in, dtype=np.float64)
+    liq_out = np.asarray(liq_out, dtype=np.float64)
+    return _fill(*_path_bounds(liq_in, liq_out, S), amt).tolist()
+
+
+def quote_ladder(paths, amounts, S=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The optimal splits of a whole array of amounts over constant product paths, see
+    marginal_split_paths. The split only moves along one piecewise linear curve as the
+    amount grows, so its breakpoints are found once and every amount is a lookup on them.
+    Args:
+        paths: The (liq_in, liq_out) liquidities of the collapsed paths, as returned by
+            collapse_path
+        amounts: The amounts to quote
+        S: The minimum rate of each path, None for no constraint
+    Returns:
+        The split of each amount as one row per amount and the total output of each amount,
+        NaN where an amount cannot be split within the slippage constraints
+    """
+    liq_in, liq_out = (np.asarray(v, dtype=np.float64) for v in paths)
+    splits = _fill_ladder(*_path_bounds(liq_in, liq_out, S), np.ravel(amounts))
+    outputs = path_output(splits, liq_in, liq_out).sum(axis=1)
+    return splits, outputs
+
+
+BACKENDS = ("native", "CLARABEL", "ECOS", "SCS")
+# the name of the time limit option of each cvxpy solver
+_TIME_LIMIT_OPTIONS = {"CLARABEL": "time_limit", "SCS": "time_limit_secs"}
+
+
+@lru_cache(maxsize=None)
+def _installed_solvers() -> frozenset:
+    return frozenset(cp.installed_solvers())
+
+
+@dataclass
+class SplitReport:
+    """
+    How a split was found
+    Args:
+        backend: The backend whose split was returned
+        elapsed: The wall-clock time of the whole solve in seconds
+        attempts: (backend, status, seconds) of every backend tried, in order
+    """
+
+    backend: str
+    elapsed: float
+    attempts: List[tuple] = field(default_factory=list)
+
+
+def _feasible_split(x, amt, A, B, C, D, S, tol: float = 1e-6) -> Optional[tuple]:
+    """
+    Spread the gap between sum(x) and amt evenly over an approximate split and check the
+    constraints of convex_model
+    Returns:
+        The corrected split and its total output, None if it is not feasible
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if not np.all(np.isfinite(x)):
+        return None
+    x = x + (amt - x.sum()) / len(x)
+    inner = B * x + C
+    scale = max(abs(amt), 1.0)
+    if np.any(inner < -tol * scale):
+        return None
+    y = A * np.sqrt(np.maximum(inner, 0)) + D
+    if np.any(y < S * x - tol * scale):
+        return None
+    return x, float(y.sum())
+
+
+def solve_split(
+    amt,
+    A,
+    B,
+    C,
+    D,
+    S,
+    backends: Sequence[str] = BACKENDS,
+    time_limit: Optional[float] = None,
+) -> Tuple[list, SplitReport]:
+    """
+    Solve the problem of convex_model with a chain of backends. Each backend is tried in
+    turn until one reports an optimal split or the time budget runs out. Inaccurate splits
+    that satisfy the constraints once their sum is corrected are kept and the best of them
+    is returned if no backend finishes. While no feasible split has been found the next
+    backend is still tried after the budget ran out. Backends that are not installed are
+    skipped.
+    Args:
+        amt: total amount of liquidity to be exchanged
+        A: set of A_i
+        B: set of B_i
+        C: set of C_i
+        D: set of D_i
+        S: set of S_i
+        backends: "native" for marginal_split and cvxpy solver names, in order of preference
+        time_limit: The wall-clock budget in seconds, None for no limit
+    Returns:
+        x_i: set of x_i, and the SplitReport of the solve
+    """
+    A, B, C, D, S = _as_curves(A, B, C, D, S)
+    start = time.perf_counter()
+    attempts = []
+    best = None
+    for backend in backends:
+        now = time.perf_counter()
+        remaining = None if time_limit is None else time_limit - (now - start)
+        if remaining is not None and remaining <= 0 and best is not None:
+            break
+        if backend != "native" and backend not in _installed_solvers():
+            attempts.append((backend, "unavailable", 0.0))
+            continue
+        options = {}
+        if remaining is not None and backend in _TIME_LIMIT_OPTIONS:
+            options[_TIME_LIMIT_OPTIONS[backend]] = max(remaining, 1e-3)
+        try:
+            if backend == "native":
+                x = _native_split(amt, A, B, C, D, S)
+                status = "unsupported" if x is None else cp.OPTIMAL
+            else:
+                optimizer = split_optimizer(len(A), solver=backend)
+                x = optimizer.solve(amt, A, B, C, D, S, **options)
+                status = optimizer.problem.status
+        except (ValueError, cp.error.SolverError) as exc:
+            x, status = None, f"failed: {exc}"
+        attempts.append((backend, status, time.perf_counter() - now))
+        found = None if x is None else _feasible_split(x, amt, A, B, C, D, S)
+        if found is None:
+            continue
+        if best is None or found[1] > best[1]:
+            best = (found[0], found[1], backend)
+        if status == cp.OPTIMAL:
+            break
+    elapsed = time.perf_counter() - start
+    if best is None:
+        _logger.info(f"No backend found a split: {attempts}")
         raise ValueError("No Feasible solution for convex model")
-    return x.value.tolist()
+    return best[0].tolist(), SplitReport(best[2], elapsed, attempts)
 
 
 # Old functions
@@ -0,0 +1,330 @@
+# %%
+import json
+import logging
+from itertools import chain
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Union
+import networkx as nx
+import numpy as np
+from monty.io import zopen
+from entropic.graph import EDGE_COLUMNS, CSRGraph, _GraphBuilder
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+ROW_FORMAT_KEYS = ("settings", "data")
+# node kind for each list of names in the settings block
+_SETTINGS_KINDS = {
+    "chains": "chain",
+    "crosschain_dexs": "crosschain_dex",
+    "sourcechain_dexs": "sourcechain_dex",
+    "destinationchain_dexs": "destinationchain_dex",
+    "bridges": "bridge",
+}
+
+
+class _JSONStream:
+    """
+    Reads a JSON document one value at a time from a text file, keeping only the
+    unparsed tail of the file in memory.
+    """
+
+    def __init__(self, fp, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        The next non-whitespace character, or "" at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """
+        Consume the next character, which has to be one of chars
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next complete JSON value
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _open_object(fp, chunk_size: int) -> _JSONStream:
+    stream = _JSONStream(fp, chunk_size)
+    stream.expect("{")
+    return stream
+
+
+def iter_json_records(
+    filename, keys: Iterable[str] = ("edges", "nodes"), chunk_size: int = 1 << 20
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Stream the items of the top-level arrays of a JSON object without loading the document.
+    Compressed files are handled by monty.io.zopen.
+    Args:
+        filename: The JSON file, e.g. with "edges" and "nodes" lists
+        keys: The top-level keys to read, arrays are streamed item by item and any other
+            value is returned whole, the values of other keys are skipped
+        chunk_size: Number of characters read from the file at a time
+    Returns:
+        An iterator of (key, item) pairs in file order
+    """
+    keys = set(keys)
+    with zopen(filename, "rt") as fp:
+        stream = _open_object(fp, chunk_size)
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key in keys and stream.peek() == "[":
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.expect("]")
+                else:
+                    while True:
+                        yield key, stream.value()
+                        if stream.expect(",]") == "]":
+                            break
+            elif key in keys:
+                yield key, stream.value()
+            else:
+                stream.value()
+            if stream.expect(",}") == "}":
+                return
+
+
+def is_row_format(filename) -> bool:
+    """
+    Whether a JSON file uses the "settings"/"data" row format of the da_test_example files
+    rather than "edges"/"nodes" lists, judged from its first key
+    """
+    with zopen(filename, "rt") as fp:
+        stream = _open_object(fp, 1 << 12)
+        return stream.peek() == '"' and stream.value() in ROW_FORMAT_KEYS
+
+
+def graph_from_records(
+    records: Iterable[Tuple[str, dict]], liq_frac: float = 1, backend: str = "networkx"
+) -> Union[nx.Graph, CSRGraph]:
+    """
+    Build a graph from ("edges", edge_dict) and ("nodes", node_dict) pairs in any order,
+    each edge dict having "u" and "v" keys and each node dict a "name" key.
+    The node liquidity, scaled by liq_frac, is copied onto the source_liquidity and
+    target_liquidity of the edges. The networkx backend keeps the "u" and "v" of each edge
+    as attributes, nx.Graph itself does not remember the orientation that rate refers to.
+    Args:
+        records: The (key, dict) pairs, e.g. from iter_json_records
+        liq_frac: The fraction of liquidity allowed to be moved through each edge
+        backend: "networkx" for a nx.Graph or "csr" for a CSRGraph
+    Returns:
+        A nx.Graph or a CSRGraph
+    """
+    if backend == "csr":
+        builder = _GraphBuilder()
+        for key, item in records:
+            if key == "edges":
+                attrs = {k: val for k, val in item.items() if k not in ("u", "v")}
+                builder.add_edge(item["u"], item["v"], attrs)
+            else:
+                builder.add_node(item["name"], item)
+        graph = builder.build()
+        graph.set_endpoint_liquidity(liq_frac)
+        return graph
+    if backend != "networkx":
+        raise ValueError(f"Unknown graph backend: {backend}")
+    graph = nx.Graph()
+    for key, item in records:
+        if key == "edges":
+            # make sure the original data is preserved, nx.Graph forgets which way round
+            # the edge was given so u and v are kept as attributes
+            edge_kwargs = item.copy()
+            if graph.has_edge(item["u"], item["v"]):
+                # merged pools keep their first orientation, as in the csr backend
+                del edge_kwargs["u"], edge_kwargs["v"]
+            graph.add_edge(item["u"], item["v"], **edge_kwargs)
+        else:
+            graph.add_node(item["name"], **item)
+    for _, _, d in graph.edges(data=True):
+        d["source_liquidity"] = graph.nodes[d["u"]].get("liquidity", 0) * liq_frac
+        d["target_liquidity"] = graph.nodes[d["v"]].get("liquidity", 0) * liq_frac
+    return graph
+
+
+def graph_from_lists(
+    edge_list: Iterable[dict],
+    node_list: Iterable[dict],
+    liq_frac: float = 1,
+    backend: str = "networkx",
+) -> Union[nx.Graph, CSRGraph]:
+    """
+    Build a graph from lists of edge and node dicts, see graph_from_records
+    """
+    return graph_from_records(
+        chain(
+            (("edges", edge) for edge in edge_list),
+            (("nodes", node) for node in node_list),
+        ),
+        liq_frac=liq_frac,
+        backend=backend,
+    )
+
+
+def load_graph(
+    filename, liq_frac: float = 1, backend: str = "networkx", chunk_size: int = 1 << 20
+) -> Union[nx.Graph, CSRGraph]:
+    """
+    Stream a JSON file with "edges" and "nodes" lists into a graph. Only one edge or node
+    dict is decoded at a time, so the peak memory is the graph itself rather than the
+    whole document.
+    Args:
+        filename: The JSON file, optionally compressed
+        liq_frac: The fraction of liquidity allowed to be moved through each edge
+        backend: "networkx" for a nx.Graph or "csr" for a CSRGraph
+        chunk_size: Number of characters read from the file at a time
+    Returns:
+        A nx.Graph or a CSRGraph
+    """
+    records = iter_json_records(filename, ("edges", "nodes"), chunk_size=chunk_size)
+    return graph_from_records(records, liq_frac=liq_frac, backend=backend)
+
+
+def graph_from_rows(
+    rows: Iterable[list], settings: Optional[dict] = None, liq_frac: float = 1
+) -> CSRGraph:
+    """
+    Build a graph from (venue, source, destination, speed, fee, liquidity, rate) rows, each
+    row being one pool. Parallel pools between the same nodes are kept as separate edges.
+    The pool liquidity is split evenly in value between its two sides, giving
+    source_liquidity = liquidity / (2 * rate) and target_liquidity = liquidity / 2, both
+    scaled by liq_frac.
+    The settings block classifies the nodes: each node gets a "kind" (chain,
+    sourcechain_dex, destinationchain_dex, ...) and the "chain" it lives on, and edges whose
+    venue is one of the bridges get isBridge.
+    Args:
+        rows: The pool rows
+        settings: The settings block of the file
+        liq_frac: The fraction of liquidity allowed to be moved through each edge
+    Returns:
+        A CSRGraph allowing parallel edges
+    """
+    settings = settings or {}
+    index = {}
+    venue, u, v = [], [], []
+    numbers: List[list] = []
+    for row in rows:
+        name, source, destination = row[:3]
+        venue.append(name)
+        u.append(index.setdefault(source, len(index)))
+        v.append(index.setdefault(destination, len(index)))
+        numbers.append(row[3:])
+    values = np.array(numbers, dtype=np.float64).reshape(len(numbers), 4)
+    speed, fee, liquidity, rate = values.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        source_liquidity = np.where(rate > 0, 0.5 * liquidity / rate, 0.0)
+    venues = np.empty(len(venue), dtype=object)
+    venues[:] = venue
+    edge_data = {
+        "venue": venues,
+        "speed": speed.copy(),
+        "fee": fee.copy(),
+        "liquidity": liquidity.copy(),
+        "rate": rate.copy(),
+        "source_liquidity": source_liquidity * liq_frac,
+        "target_liquidity": 0.5 * liquidity * liq_frac,
+        "isBridge": np.isin(venues, list(settings.get("bridges", []))),
+    }
+    for key in EDGE_COLUMNS:
+        edge_data.setdefault(key, np.full(len(venue), np.nan))
+
+    nodes = list(index)
+    kinds = {
+        name: kind
+        for key, kind in _SETTINGS_KINDS.items()
+        for name in settings.get(key, [])
+    }
+    chains = list(settings.get("chains", []))
+    home = {}
+    if chains:
+        home.update({name: chains[0] for name in settings.get("sourcechain_dexs", [])})
+        home.update(
+            {name: chains[-1] for name in settings.get("destinationchain_dexs", [])}
+        )
+        home.update({name: name for name in chains})
+    node_data = {}
+    for key, lookup in (("kind", kinds), ("chain", home)):
+        column = np.empty(len(nodes), dtype=object)
+        column[:] = [lookup.get(name) for name in nodes]
+        node_data[key] = column
+    return CSRGraph(
+        nodes=nodes,
+        u=np.array(u, dtype=np.int32),
+        v=np.array(v, dtype=np.int32),
+        edge_data=edge_data,
+        node_data=node_data,
+        multi=True,
+    )
+
+
+def load_rows(
+    filename, liq_frac: float = 1, chunk_size: int = 1 << 20
+) -> Tuple[CSRGraph, dict]:
+    """
+    Stream a "settings"/"data" row format file, as written by scripts/generate_test_data.py,
+    into a graph, see graph_from_rows
+    Args:
+        filename: The JSON file, optionally compressed
+        liq_frac: The fraction of liquidity allowed to be moved through each edge
+        chunk_size: Number of characters read from the file at a time
+    Returns:
+        The graph and the settings block
+    """
+    settings = {}
+    rows = []
+    for key, item in iter_json_records(
+        filename, ROW_FORMAT_KEYS, chunk_size=chunk_size
+    ):
+        if key == "data":
+            rows.append(item)
+        else:
+            settings = item
+    return graph_from_rows(rows, settings, liq_frac=liq_frac), settings
@@ -0,0 +1,308 @@
+# %%
+import logging
+from typing import Dict, List, Optional
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from entropic.graph import CSRGraph
+from entropic.paths import PathEngine
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+
+def _walk(pred: np.ndarray, node: int, root: int) -> List[int]:
+    """
+    The path from node back to the root of a scipy predecessor row
+    """
+    path = [node]
+    while node != root:
+        node = int(pred[node])
+        if node < 0:
+            return []
+        path.append(node)
+    return path
+
+
+class _ChainTables:
+    """
+    Shortest-path trees rooted at the portals of one chain, restricted to its intra-chain
+    edges, in chain-local node ids.
+    """
+
+    def __init__(self, nodes: np.ndarray, portals: np.ndarray, matrix: csr_matrix):
+        self.nodes = nodes
+        self.portals = portals
+        self.matrix = matrix
+        self.local = {int(n): i for i, n in enumerate(nodes.tolist())}
+        if len(portals):
+            roots = [self.local[int(p)] for p in portals.tolist()]
+            self.dist, self.pred = dijkstra(
+                matrix, directed=False, indices=roots, return_predecessors=True
+            )
+        else:
+            self.dist = np.zeros((0, len(nodes)))
+            self.pred = np.zeros((0, len(nodes)), dtype=np.int32)
+
+    def path(self, row: int, node: int) -> List[int]:
+        """
+        The global node ids on the best path from a node to the portal of a tree row
+        """
+        root = self.local[int(self.portals[row])]
+        return self.nodes[_walk(self.pred[row], self.local[node], root)].tolist()
+
+
+class ChainOverlay:
+    """
+    Hierarchical router over a graph partitioned by chain.
+    The endpoints of bridge edges are the portals of their chain. For every chain the best
+    intra-chain paths from each portal are precomputed, which gives an overlay graph made of
+    the bridge edges and one shortcut per pair of portals of a chain. A query attaches the
+    source and target to the portals of their chains and searches the overlay only, then
+    expands each overlay hop back into nodes.
+    Shortest paths are exact. With k > 1 the k cheapest overlay paths narrow the search down to
+    the chains they go through.
+    A weight change inside a chain only recomputes that chain's trees, a change of a bridge
+    only touches the overlay.
+    """
+
+    def __init__(self, graph: CSRGraph, weights: np.ndarray):
+        """
+        Args:
+            graph: The graph, with chains given by graph.chain_index()
+            weights: The weight of each edge
+        """
+        self.graph = graph
+        self.weights = np.asarray(weights, dtype=np.float64).copy()
+        if np.any(self.weights < 0):
+            raise ValueError("Path searches need non-negative edge weights")
+        index = graph.chain_index()
+        # nodes of unknown chain get a partition of their own
+        self.partition = index.chain_id.astype(np.int64)
+        unknown = np.flatnonzero(self.partition < 0)
+        self.partition[unknown] = len(index.chains) + np.arange(len(unknown))
+        pu, pv = self.partition[graph.u], self.partition[graph.v]
+        self.bridge_mask = index.bridge_mask | (pu != pv)
+        self.edge_chain = np.where(self.bridge_mask, -1, pu)
+        portals = np.unique(
+            np.concatenate([graph.u[self.bridge_mask], graph.v[self.bridge_mask]])
+        )
+        self.is_portal = np.zeros(graph.num_nodes, dtype=bool)
+        self.is_portal[portals] = True
+        self.builds: Dict[int, int] = {}
+        self._tables: Dict[int, _ChainTables] = {}
+        for chain in np.unique(self.partition).tolist():
+            self._build_chain(chain)
+        self._overlay: Optional[dict] = None
+
+    def _build_chain(self, chain: int):
+        """
+        Recompute the portal trees of one chain
+        """
+        graph = self.graph
+        nodes = np.flatnonzero(self.partition == chain)
+        local = np.full(graph.num_nodes, -1, dtype=np.int64)
+        local[nodes] = np.arange(len(nodes))
+        edges = np.flatnonzero(self.edge_chain == chain)
+        rows = np.concatenate([local[graph.u[edges]], local[graph.v[edges]]])
+        cols = np.concatenate([local[graph.v[edges]], local[graph.u[edges]]])
+        data = np.concatenate([self.weights[edges]] * 2)
+        # keep the cheapest of any parallel edges
+        order = np.lexsort((data, cols, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        matrix = csr_matrix(
+            (data[first], (rows[first], cols[first])), shape=(len(nodes), len(nodes))
+        )
+        portals = nodes[self.is_portal[nodes]]
+        self._tables[chain] = _ChainTables(nodes, portals, matrix)
+        self.builds[chain] = self.builds.get(chain, 0) + 1
+        self._overlay = None
+
+    def update(self, edges, weights):
+        """
+        Change the weights of some edges, recomputing only the chains they belong to
+        Args:
+            edges: The ids of the changed edges
+            weights: The new weight of each of those edges
+        Returns:
+            The chain partitions that were recomputed
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        if np.any(weights < 0):
+            raise ValueError("Path searches need non-negative edge weights")
+        changed = self.weights[edges] != weights
+        edges, weights = edges[changed], weights[changed]
+        self.weights[edges] = weights
+        chains = sorted(set(self.edge_chain[edges].tolist()) - {-1})
+        for chain in chains:
+            self._build_chain(chain)
+        if len(edges):
+            self._overlay = None
+        return chains
+
+    def _base_overlay(self) -> dict:
+        """
+        The overlay edges between portals as {(a, b): (weight, hop)}, a hop being
+        ("bridge", None) or ("chain", chain)
+        """
+        if self._overlay is not None:
+            return self._overlay
+        overlay = {}
+
+        def offer(a, b, weight, hop):
+            pair = (a, b) if a < b else (b, a)
+            if pair not in overlay or weight < overlay[pair][0]:
+                overlay[pair] = (weight, hop)
+
+        graph = self.graph
+        for e in np.flatnonzero(self.bridge_mask).tolist():
+            offer(int(graph.u[e]), int(graph.v[e]), float(self.weights[e]), ("bridge",))
+        for chain, tables in self._tables.items():
+            portals = tables.portals.tolist()
+            for i, a in enumerate(portals):
+                for j in range(i + 1, len(portals)):
+                    weight = float(tables.dist[i, tables.local[portals[j]]])
+                    if np.isfinite(weight):
+                        offer(a, portals[j], weight, ("chain", chain))
+        self._overlay = overlay
+        return overlay
+
+    def _expand(self, a: int, b: int, hop: tuple) -> List[int]:
+        """
+        The nodes of an overlay hop from a to b, both included
+        """
+        if hop[0] == "bridge":
+            return [a, b]
+        tables = self._tables[hop[1]]
+        if hop[0] == "direct":
+            _, pred = dijkstra(
+                tables.matrix,
+                directed=False,
+                indices=tables.local[a],
+                return_predecessors=True,
+            )
+            path = _walk(pred, tables.local[b], tables.local[a])[::-1]
+            return tables.nodes[path].tolist()
+        portals = tables.portals.tolist()
+        if a in portals:
+            return tables.path(portals.index(a), b)[::-1]
+        return tables.path(portals.index(b), a)
+
+    def _query_overlay(self, source: int, target: int):
+        """
+        The overlay with the source and target attached to the portals of their chains
+        Returns:
+            The overlay edges {(a, b): (weight, hop)}, the overlay graph with global node ids
+            as names and its path engine
+        """
+        edges = dict(self._base_overlay())
+
+        def offer(a, b, weight, hop):
+            pair = (a, b) if a < b else (b, a)
+            if np.isfinite(weight) and (pair not in edges or weight < edges[pair][0]):
+                edges[pair] = (weight, hop)
+
+        for node in (source, target):
+            chain = int(self.partition[node])
+            tables = self._tables[chain]
+            for row, portal in enumerate(tables.portals.tolist()):
+                if portal != node:
+                    weight = float(tables.dist[row, tables.local[node]])
+                    offer(node, portal, weight, ("chain", chain))
+        if self.partition[source] == self.partition[target]:
+            chain = int(self.partition[source])
+            tables = self._tables[chain]
+            weight = dijkstra(
+                tables.matrix,
+                directed=False,
+                indices=tables.local[source],
+            )[tables.local[target]]
+            offer(source, target, float(weight), ("direct", chain))
+
+        pairs = list(edges)
+        names = sorted({n for pair in pairs for n in pair} | {source, target})
+        position = {n: i for i, n in enumerate(names)}
+        overlay = CSRGraph(
+            nodes=names,
+            u=np.array([position[a] for a, _ in pairs], dtype=np.int32),
+            v=np.array([position[b] for _, b in pairs], dtype=np.int32),
+        )
+        engine = PathEngine(overlay, np.array([edges[p][0] for p in pairs]))
+        return edges, overlay, engine
+
+    def shortest_path(self, source: int, target: int) -> Optional[List[int]]:
+        """
+        The exact shortest path, found on the overlay and expanded back into nodes
+        Args:
+            source: The source node id
+            target: The target node id
+        Returns:
+            The path as a list of node ids, None if the target cannot be reached
+        """
+        if source == target:
+            return [source]
+        edges, overlay, engine = self._query_overlay(source, target)
+        s, t = overlay.ids([source, target])
+        # with zero weights an overlay path may expand to a non-simple path
+        for overlay_path in engine.k_shortest_paths(s, t, 2):
+            hops = overlay.names(overlay_path)
+            path = [source]
+            for a, b in zip(hops[:-1], hops[1:]):
+                pair = (a, b) if a < b else (b, a)
+                path.extend(self._expand(a, b, edges[pair][1])[1:])
+            if len(set(path)) == len(path):
+                return path
+        return None
+
+    def k_shortest_paths(self, source: int, target: int, k: int) -> List[List[int]]:
+        """
+        Find up to k simple paths. The k cheapest overlay paths pick the chains worth
+        searching, then Yen's algorithm runs on the subgraph of those chains only.
+        Args:
+            source: The source node id
+            target: The target node id
+            k: The number of paths
+        Returns:
+            The paths as lists of node ids, cheapest first
+        """
+        if k == 1 or source == target:
+            best = self.shortest_path(source, target)
+            return [] if best is None else [best]
+        _, overlay, engine = self._query_overlay(source, target)
+        s, t = overlay.ids([source, target])
+        chains = {
+            int(self.partition[node])
+            for overlay_path in engine.k_shortest_paths(s, t, k)
+            for node in overlay.names(overlay_path)
+        }
+        if not chains:
+            return []
+        graph = self.graph
+        nodes = np.flatnonzero(np.isin(self.partition, list(chains)))
+        local = np.full(graph.num_nodes, -1, dtype=np.int64)
+        local[nodes] = np.arange(len(nodes))
+        edges = np.flatnonzero((local[graph.u] >= 0) & (local[graph.v] >= 0))
+        corridor = CSRGraph(
+            nodes=nodes.tolist(), u=local[graph.u[edges]], v=local[graph.v[edges]]
+        )
+        paths = PathEngine(corridor, self.weights[edges]).k_shortest_paths(
+            int(local[source]), int(local[target]), k
+        )
+        return [nodes[path].tolist() for path in paths]
+
+    def path_costs(self, paths: List[List[int]]) -> List[float]:
+        """
+        The cost of node paths with the current weights, using the cheapest parallel edge
+        """
+        graph = self.graph
+        costs = []
+        for path in paths:
+            total = 0.0
+            for a, b in zip(path[:-1], path[1:]):
+                total += float(self.weights[graph.edge_ids(a, b)].min())
+            costs.append(total)
+        return costs
@@ -0,0 +1,491 @@
+# %%
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from entropic.cache import LRUCache
+from entropic.graph import CSRGraph
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+# the state shared by the worker processes, set once per process by the pool initializer
+_WORKER_MATRIX: Optional[csr_matrix] = None
+_WORKER_ENGINE: Optional["PathEngine"] = None
+
+
+def weight_matrix(graph: CSRGraph, weights: np.ndarray) -> csr_matrix:
+    """
+    Symmetric sparse matrix of edge weights, keeping the cheapest of any parallel edges.
+    Args:
+        graph: The graph
+        weights: The weight of each edge
+    Returns:
+        A num_nodes x num_nodes scipy csr_matrix
+    """
+    rows = np.concatenate([graph.u, graph.v])
+    cols = np.concatenate([graph.v, graph.u])
+    data = np.concatenate([weights, weights])
+    order = np.lexsort((data, cols, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    shape = (graph.num_nodes, graph.num_nodes)
+    matrix = csr_matrix((data[first], (rows[first], cols[first])), shape=shape)
+    matrix.sort_indices()
+    return matrix
+
+
+def repair_tree(
+    matrix: csr_matrix,
+    dist: List[float],
+    nxt: List[int],
+    changes: List[Tuple[int, int, float, float]],
+):
+    """
+    Repair a shortest-path tree in place after some edge weights changed, touching only
+    the part of the tree that is affected.
+    Nodes whose tree path used an edge that got more expensive are detached and re-attached
+    from their unaffected neighbours, then the new distances are propagated Dijkstra-style
+    from the detached nodes and from the endpoints of the edges that got cheaper.
+    Args:
+        matrix: The symmetric weight matrix, already holding the new weights
+        dist: The distance of every node to the root
+        nxt: The next hop of every node towards the root, -1 for the root and unreachable nodes
+        changes: (a, b, old weight, new weight) for every changed node pair
+    """
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+
+    def neighbors(node):
+        for slot in range(indptr[node], indptr[node + 1]):
+            yield int(indices[slot]), float(data[slot])
+
+    detached = []
+    for a, b, old, new in changes:
+        if new <= old:
+            continue
+        for x, y in ((a, b), (b, a)):
+            if nxt[x] == y:
+                detached.append(x)
+    affected = set()
+    if detached:
+        children: Dict[int, List[int]] = {}
+        for node, hop in enumerate(nxt):
+            if hop >= 0:
+                children.setdefault(hop, []).append(node)
+        stack = detached
+        while stack:
+            node = stack.pop()
+            if node not in affected:
+                affected.add(node)
+                stack.extend(children.get(node, []))
+        for node in affected:
+            dist[node], nxt[node] = np.inf, -1
+
+    heap = []
+    for node in affected:
+        for nbr, w in neighbors(node):
+            if nbr not in affected and dist[nbr] + w < dist[node]:
+                dist[node], nxt[node] = dist[nbr] + w, nbr
+        if dist[node] < np.inf:
+            heapq.heappush(heap, (dist[node], node))
+    for a, b, old, new in changes:
+        if new >= old:
+            continue
+        for x, y in ((a, b), (b, a)):
+            if dist[y] + new < dist[x]:
+                dist[x], nxt[x] = dist[y] + new, y
+                heapq.heappush(heap, (dist[x], x))
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        for nbr, w in neighbors(node):
+            if d + w < dist[nbr]:
+                dist[nbr], nxt[nbr] = d + w, node
+                heapq.heappush(heap, (d + w, nbr))
+
+
+def _tree_path(nxt: List[int], node: int, target: int) -> List[int]:
+    """
+    Follow the next hops of a shortest-path tree from a node to its root
+    """
+    path = [node]
+    while path[-1] != target:
+        path.append(nxt[path[-1]])
+    return path
+
+
+class PathEngine:
+    """
+    Weighted k shortest simple paths (Yen's algorithm) over a CSRGraph.
+
+    The shortest-path tree rooted at each target is computed once and cached, keeping the
+    max_trees most recently used targets. Every spur
+    search of Yen's algorithm uses the distances in that tree as an exact A* heuristic
+    (removing nodes and edges can only make paths longer) and stops as soon as it reaches a
+    node whose tree path to the target is not blocked, so most spur searches only touch a
+    handful of nodes. Banned nodes and edges are checked on the fly, the graph is never copied.
+    """
+
+    def __init__(
+        self,
+        graph: CSRGraph,
+        weights: Optional[np.ndarray] = None,
+        max_trees: int = 256,
+    ):
+        """
+        Args:
+            graph: The graph to search
+            weights: The weight of each edge, None to count hops
+            max_trees: Maximum number of shortest-path trees kept, each holds two lists of
+                num_nodes values and is repaired by every update_weights
+        """
+        if weights is None:
+            weights = np.ones(graph.num_edges)
+        weights = np.asarray(weights, dtype=np.float64)
+        if np.any(weights < 0):
+            raise ValueError("Path searches need non-negative edge weights")
+        self.graph = graph
+        self.weights = weights
+        self._weight_list = weights.tolist()
+        self.matrix = weight_matrix(graph, weights)
+        self._trees = LRUCache(maxsize=max_trees)
+
+    def reverse_tree(self, target: int) -> Tuple[List[float], List[int]]:
+        """
+        The shortest-path tree rooted at the target
+        Args:
+            target: The root node id
+        Returns:
+            The distance to the target and the next hop towards the target for every node,
+            unreachable nodes have an infinite distance and a next hop of -1
+        """
+        tree = self._trees.get(target)
+        if tree is None:
+            dist, pred = dijkstra(
+                self.matrix, directed=True, indices=target, return_predecessors=True
+            )
+            pred[pred < 0] = -1
+            tree = (dist.tolist(), pred.tolist())
+            self._trees.put(target, tree)
+        return tree
+
+    def _spur_path(
+        self,
+        source: int,
+        target: int,
+        banned_nodes: Set[int],
+        banned_pairs: Set[Tuple[int, int]],
+    ) -> Optional[Tuple[float, List[int]]]:
+        """
+        A* search from source to target using the reverse tree as heuristic
+        Returns:
+            The cost and the list of node ids of the path, None if there is no path
+        """
+        indptr, indices, slot_edge = self.graph.adjacency()
+        weights = self._weight_list
+        h, nxt = self.reverse_tree(target)
+        if h[source] == np.inf:
+            return None
+        g = {source: 0.0}
+        prev = {source: -1}
+        done = set()
+        heap = [(h[source], source)]
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            tail = self._unblocked_tail(nxt, node, target, banned_nodes, banned_pairs)
+            if tail is not None:
+                path = [node]
+                while prev[path[-1]] != -1:
+                    path.append(prev[path[-1]])
+                return g[node] + h[node], path[::-1] + tail[1:]
+            for slot in range(indptr[node], indptr[node + 1]):
+                nbr = indices[slot]
+                if nbr in done or nbr in banned_nodes or (node, nbr) in banned_pairs:
+                    continue
+                ng = g[node] + weights[slot_edge[slot]]
+                if ng < g.get(nbr, np.inf) and h[nbr] < np.inf:
+                    g[nbr] = ng
+                    prev[nbr] = node
+                    heapq.heappush(heap, (ng + h[nbr], nbr))
+        return None
+
+    @staticmethod
+    def _unblocked_tail(nxt, node, target, banned_nodes, banned_pairs):
+        """
+        The tree path from node to the target, None if it uses a banned node or pair
+        """
+        if nxt[node] == -1 and node != target:
+            return None
+        path = _tree_path(nxt, node, target)
+        if any(n in banned_nodes for n in path[1:]):
+            return None
+        if any(pair in banned_pairs for pair in zip(path[:-1], path[1:])):
+            return None
+        return path
+
+    def update_weights(
+        self, edges: List[int], weights: np.ndarray
+    ) -> List[Tuple[int, int, float, float]]:
+        """
+        Change the weight of some edges and repair the cached shortest-path trees
+        Args:
+            edges: The edge ids
+            weights: The new weight of each edge
+        Returns:
+            (a, b, old weight, new weight) for every node pair whose cheapest edge changed
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        if np.any(weights < 0):
+            raise ValueError("Path searches need non-negative edge weights")
+        self.weights[edges] = weights
+        for e, w in zip(edges, weights.tolist()):
+            self._weight_list[e] = w
+        indptr, indices, slot_edge = self.graph.adjacency()
+        matrix = self.matrix
+        changes = []
+        for a, b in {
+            tuple(sorted(p)) for p in zip(self.graph.u[edges], self.graph.v[edges])
+        }:
+            a, b = int(a), int(b)
+            new = min(
+                self._weight_list[slot_edge[slot]]
+                for slot in range(indptr[a], indptr[a + 1])
+                if indices[slot] == b
+            )
+            for x, y in ((a, b), (b, a)):
+                start = matrix.indptr[x]
+                pos = start + np.searchsorted(
+                    matrix.indices[start : matrix.indptr[x + 1]], y
+                )
+                old = float(matrix.data[pos])
+                matrix.data[pos] = new
+            if old != new:
+                changes.append((a, b, old, new))
+        if changes:
+            for dist, nxt in self._trees.values():
+                repair_tree(matrix, dist, nxt, changes)
+        return changes
+
+    def k_shortest_paths_many(
+        self, source: int, queries: List[Tuple[int, int]]
+    ) -> List[List[List[int]]]:
+        """
+        Answer several queries from the same source. The graph is undirected, so each query is
+        searched from its target towards the source and all of them share the single
+        shortest-path tree rooted at the source.
+        Args:
+            source: The source node id
+            queries: (target, k) for every query
+        Returns:
+            The k shortest paths from the source for every query
+        """
+        return [
+            [ip[::-1] for ip in self.k_shortest_paths(target, source, k)]
+            for target, k in queries
+        ]
+
+    def path_cost(self, path: List[int]) -> float:
+        """
+        Cost of a path, using the cheapest of any parallel edges between consecutive nodes
+        """
+        return float(sum(self.matrix[a, b] for a, b in zip(path[:-1], path[1:])))
+
+    def k_shortest_paths(self, source: int, target: int, k: int) -> List[List[int]]:
+        """
+        Find the k shortest simple paths between two nodes
+        Args:
+            source: The source node id
+            target: The target node id
+            k: Total number of paths to report
+        Returns:
+            A list of paths sorted by cost, each path a list of node ids
+        """
+        first = self._spur_path(source, target, set(), set())
+        if first is None or k < 1:
+            return []
+        found = [first[1]]
+        candidates: List[Tuple[float, List[int]]] = []
+        seen = {tuple(first[1])}
+        while len(found) < k:
+            last = found[-1]
+            root_cost = 0.0
+            for i in range(len(last) - 1):
+                root = last[: i + 1]
+                banned_pairs = set()
+                for path in found:
+                    if path[: i + 1] == root:
+                        banned_pairs.add((path[i], path[i + 1]))
+                        banned_pairs.add((path[i + 1], path[i]))
+                spur = self._spur_path(last[i], target, set(root[:-1]), banned_pairs)
+                if spur is not None:
+                    path = root[:-1] + spur[1]
+                    if tuple(path) not in seen:
+                        seen.add(tuple(path))
+                        heapq.heappush(candidates, (root_cost + spur[0], path))
+                root_cost += self.matrix[last[i], last[i + 1]]
+            if not candidates:
+                break
+            found.append(heapq.heappop(candidates)[1])
+        return found
+
+
+def _init_batch_worker(graph: CSRGraph, weights: np.ndarray):
+    global _WORKER_ENGINE
+    _WORKER_ENGINE = PathEngine(graph, weights)
+
+
+def _batch_group(task: Tuple[int, List[Tuple[int, int]]]) -> List[List[List[int]]]:
+    return _WORKER_ENGINE.k_shortest_paths_many(*task)
+
+
+def k_shortest_paths_batch(
+    engine: PathEngine,
+    tasks: List[Tuple[int, List[Tuple[int, int]]]],
+    workers: Optional[int] = None,
+) -> List[List[List[List[int]]]]:
+    """
+    Run groups of same-source queries, optionally over a process pool. Each worker receives
+    the graph and weights once, when it starts, and builds its own engine.
+    Args:
+        engine: The engine to use in process, or to copy into the workers
+        tasks: (source, [(target, k), ...]) for every group of queries
+        workers: Number of processes, None to run in process
+    Returns:
+        The paths for every query of every group, see PathEngine.k_shortest_paths_many
+    """
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        return [engine.k_shortest_paths_many(*task) for task in tasks]
+    with ProcessPoolExecutor(
+        workers,
+        initializer=_init_batch_worker,
+        initargs=(engine.graph, engine.weights),
+    ) as pool:
+        chunksize = max(1, len(tasks) // (4 * workers))
+        return list(pool.map(_batch_group, tasks, chunksize=chunksize))
+
+
+def _init_index_worker(matrix: csr_matrix):
+    global _WORKER_MATRIX
+    _WORKER_MATRIX = matrix
+
+
+def _index_rows(roots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    dist, pred = dijkstra(
+        _WORKER_MATRIX, directed=True, indices=roots, return_predecessors=True
+    )
+    return dist, pred.astype(np.int32)
+
+
+class RouteIndex:
+    """
+    Precomputed all-pairs routing table.
+    Row t of the tables is the shortest-path tree rooted at node t: dist[t, s] is the cost of
+    the best path between s and t and nxt[t, s] is the next hop from s towards t. Memory grows
+    as num_nodes ** 2, which is fine for token graphs of a few thousand nodes.
+    """
+
+    def __init__(self, matrix: csr_matrix, dist: np.ndarray, nxt: np.ndarray):
+        """
+        Args:
+            matrix: The symmetric weight matrix the tables were computed from
+            dist: The num_nodes x num_nodes distance table
+            nxt: The num_nodes x num_nodes next-hop table, -1 where there is no path
+        """
+        self.matrix = matrix
+        self.dist = dist
+        self.nxt = nxt
+
+    @classmethod
+    def build(
+        cls, matrix: csr_matrix, workers: Optional[int] = None, chunk_size: int = 256
+    ) -> "RouteIndex":
+        """
+        Run one vectorized multi-source Dijkstra per chunk of roots
+        Args:
+            matrix: The symmetric weight matrix, see weight_matrix
+            workers: Number of processes to spread the chunks over, None to stay in process
+            chunk_size: Number of roots per Dijkstra call
+        Returns:
+            A RouteIndex
+        """
+        num_nodes = matrix.shape[0]
+        chunks = np.array_split(
+            np.arange(num_nodes), max(1, -(-num_nodes // chunk_size))
+        )
+        if workers is None or workers <= 1:
+            _init_index_worker(matrix)
+            rows = [_index_rows(chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(
+                workers, initializer=_init_index_worker, initargs=(matrix,)
+            ) as pool:
+                rows = list(pool.map(_index_rows, chunks))
+        dist = np.vstack([d.reshape(-1, num_nodes) for d, _ in rows])
+        nxt = np.vstack([p.reshape(-1, num_nodes) for _, p in rows])
+        nxt[nxt < 0] = -1
+        return cls(matrix, dist, nxt)
+
+    def distance(self, source: int, target: int) -> float:
+        return float(self.dist[target, source])
+
+    def path(self, source: int, target: int) -> Optional[List[int]]:
+        """
+        Read the best path off the next-hop table
+        Returns:
+            The list of node ids, None if the nodes are not connected
+        """
+        if source != target and self.nxt[target, source] < 0:
+            return None
+        return _tree_path(self.nxt[target].tolist(), source, target)
+
+    def update(self, changes: List[Tuple[int, int, float, float]]) -> int:
+        """
+        Refresh the tables after some weights changed, the matrix must already hold the new
+        weights. The trees that can be affected are found with one vectorized test over all
+        roots and only those are repaired.
+        Args:
+            changes: (a, b, old weight, new weight) for every changed node pair
+        Returns:
+            The number of trees that were repaired
+        """
+        stale = np.zeros(len(self.dist), dtype=bool)
+        for a, b, old, new in changes:
+            if new > old:
+                stale |= (self.nxt[:, a] == b) | (self.nxt[:, b] == a)
+            elif new < old:
+                stale |= self.dist[:, b] + new < self.dist[:, a]
+                stale |= self.dist[:, a] + new < self.dist[:, b]
+        roots = np.flatnonzero(stale)
+        for root in roots:
+            repair_tree(self.matrix, self.dist[root], self.nxt[root], changes)
+        return len(roots)
+
+
+def k_shortest_paths(
+    graph: CSRGraph,
+    source: int,
+    target: int,
+    k: int,
+    weights: Optional[np.ndarray] = None,
+) -> List[List[int]]:
+    """
+    Yen's algorithm for the k shortest simple paths between two nodes.
+    Args:
+        graph: The graph to search
+        source: The source node id
+        target: The target node id
+        k: Total number of paths to report
+        weights: The weight of each edge, None to count hops
+    Returns:
+        A list of paths sorted by cost, each path a list of node ids
+    """
+    return PathEngine(graph, weights).k_shortest_paths(source, target, k)
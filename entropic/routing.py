@@ -0,0 +1,287 @@
+# %%
+from dataclasses import dataclass, field
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from entropic.graph import CSRGraph
+from entropic.liquidity import collapse_path, exchange_function, marginal_split_paths
+from entropic.paths import PathEngine
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AmountRoute:
+    """
+    A path together with the amount it delivers for a given input
+    Args:
+        nodes: The nodes visited
+        edges: The pool used for each hop
+        amount_out: The amount of the target asset received
+    """
+
+    nodes: list
+    edges: List[int]
+    amount_out: float
+
+
+class AmountRouter:
+    """
+    Finds the paths that deliver the most output for a given input amount, the output of a
+    path being exchange_function applied pool by pool with the input of each hop reduced by
+    the pool fee.
+    The search is a best-first branch and bound over simple paths. A partial path holding an
+    amount a at node n can deliver at most a times the best product of spot rates from n to
+    the target (every pool gives less than its spot rate) and never more than the deepest
+    pool into the target holds. Partial paths are expanded in order of that bound, so complete
+    paths come out best first and the search stops after k of them.
+    Partial paths reaching a node are expanded in order of the amount they hold there, and
+    only the k best labels of every node are expanded, the others cannot lead to a better
+    route except by avoiding nodes those k labels used.
+    """
+
+    def __init__(self, graph: CSRGraph, fee_scale: float = 1.0):
+        """
+        Args:
+            graph: The graph, with "source_liquidity", "target_liquidity" and "fee" columns
+            fee_scale: Multiplies the fee column to get the fee as a fraction
+        """
+        self.graph = graph
+        self.fee_scale = fee_scale
+        data = graph.edge_data
+        fee = np.nan_to_num(data["fee"].astype(np.float64)) * fee_scale
+        self.keep = np.clip(1 - fee, 0, 1)
+        self.liq_u = np.nan_to_num(data["source_liquidity"].astype(np.float64))
+        self.liq_v = np.nan_to_num(data["target_liquidity"].astype(np.float64))
+        self._keep = self.keep.tolist()
+        self._liq_u = self.liq_u.tolist()
+        self._liq_v = self.liq_v.tolist()
+        self._u = graph.u.tolist()
+        self._bounds: Dict[tuple, tuple] = {}
+
+    def hop_output(self, e: int, node: int, amount: float) -> float:
+        """
+        The output of swapping an amount through pool e, entering it from node
+        """
+        l1, l2 = self._liq_u[e], self._liq_v[e]
+        if self._u[e] != node:
+            l1, l2 = l2, l1
+        if l1 <= 0 or l2 <= 0:
+            return 0.0
+        return float(exchange_function(amount * self._keep[e], l1, l2))
+
+    def _target_bounds(self, target: int, max_hops: Optional[int] = None):
+        """
+        The best product of spot rates from every node to the target over at most max_hops
+        pools, and the most any pool into the target can pay out
+        """
+        cached = self._bounds.get((target, max_hops))
+        if cached is not None:
+            return cached
+        graph = self.graph
+        valid = (self.liq_u > 0) & (self.liq_v > 0) & (self.keep > 0)
+        u, v = graph.u[valid], graph.v[valid]
+        keep, liq_u, liq_v = self.keep[valid], self.liq_u[valid], self.liq_v[valid]
+        # Bellman-Ford from the target over the reversed arcs, relaxing all arcs per round
+        src = np.concatenate([v, u])
+        dst = np.concatenate([u, v])
+        weight = -np.log(np.concatenate([keep * liq_v / liq_u, keep * liq_u / liq_v]))
+        dist = np.full(graph.num_nodes, np.inf)
+        dist[target] = 0.0
+        # after r rounds dist covers every walk of at most r pools
+        rounds = graph.num_nodes if max_hops is None else max_hops
+        for _ in range(rounds):
+            new = dist.copy()
+            np.minimum.at(new, dst, dist[src] + weight)
+            if np.array_equal(new, dist):
+                break
+            dist = new
+        else:
+            if max_hops is None:
+                # an arbitrage loop makes the rate product unbounded, keep the liquidity cap
+                dist = np.where(np.isfinite(dist), -np.inf, np.inf)
+        rate = np.exp(-dist)
+        cap = max(
+            [liq_v[i] for i in np.flatnonzero(v == target)]
+            + [liq_u[i] for i in np.flatnonzero(u == target)],
+            default=0.0,
+        )
+        self._bounds[(target, max_hops)] = (rate.tolist(), float(cap))
+        return self._bounds[(target, max_hops)]
+
+    def best_routes(
+        self,
+        source: int,
+        target: int,
+        amount: float,
+        k: int = 1,
+        max_hops: Optional[int] = None,
+    ) -> List[AmountRoute]:
+        """
+        Find the k simple paths with the highest output for an input amount
+        Args:
+            source: The source node id
+            target: The target node id
+            amount: The amount of the source asset to swap
+            k: The number of paths
+            max_hops: The maximum number of pools on a path, None for no limit
+        Returns:
+            Up to k AmountRoute, highest output first
+        """
+        rate, cap = self._target_bounds(target, max_hops)
+        indptr, indices, slot_edge = self.graph.adjacency()
+
+        def bound(node, out):
+            return out if node == target else min(out * rate[node], cap)
+
+        routes: List[AmountRoute] = []
+        settled = [0] * self.graph.num_nodes
+        heap = [(-bound(source, amount), -amount, source, (source,), ())]
+        while heap and len(routes) < k:
+            _, held, node, nodes, edges = heapq.heappop(heap)
+            held = -held
+            if settled[node] >= k:
+                continue
+            settled[node] += 1
+            if node == target:
+                routes.append(AmountRoute(list(nodes), list(edges), held))
+                continue
+            if max_hops is not None and len(edges) >= max_hops:
+                continue
+            best: Dict[int, tuple] = {}
+            for slot in range(indptr[node], indptr[node + 1]):
+                nbr, e = indices[slot], slot_edge[slot]
+                if nbr in nodes or rate[nbr] == 0 or settled[nbr] >= k:
+                    continue
+                out = self.hop_output(e, node, held)
+                # parallel pools: only the one paying the most is worth following
+                if out > 0 and (nbr not in best or out > best[nbr][0]):
+                    best[nbr] = (out, e)
+            for nbr, (out, e) in best.items():
+                heapq.heappush(
+                    heap, (-bound(nbr, out), -out, nbr, nodes + (nbr,), edges + (e,))
+                )
+        return routes
+
+
+@dataclass
+class Quote:
+    """
+    The result of Router.quote
+    Args:
+        nodes: The nodes of each path
+        edges: The pool used for each hop of each path
+        split: The amount sent through each path
+        outputs: The amount of the target asset each path delivers
+        amount_out: The total amount of the target asset received
+        timings: Seconds spent in each stage: "paths", "curves", "split", "estimate" and
+            "total"
+    """
+
+    nodes: List[list]
+    edges: List[List[int]]
+    split: np.ndarray
+    outputs: np.ndarray
+    amount_out: float
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class Router:
+    """
+    Quotes an order end to end on integer ids and arrays:
+        1. paths: the k shortest paths of a PathEngine, using the cheapest of parallel pools
+        2. curves: each path collapsed into one constant product pool (collapse_path)
+        3. split: the amount split exactly over the collapsed pools (marginal_split_paths)
+        4. estimate: the split swapped path after path through the pools, so that paths
+           sharing a pool see the reserves left by the previous ones
+    """
+
+    def __init__(self, engine: PathEngine, fee_scale: float = 1.0):
+        """
+        Args:
+            engine: The path engine, over a graph with "source_liquidity",
+                "target_liquidity" and "fee" columns
+            fee_scale: Multiplies the fee column to get the fee as a fraction
+        """
+        self.engine = engine
+        self.graph = engine.graph
+        self.fee_scale = fee_scale
+        data = self.graph.edge_data
+        fee = np.nan_to_num(data["fee"].astype(np.float64)) * fee_scale
+        self.fee = np.clip(fee, 0, 1)
+        self.liq_u = np.nan_to_num(data["source_liquidity"].astype(np.float64))
+        self.liq_v = np.nan_to_num(data["target_liquidity"].astype(np.float64))
+
+    def _hops(self, path: List[int]) -> List[int]:
+        """
+        The cheapest pool of each hop of a node path
+        """
+        weights = self.engine.weights
+        return [
+            min(self.graph.edge_ids(a, b), key=lambda e: weights[e])
+            for a, b in zip(path[:-1], path[1:])
+        ]
+
+    def quote(self, source: int, target: int, amount: float, k: int = 3) -> Quote:
+        """
+        Split an amount of the source asset over the k shortest paths to the target
+        Args:
+            source: The source node id
+            target: The target node id
+            amount: The amount of the source asset to swap
+            k: The number of paths
+        Returns:
+            A Quote, with no paths if the target cannot be reached
+        """
+        timings = {}
+        start = stage = time.perf_counter()
+
+        def lap(name):
+            nonlocal stage
+            now = time.perf_counter()
+            timings[name] = now - stage
+            stage = now
+
+        paths = self.engine.k_shortest_paths(source, target, k)
+        edges = [self._hops(path) for path in paths]
+        lap("paths")
+
+        liq_in, liq_out = np.zeros(len(paths)), np.zeros(len(paths))
+        for i, (path, hops) in enumerate(zip(paths, edges)):
+            hops = np.array(hops, dtype=np.int64)
+            forward = self.graph.u[hops] == np.array(path[:-1])
+            liq1 = np.where(forward, self.liq_u[hops], self.liq_v[hops])
+            liq2 = np.where(forward, self.liq_v[hops], self.liq_u[hops])
+            if np.all(liq1 > 0) and np.all(liq2 > 0) and np.all(self.fee[hops] < 1):
+                liq_in[i], liq_out[i] = collapse_path(liq1, liq2, self.fee[hops])
+        usable = liq_in > 0
+        lap("curves")
+
+        split = np.zeros(len(paths))
+        if usable.any():
+            split[usable] = marginal_split_paths(
+                amount, liq_in[usable], liq_out[usable]
+            )
+        lap("split")
+
+        reserves: Dict[int, list] = {}
+        outputs = np.zeros(len(paths))
+        for i, (path, hops) in enumerate(zip(paths, edges)):
+            held = split[i]
+            if held <= 0:
+                continue
+            for node, e in zip(path[:-1], hops):
+                pool = reserves.setdefault(e, [self.liq_u[e], self.liq_v[e]])
+                side = 0 if self.graph.u[e] == node else 1
+                paid = held * (1 - self.fee[e])
+                held = float(exchange_function(paid, pool[side], pool[1 - side]))
+                pool[side] += paid
+                pool[1 - side] -= held
+            outputs[i] = held
+        lap("estimate")
+        timings["total"] = stage - start
+        return Quote(paths, edges, split, outputs, float(outputs.sum()), timings)
@@ -0,0 +1,106 @@
+# %%
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Tuple
+import numpy as np
+from monty.json import MontyDecoder, MontyEncoder
+from entropic.graph import CSRGraph
+
+__author__ = "jmmshn" "Ajk009"
+
+_logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "dexa-snapshot"
+SNAPSHOT_VERSION = 1
+_HEADER = "header.json"
+_ARRAYS = ("u", "v", "indptr", "indices", "slot_edge")
+
+
+def _save_columns(path: Path, prefix: str, columns: Dict[str, np.ndarray]) -> list:
+    """
+    Write the numeric and boolean columns as .npy files, object columns go in the header
+    """
+    entries = []
+    for i, (key, column) in enumerate(columns.items()):
+        if column.dtype == object:
+            entries.append({"name": key, "values": column.tolist()})
+            continue
+        filename = f"{prefix}_{i}.npy"
+        np.save(path / filename, column, allow_pickle=False)
+        entries.append({"name": key, "file": filename})
+    return entries
+
+
+def _load_columns(path: Path, entries: list, mmap_mode) -> Dict[str, np.ndarray]:
+    columns = {}
+    for entry in entries:
+        if "file" in entry:
+            columns[entry["name"]] = np.load(path / entry["file"], mmap_mode=mmap_mode)
+        else:
+            column = np.empty(len(entry["values"]), dtype=object)
+            column[:] = entry["values"]
+            columns[entry["name"]] = column
+    return columns
+
+
+def save_snapshot(graph: CSRGraph, path, metadata: dict = None):
+    """
+    Write a graph to a snapshot directory: one raw .npy file per array (endpoints, CSR
+    adjacency and attribute columns) and a JSON header with the format version, the node
+    names and the object columns.
+    Args:
+        graph: The graph to save
+        path: The snapshot directory, created if needed
+        metadata: Extra JSON-serializable values stored in the header
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name in _ARRAYS:
+        np.save(path / f"{name}.npy", getattr(graph, name), allow_pickle=False)
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "nodes": graph.nodes,
+        "multi": graph.multi,
+        "edge_columns": _save_columns(path, "edge", graph.edge_data),
+        "node_columns": _save_columns(path, "node", graph.node_data),
+        "metadata": metadata or {},
+    }
+    with open(path / _HEADER, "w") as fp:
+        json.dump(header, fp, cls=MontyEncoder)
+
+
+def load_snapshot(path, mmap: bool = True) -> Tuple[CSRGraph, dict]:
+    """
+    Open a snapshot written by save_snapshot. With mmap the arrays are memory-mapped
+    copy-on-write, so processes opening the same snapshot share its pages through the page
+    cache and only the pages of edited columns are copied.
+    Args:
+        path: The snapshot directory
+        mmap: Memory-map the arrays instead of reading them into memory
+    Returns:
+        The graph and the metadata stored with it
+    """
+    path = Path(path)
+    with open(path / _HEADER) as fp:
+        header = json.load(fp, cls=MontyDecoder)
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not a DEXA snapshot")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot version {header.get('version')}, "
+            f"expected {SNAPSHOT_VERSION}"
+        )
+    mmap_mode = "c" if mmap else None
+    arrays = {
+        name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in _ARRAYS
+    }
+    graph = CSRGraph.from_arrays(
+        nodes=header["nodes"],
+        edge_data=_load_columns(path, header["edge_columns"], mmap_mode),
+        node_data=_load_columns(path, header["node_columns"], mmap_mode),
+        multi=header["multi"],
+        **arrays,
+    )
+    return graph, header["metadata"]
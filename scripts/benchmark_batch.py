@@ -0,0 +1,50 @@
+"""
+Benchmark the throughput of DEXA.get_pathways_batch for different numbers of worker processes.
+Uses a copy of test_files/da_test_example_0.json that is 100x larger.
+"""
+
+import os
+from pathlib import Path
+import random
+import time
+from monty.serialization import loadfn
+from entropic.core import DEXA
+
+TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
+COPIES = 100
+NUM_QUERIES = 400
+NUM_SOURCES = 20
+K = 5
+
+rows = loadfn(TEST_FILES_DIR / "da_test_example_0.json")["data"]
+edges = []
+for i in range(COPIES):
+    for venue, u, v, speed, fee, liquidity, rate in rows:
+        u = u if u.startswith("chain") else f"{u}#{i}"
+        v = v if v.startswith("chain") else f"{v}#{i}"
+        edges.append({"u": u, "v": v, "fee": fee + 1})
+dexa = DEXA.from_list(edges, [], backend="csr")
+dexa.assign_weight(lambda d: d["fee"])
+
+random.seed(0)
+nodes = dexa.csr.nodes
+sources = random.sample(nodes, NUM_SOURCES)
+queries = [
+    (random.choice(sources), random.choice(nodes), K) for _ in range(NUM_QUERIES)
+]
+print(f"{dexa.csr.num_nodes} nodes, {dexa.csr.num_edges} edges, {len(queries)} queries")
+
+start = time.perf_counter()
+for source, target, k in queries:
+    dexa.get_pathways(source, target, k)
+elapsed = time.perf_counter() - start
+print(f"  get_pathways loop      {len(queries) / elapsed:8.1f} queries/s")
+
+workers = 1
+while workers <= (os.cpu_count() or 1):
+    dexa.route_cache.clear()
+    start = time.perf_counter()
+    dexa.get_pathways_batch(queries, workers=workers)
+    elapsed = time.perf_counter() - start
+    print(f"  batch, {workers:2d} workers     {len(queries) / elapsed:8.1f} queries/s")
+    workers *= 2
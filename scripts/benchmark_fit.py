@@ -0,0 +1,44 @@
+"""
+Benchmark the batched exchange fit against fitting each curve with curve_fit in a loop.
+"""
+
+import time
+import warnings
+import numpy as np
+from entropic.liquidity import (
+    _fit_func,
+    exchange_fit_params,
+    exchange_fit_params_batch,
+    exchange_function,
+)
+
+x = np.linspace(0, 100, 100)
+rng = np.random.default_rng(0)
+warnings.simplefilter("ignore")
+
+for n in [10, 100, 1000]:
+    liq1 = rng.lognormal(5, 2, n)
+    liq2 = rng.lognormal(5, 2, n)
+
+    start = time.perf_counter()
+    loop_err = []
+    for l1, l2 in zip(liq1, liq2):
+        try:
+            params = exchange_fit_params(x, l1, l2)
+            fit = _fit_func(x, *params)
+            loop_err.append(np.sqrt(np.mean((fit - exchange_function(x, l1, l2)) ** 2)))
+        except RuntimeError:
+            loop_err.append(np.inf)
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, batch_err = exchange_fit_params_batch(x, liq1, liq2)
+    t_batch = time.perf_counter() - start
+
+    loop_err = np.nan_to_num(np.array(loop_err) / liq2, nan=np.inf)
+    batch_err = batch_err / liq2
+    print(
+        f"{n:5d} curves:  loop {t_loop * 1e3:9.1f} ms  batch {t_batch * 1e3:7.1f} ms"
+        f"  median rms/liq2 loop {np.median(loop_err):.2e} batch {np.median(batch_err):.2e}"
+        f"  batch at least as good on {np.mean(batch_err <= loop_err * (1 + 1e-6)):.0%}"
+    )
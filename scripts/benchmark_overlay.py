@@ -0,0 +1,65 @@
+"""
+Benchmark single path queries on the chain overlay against a search over the whole graph.
+Each synthetic chain is a random graph of tokens and a few bridges join random chains.
+"""
+
+import time
+import networkx as nx
+import numpy as np
+from entropic.graph import CSRGraph
+from entropic.overlay import ChainOverlay
+from entropic.paths import PathEngine
+
+TOKENS_PER_CHAIN = 500
+BRIDGES_PER_CHAIN = 4
+QUERIES = 200
+
+
+def chains_graph(num_chains, seed=0):
+    rng = np.random.default_rng(seed)
+    edges = []
+    for c in range(num_chains):
+        graph = nx.connected_watts_strogatz_graph(TOKENS_PER_CHAIN, 6, 0.3, seed=c)
+        for a, b in graph.edges():
+            edges.append(
+                {"u": f"C{c}:T{a}", "v": f"C{c}:T{b}", "w": rng.uniform(1, 20)}
+            )
+    for _ in range(BRIDGES_PER_CHAIN * num_chains):
+        c1, c2 = rng.choice(num_chains, 2, replace=False)
+        token = rng.integers(TOKENS_PER_CHAIN)
+        edges.append(
+            {"u": f"C{c1}:T{token}", "v": f"C{c2}:T{token}", "w": rng.uniform(1, 20)}
+        )
+    return CSRGraph.from_lists(edges, [])
+
+
+for num_chains in [2, 5, 10, 20]:
+    graph = chains_graph(num_chains)
+    weights = graph.edge_weights("w")
+    rng = np.random.default_rng(1)
+    queries = rng.choice(graph.num_nodes, (QUERIES, 2))
+
+    start = time.perf_counter()
+    overlay = ChainOverlay(graph, weights)
+    t_build = time.perf_counter() - start
+
+    # a fresh engine per query, each query needs a new shortest-path tree
+    start = time.perf_counter()
+    for source, target in queries:
+        PathEngine(graph, weights).k_shortest_paths(source, target, 1)
+    t_full = (time.perf_counter() - start) / QUERIES
+
+    start = time.perf_counter()
+    for source, target in queries:
+        overlay.shortest_path(source, target)
+    t_overlay = (time.perf_counter() - start) / QUERIES
+
+    edge = int(np.flatnonzero(overlay.edge_chain == 0)[0])
+    start = time.perf_counter()
+    overlay.update([edge], [weights[edge] * 2])
+    t_update = time.perf_counter() - start
+    print(
+        f"{num_chains:3d} chains, {graph.num_nodes} nodes, {overlay.is_portal.sum()} portals:"
+        f"  build {t_build * 1e3:8.1f} ms  full {t_full * 1e3:7.2f} ms/query"
+        f"  overlay {t_overlay * 1e3:7.2f} ms/query  one-chain update {t_update * 1e3:6.2f} ms"
+    )
@@ -0,0 +1,77 @@
+"""
+Benchmark the k-shortest-paths engine behind DEXA.get_pathways against networkx.
+Uses the graphs in test_files/da_test_example_*.json and copies of them 100x larger.
+"""
+
+from itertools import islice
+from pathlib import Path
+import time
+import networkx as nx
+from monty.serialization import loadfn
+from entropic.graph import CSRGraph
+from entropic.paths import PathEngine
+
+TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
+K_VALUES = [5, 10, 20, 50]
+SCALE = 100
+REPEATS = 3
+
+
+def load_edges(filename, copies=1):
+    """
+    Turn the (venue, source, destination, speed, fee, liquidity, rate) rows into edge dicts.
+    Each copy gets its own DEX nodes but shares the two chain nodes.
+    """
+    rows = loadfn(filename)["data"]
+    edges = []
+    for i in range(copies):
+        for venue, u, v, speed, fee, liquidity, rate in rows:
+            if copies > 1:
+                u = u if u.startswith("chain") else f"{u}#{i}"
+                v = v if v.startswith("chain") else f"{v}#{i}"
+            edges.append(
+                {"u": u, "v": v, "fee": fee + 1, "liquidity": liquidity, "rate": rate}
+            )
+    return edges
+
+
+def best_of(func):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+for filename in sorted(TEST_FILES_DIR.glob("da_test_example_*.json")):
+    for copies in [1, SCALE]:
+        edges = load_edges(filename, copies)
+        csr = CSRGraph.from_lists(edges, [])
+        graph = csr.to_networkx()
+        source, target = csr.ids(["chain0", "chain1"])
+        print(
+            f"{filename.name} x{copies}: {csr.num_nodes} nodes, {csr.num_edges} edges"
+        )
+        for k in K_VALUES:
+            t_nx = best_of(
+                lambda: list(
+                    islice(
+                        nx.shortest_simple_paths(graph, "chain0", "chain1", "fee"), k
+                    )
+                )
+            )
+            # a fresh engine per call includes building the reverse shortest-path tree
+            t_cold = best_of(
+                lambda: PathEngine(csr, csr.edge_weights("fee")).k_shortest_paths(
+                    source, target, k
+                )
+            )
+            engine = PathEngine(csr, csr.edge_weights("fee"))
+            engine.k_shortest_paths(source, target, k)
+            t_warm = best_of(lambda: engine.k_shortest_paths(source, target, k))
+            print(
+                f"  k={k:3d}  networkx {t_nx * 1e3:9.2f} ms"
+                f"  engine (cold) {t_cold * 1e3:9.2f} ms"
+                f"  engine (warm) {t_warm * 1e3:9.2f} ms"
+            )
@@ -0,0 +1,48 @@
+"""
+Benchmark re-quoting a split with a compiled SplitOptimizer against building the cvxpy
+problem on every call, as convex_model used to.
+"""
+
+import time
+import cvxpy as cp
+import numpy as np
+from entropic.liquidity import SplitOptimizer, exchange_fit_params_batch
+
+QUOTES = 50
+
+
+def rebuild(amt, A, B, C, D, S):
+    x = cp.Variable(len(A))
+    y = cp.multiply(A, cp.sqrt(cp.multiply(B, x) + C)) + D
+    cp.Problem(
+        cp.Maximize(cp.sum(y)), [cp.sum(x) == amt, y >= cp.multiply(S, x)]
+    ).solve()
+    return x.value
+
+
+rng = np.random.default_rng(0)
+grid = np.linspace(0, 100, 100)
+for n in [2, 5, 10, 20]:
+    params, _ = exchange_fit_params_batch(
+        grid, rng.lognormal(6, 1, n), rng.lognormal(6, 1, n)
+    )
+    A, B, C, D = params.T
+    S = np.zeros(n)
+    amounts = rng.uniform(10, 100, QUOTES)
+
+    start = time.perf_counter()
+    for amt in amounts:
+        rebuild(amt, A, B, C, D, S)
+    t_rebuild = (time.perf_counter() - start) / QUOTES
+
+    optimizer = SplitOptimizer(n)
+    start = time.perf_counter()
+    for amt in amounts:
+        optimizer.solve(amt, A, B, C, D, S)
+    t_compiled = (time.perf_counter() - start) / QUOTES
+    timings = optimizer.timings
+    print(
+        f"{n:3d} paths:  rebuild {t_rebuild * 1e3:6.2f} ms/quote  compiled {t_compiled * 1e3:6.2f} ms/quote"
+        f"  (first compile {timings['compile'] * 1e3:6.2f} ms, last compile"
+        f" {timings['last_compile'] * 1e3:5.2f} ms, last solve {timings['last_solve'] * 1e3:5.2f} ms)"
+    )
@@ -0,0 +1,80 @@
+# %%
+import pytest
+from entropic.arbitrage import ArbitrageDetector
+from entropic.core import DEXA
+from entropic.graph import CSRGraph
+
+
+@pytest.fixture
+def triangle():
+    """
+    Returns a graph with one profitable cycle a -> b -> c -> a and a dangling edge to d.
+    """
+    edges = [
+        {"u": "a", "v": "b", "rate": 2.0, "fee": 0.0},
+        {"u": "b", "v": "c", "rate": 2.0, "fee": 0.0},
+        {"u": "c", "v": "a", "rate": 0.3, "fee": 0.0},
+        {"u": "c", "v": "d", "rate": 1.0, "fee": 0.0},
+    ]
+    return CSRGraph.from_lists(edges, [])
+
+
+def test_find_cycles(triangle):
+    """
+    Test that the detector finds the profitable cycle and drops it once a fee removes the profit.
+    """
+    detector = ArbitrageDetector(triangle)
+    cycles = detector.run()
+    assert len(cycles) == 1
+    assert cycles[0].profit == pytest.approx(0.2)
+    assert set(cycles[0].nodes) == {0, 1, 2}
+    assert cycles[0].nodes[0] == cycles[0].nodes[-1]
+
+    # a fee on one of the swaps removes the opportunity
+    detector.graph.set_edge_value(2, "fee", 0.5)
+    assert detector.update([2]) == []
+    assert detector.cycles == []
+
+
+def test_dexa_incremental_arbitrage():
+    """
+    An edge update should surface a new cycle, the same one a full pass finds.
+    """
+    dexa = DEXA.from_list(
+        [
+            {"u": "a", "v": "b", "rate": 2.0, "fee": 0.01},
+            {"u": "b", "v": "c", "rate": 2.0, "fee": 0.01},
+            {"u": "c", "v": "a", "rate": 0.25, "fee": 0.01},
+            {"u": "c", "v": "d", "rate": 1.0, "fee": 0.01},
+        ],
+        [],
+        backend="csr",
+    )
+    assert dexa.find_arbitrage_cycles() == []
+    dexa.update_edges([{"u": "c", "v": "a", "rate": 0.3}])
+    cycles = dexa.find_arbitrage_cycles()
+    assert len(cycles) == 1
+    assert set(cycles[0].nodes) == {"a", "b", "c"}
+    assert cycles[0].profit == pytest.approx(1.2 * 0.99**3 - 1)
+    full = dexa.find_arbitrage_cycles(incremental=False)
+    assert [c.profit for c in full] == pytest.approx([c.profit for c in cycles])
+
+
+@pytest.mark.parametrize("backend", ["networkx", "csr"])
+def test_no_arbitrage_backends(backend):
+    """
+    A fair loop has no arbitrage on either backend, nx.Graph must not flip the rates
+    """
+    dexa = DEXA.from_list(
+        [
+            {"u": "a", "v": "b", "rate": 2.0, "fee": 0.0},
+            {"u": "b", "v": "c", "rate": 2.0, "fee": 0.0},
+            {"u": "c", "v": "a", "rate": 0.25, "fee": 0.0},
+        ],
+        [],
+        backend=backend,
+    )
+    assert dexa.find_arbitrage_cycles() == []
+    dexa.update_edges([{"u": "c", "v": "a", "rate": 0.3}])
+    (cycle,) = dexa.find_arbitrage_cycles()
+    assert cycle.profit == pytest.approx(0.2)
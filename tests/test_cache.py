@@ -0,0 +1,77 @@
+# %%
+import numpy as np
+import pytest
+from entropic.cache import FitCache, LRUCache
+from entropic.liquidity import exchange_fit_params, exchange_fit_params_batch
+
+
+def test_lru_cache():
+    """
+    Check the eviction order and the counters
+    """
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.invalidate(lambda key, value: value == 3) == 1
+    assert cache.stats == {
+        "hits": 1,
+        "misses": 1,
+        "evictions": 1,
+        "size": 1,
+        "hit_rate": pytest.approx(0.5),
+    }
+    expiring = LRUCache(ttl=0)
+    expiring.put("a", 1)
+    assert expiring.get("a") is None
+    assert expiring.evictions == 1
+
+
+def test_fit_cache(tmp_path):
+    """
+    Pools of nearly the same liq1 share a fit, and saved fits are found again after a restart
+    """
+    x = np.linspace(0, 100, 100)
+    path = tmp_path / "fits.npz"
+    cache = FitCache(rel_tol=1e-3, path=path)
+    params = cache.params(x, [102.0, 102.01, 40.0], [50.0, 80.0, 3.0])
+    assert cache.stats["fits"] == 2
+    ref, _ = exchange_fit_params_batch(x, [102.0, 40.0], [50.0, 3.0])
+    assert params[[0, 2]] == pytest.approx(ref, rel=1e-2)
+    assert params[1] == pytest.approx(params[0] * [1.6, 1, 1, 1.6])
+    cache.save()
+
+    restarted = FitCache(rel_tol=1e-3, path=path)
+    assert restarted.params(x, 40.0, 3.0) == pytest.approx(params[[2]])
+    assert restarted.stats["fits"] == 0
+    assert restarted.stats["hit_rate"] == 1.0
+    # another grid is another entry
+    restarted.params(x * 2, 40.0, 3.0)
+    assert restarted.stats["fits"] == 1
+
+    # the file is written under the given name, with or without a suffix
+    restarted.save(tmp_path / "fits")
+    assert FitCache(rel_tol=1e-3, path=tmp_path / "fits").stats["size"] == 3
+    with pytest.raises(ValueError):
+        FitCache().save()
+
+
+def test_exchange_fit_params_cache(monkeypatch):
+    """
+    With a cache only the first call fits and curve_fit is never used
+    """
+    x = np.linspace(0, 100, 100)
+    cache = FitCache()
+
+    def no_curve_fit(*args, **kwargs):
+        raise AssertionError("curve_fit should not be called")
+
+    monkeypatch.setattr("entropic.liquidity.curve_fit", no_curve_fit)
+    first = exchange_fit_params(x, 100.0, 80.0, cache=cache)
+    second = exchange_fit_params(x, 100.0, 80.0, cache=cache)
+    assert first == pytest.approx(second)
+    assert cache.stats["fits"] == 1
+    assert cache.stats["hits"] == 1
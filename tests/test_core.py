@@ -1,6 +1,8 @@
 # %%
 from pathlib import Path
+import networkx as nx
 import pytest
+from monty.serialization import loadfn
 from entropic.core import DEXA
 
 TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
@@ -48,3 +50,222 @@ def test_paths(dexa):
     for ip in paths:
         assert ip[0] == "Ethereum:SUSHI"
         assert ip[-1] == "Polygon:BIFI"
+
+
+def test_csr_backend(files, dexa):
+    """
+    The array-backed graph should hold the same graph as the networkx one and find valid paths
+    """
+    compact = DEXA.from_file(files["nodes_edges"], backend="csr")
+    assert compact.graph is None
+    assert set(compact.to_networkx().edges()) == set(dexa.graph.edges())
+    compact.assign_weight(lambda d: d["fee"])
+    assert (
+        compact.csr.edge_data["weight"].tolist()
+        == compact.csr.edge_data["fee"].tolist()
+    )
+    paths = compact.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5)
+    assert len(paths) == 5
+    assert len({tuple(ip) for ip in paths}) == 5
+    for ip in paths:
+        assert ip[0] == "Ethereum:SUSHI"
+        assert ip[-1] == "Polygon:BIFI"
+        assert len(set(ip)) == len(ip)
+
+
+def test_weighted_paths(dexa):
+    """
+    The paths should be sorted by the weight written by assign_weight
+    """
+    dexa.assign_weight(lambda d: d["fee"])
+    paths = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 10)
+    costs = [nx.path_weight(dexa.graph, ip, "weight") for ip in paths]
+    assert costs == sorted(costs)
+    assert paths[0] == nx.dijkstra_path(
+        dexa.graph, "Ethereum:SUSHI", "Polygon:BIFI", "weight"
+    )
+
+
+def test_route_cache(dexa):
+    """
+    Repeated queries are served from the cache until the weights change
+    """
+    first = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5)
+    assert dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5) == first
+    dexa.get_pathways("Ethereum:MATIC", "Polygon:MATIC", 1)
+    assert dexa.route_cache.hits == 1
+    assert dexa.route_cache.misses == 2
+    # only the routes through the changed edge are dropped
+    dexa.invalidate_routes([("Polygon:MATIC", "Ethereum:MATIC")])
+    assert len(dexa.route_cache) == 1
+    dexa.assign_weight(lambda d: d["fee"])
+    assert len(dexa.route_cache) == 0
+    dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5)
+    assert dexa.route_cache.misses == 3
+
+
+def test_update_edges(files, dexa):
+    """
+    Patching the graph in place should give the same routes as rebuilding it
+    """
+    dexa.assign_weight(lambda d: d["fee"] / (1 + d["target_liquidity"]))
+    dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5)
+    dexa.update_edges(
+        [
+            {"u": "Ethereum:ETH", "v": "Polygon:BIFI", "fee": 1e9},
+            {"u": "Ethereum:SUSHI", "v": "Ethereum:USDC", "fee": 1.0},
+        ]
+    )
+    dexa.update_nodes([{"name": "Polygon:ETH", "liquidity": 1e9}])
+    assert dexa.graph.nodes["Polygon:ETH"]["liquidity"] == 1e9
+    assert dexa.graph.edges["Ethereum:ETH", "Polygon:ETH"]["target_liquidity"] == 1e9
+
+    data = loadfn(files["nodes_edges"])
+    for edge in data["edges"]:
+        if {edge["u"], edge["v"]} == {"Ethereum:ETH", "Polygon:BIFI"}:
+            edge["fee"] = 1e9
+        if {edge["u"], edge["v"]} == {"Ethereum:SUSHI", "Ethereum:USDC"}:
+            edge["fee"] = 1.0
+    for node in data["nodes"]:
+        if node["name"] == "Polygon:ETH":
+            node["liquidity"] = 1e9
+    rebuilt = DEXA.from_list(data["edges"], data["nodes"], backend="csr")
+    rebuilt.assign_weight(lambda d: d["fee"] / (1 + d["target_liquidity"]))
+    for u, v, d in dexa.graph.edges(data=True):
+        (e,) = rebuilt.csr.edge_ids(*rebuilt.csr.ids([u, v]))
+        ends = rebuilt.csr.names([rebuilt.csr.u[e], rebuilt.csr.v[e]])
+        assert ends == [d["u"], d["v"]]
+        for key, value in d.items():
+            if key not in ("u", "v"):
+                assert rebuilt.csr.edge_dict(e)[key] == pytest.approx(value)
+    assert dexa.get_pathways(
+        "Ethereum:SUSHI", "Polygon:BIFI", 5
+    ) == rebuilt.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5)
+
+
+def test_route_index(dexa):
+    """
+    Single path queries answered from the index should match the online search
+    """
+    dexa.assign_weight(lambda d: d["fee"])
+    dexa.build_route_index()
+    (best,) = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 1)
+    assert best == dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 2)[0]
+    dexa.update_edges([{"u": best[0], "v": best[1], "fee": 1e9}])
+    (best,) = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 1)
+    assert best == nx.dijkstra_path(
+        dexa.graph, "Ethereum:SUSHI", "Polygon:BIFI", "weight"
+    )
+
+
+def test_hierarchical_paths_only(dexa):
+    """
+    Updates should drop cached overlay routes even when no flat search was made
+    """
+    dexa.assign_weight(lambda d: d["fee"])
+    (old,) = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 1, hierarchical=True)
+    dexa.update_edges([{"u": old[0], "v": old[1], "fee": 1e9}])
+    (best,) = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 1, hierarchical=True)
+    assert best != old
+    assert best == nx.dijkstra_path(
+        dexa.graph, "Ethereum:SUSHI", "Polygon:BIFI", "weight"
+    )
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_pathways_batch(dexa, workers):
+    """
+    Batched queries come back in order with the same costs as single queries
+    """
+    dexa.assign_weight(lambda d: d["fee"])
+    queries = [
+        ("Ethereum:SUSHI", "Polygon:BIFI", 5),
+        ("Ethereum:DAI", "Polygon:AAVE", 3),
+        ("Ethereum:SUSHI", "Polygon:ANY", 4),
+        ("Polygon:MATIC", "Ethereum:USDT", 2),
+    ]
+    results = dexa.get_pathways_batch(queries, workers=workers)
+    dexa.route_cache.clear()
+    for (source, target, k), paths in zip(queries, results):
+        expected = dexa.get_pathways(source, target, k)
+        assert len(paths) == k
+        assert [ip[0] for ip in paths] == [source] * k
+        assert [ip[-1] for ip in paths] == [target] * k
+        assert [
+            nx.path_weight(dexa.graph, ip, "weight") for ip in paths
+        ] == pytest.approx(
+            [nx.path_weight(dexa.graph, ip, "weight") for ip in expected]
+        )
+    # the second batch is served from the route cache
+    hits = dexa.route_cache.hits
+    dexa.get_pathways_batch(queries)
+    assert dexa.route_cache.hits == hits + len(queries)
+
+
+@pytest.mark.parametrize("backend", ["networkx", "csr"])
+def test_vectorized_weights(files, backend):
+    """
+    Vectorized weight functions should match the per-edge ones and several schemes can be
+    stored side by side
+    """
+    dexa = DEXA.from_file(files["nodes_edges"], backend=backend)
+    dexa.assign_weight(lambda d: d["fee"] / (1 + d["source_liquidity"]), name="slow")
+    dexa.assign_weight(
+        lambda c: c["fee"] / (1 + c["source_liquidity"]), name="fast", vectorized=True
+    )
+    dexa.assign_weight(lambda c: c["fee"], name="fee_only", vectorized=True)
+    graph = dexa.to_networkx()
+    for _, _, d in graph.edges(data=True):
+        assert d["fast"] == pytest.approx(d["slow"])
+    for name in ["fast", "fee_only"]:
+        (best,) = dexa.get_pathways("Ethereum:SUSHI", "Polygon:AAVE", 1, weight=name)
+        assert nx.path_weight(graph, best, name) == pytest.approx(
+            nx.dijkstra_path_length(graph, "Ethereum:SUSHI", "Polygon:AAVE", name)
+        )
+    dexa.update_nodes([{"name": "Ethereum:SUSHI", "liquidity": 0}])
+    for _, _, d in dexa.to_networkx().edges(data=True):
+        assert d["fast"] == pytest.approx(d["slow"])
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_snapshot(files, dexa, tmp_path, mmap):
+    """
+    A snapshot should give back the same graph as from_file and stay editable
+    """
+    compact = DEXA.from_file(files["nodes_edges"], liq_frac=0.5, backend="csr")
+    compact.save_snapshot(tmp_path / "snap")
+    loaded = DEXA.load_snapshot(tmp_path / "snap", mmap=mmap)
+    assert loaded.liq_frac == 0.5
+    assert loaded.csr.nodes == compact.csr.nodes
+    for attr in ("u", "v", "indptr", "indices", "slot_edge"):
+        assert (getattr(loaded.csr, attr) == getattr(compact.csr, attr)).all()
+    for e in range(compact.csr.num_edges):
+        assert loaded.csr.edge_dict(e) == compact.csr.edge_dict(e)
+    assert loaded.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5) == (
+        compact.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 5)
+    )
+    graph = loaded.to_networkx()
+    assert set(map(frozenset, graph.edges())) == set(map(frozenset, dexa.graph.edges()))
+    for u, v, d in dexa.graph.edges(data=True):
+        assert {k: graph.edges[u, v][k] for k in d if "liquidity" not in k} == {
+            k: val for k, val in d.items() if "liquidity" not in k
+        }
+    loaded.update_edges([{"u": "Ethereum:ETH", "v": "Ethereum:USDC", "fee": 1.0}])
+    assert DEXA.load_snapshot(tmp_path / "snap").csr.edge_dict(0)["fee"] != 1.0
+
+
+def test_hierarchical_paths(dexa):
+    """
+    Routing on the chain overlay should give paths as cheap as the full search
+    """
+    dexa.assign_weight(lambda d: d["fee"])
+    full = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 3)
+    paths = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 3, hierarchical=True)
+    assert [nx.path_weight(dexa.graph, ip, "weight") for ip in paths] == [
+        nx.path_weight(dexa.graph, ip, "weight") for ip in full
+    ]
+    dexa.update_edges([{"u": full[0][0], "v": full[0][1], "fee": 1e9}])
+    (best,) = dexa.get_pathways("Ethereum:SUSHI", "Polygon:BIFI", 1, hierarchical=True)
+    assert best == nx.dijkstra_path(
+        dexa.graph, "Ethereum:SUSHI", "Polygon:BIFI", "weight"
+    )
@@ -0,0 +1,47 @@
+# %%
+from pathlib import Path
+import numpy as np
+import pytest
+from entropic.core import DEXA
+from entropic.flow import edge_flow_model
+from entropic.graph import CSRGraph
+from entropic.liquidity import collapse_path, marginal_split_paths, path_output
+
+TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
+
+
+def test_disjoint_paths():
+    """
+    Without shared pools the flow model is the split over independent paths
+    """
+    liquidity = {"A": 100.0, "B": 120.0, "C": 300.0, "D": 150.0}
+    nodes = [{"name": name, "liquidity": liq} for name, liq in liquidity.items()]
+    pairs = [("A", "B"), ("B", "D"), ("A", "C"), ("D", "C")]
+    graph = CSRGraph.from_lists([{"u": u, "v": v, "fee": 0.0} for u, v in pairs], nodes)
+    a, b, c, d = graph.ids(["A", "B", "C", "D"])
+    flow = edge_flow_model(graph, [[a, b, d], [a, c, d]], 100.0)
+    # the collapsed pools of both paths
+    liq_in, liq_out = collapse_path(
+        np.array([[100.0, 120.0], [100.0, 300.0]]), np.array([[120.0, 150.0], [300.0, 150.0]])
+    )
+    split = marginal_split_paths(100.0, liq_in, liq_out)
+    expected = path_output(np.array(split), liq_in, liq_out).sum()
+    assert flow.amount_out == pytest.approx(expected, rel=1e-4)
+    assert len(flow.edges) == 4
+
+
+def test_shared_pools():
+    """
+    Paths sharing a pool should be routed through it once, at least as well as the
+    split that assumes independent paths
+    """
+    dexa = DEXA.from_file(TEST_FILES_DIR / "nodes_edges.json", backend="csr")
+    quote = dexa.quote("Ethereum:SUSHI", "Polygon:BIFI", 1e3, k=5, fee_scale=0)
+    flow = dexa.optimize_flow("Ethereum:SUSHI", "Polygon:BIFI", 1e3, k=5, fee_scale=0)
+    pools = {e for hops in quote.edges for e in hops}
+    assert len(flow.edges) < sum(len(hops) for hops in quote.edges)
+    assert pools <= set(flow.edges.tolist())
+    assert flow.amount_out >= quote.amount_out
+    # nothing is created along the way
+    spent = sum(i for i, t in zip(flow.inputs, flow.tails) if t == "Ethereum:SUSHI")
+    assert spent == pytest.approx(1e3, rel=1e-4)
@@ -0,0 +1,84 @@
+# %%
+from pathlib import Path
+import numpy as np
+import pytest
+from monty.serialization import loadfn
+from entropic.graph import CSRGraph
+
+TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
+
+
+@pytest.fixture
+def data():
+    return loadfn(TEST_FILES_DIR / "nodes_edges.json")
+
+
+def test_csr_matches_networkx(data):
+    """
+    The compact graph should hold the same edges and attributes as the nx.Graph built by DEXA
+    """
+    from entropic.core import DEXA
+
+    csr = CSRGraph.from_lists(data["edges"], data["nodes"])
+    graph = DEXA.from_list(data["edges"], data["nodes"]).graph
+    assert csr.num_nodes == graph.number_of_nodes()
+    assert csr.num_edges == graph.number_of_edges()
+    assert csr.edge_data["fee"].dtype == np.float64
+    # every edge is stored once from each endpoint
+    assert csr.indptr[-1] == 2 * csr.num_edges
+    pairs = {
+        (csr.nodes[a], csr.nodes[b]): e for e, (a, b) in enumerate(zip(csr.u, csr.v))
+    }
+    for _, _, d in graph.edges(data=True):
+        # both keep the orientation the edge was given in
+        e = pairs[(d["u"], d["v"])]
+        for key, value in d.items():
+            if key not in ("u", "v"):
+                assert csr.edge_dict(e)[key] == pytest.approx(value)
+    round_trip = csr.to_networkx()
+    assert set(round_trip.edges()) == set(graph.edges())
+
+
+def test_multi_edges():
+    """
+    Parallel pools are only merged when the graph is not a multigraph
+    """
+    edges = [
+        {"u": "a", "v": "b", "fee": 1},
+        {"u": "b", "v": "a", "fee": 2},
+        {"u": "b", "v": "c", "fee": 3, "isBridge": True},
+    ]
+    nodes = [{"name": "a", "liquidity": 10}]
+    merged = CSRGraph.from_lists(edges, nodes)
+    assert merged.num_edges == 2
+    assert merged.edge_data["fee"].tolist() == [2, 3]
+    assert merged.edge_data["isBridge"].tolist() == [False, True]
+    assert merged.edge_data["source_liquidity"].tolist() == [10, 0]
+    multi = CSRGraph.from_lists(edges, nodes, multi=True)
+    assert multi.num_edges == 3
+    assert multi.to_networkx().number_of_edges() == 3
+
+
+def test_chain_index(data):
+    """
+    Chains, tokens and bridges should be looked up by id instead of splitting node names
+    """
+    csr = CSRGraph.from_lists(data["edges"], data["nodes"])
+    index = csr.chain_index()
+    assert index.chains == ["Ethereum", "Polygon"]
+    assert [csr.nodes[i] for i in index.chain_nodes("Polygon")] == [
+        n for n in csr.nodes if n.startswith("Polygon:")
+    ]
+    assert sorted(csr.names(index.token_nodes("ETH"))) == [
+        "Ethereum:ETH",
+        "Polygon:ETH",
+    ]
+    crossing = {
+        frozenset((e["u"], e["v"]))
+        for e in data["edges"]
+        if e["u"].split(":")[0] != e["v"].split(":")[0]
+    }
+    assert {
+        frozenset(csr.names([csr.u[e], csr.v[e]])) for e in index.bridge_edges
+    } == crossing
+    assert index.chain_of(index.token_nodes("MATIC")) == ["Ethereum", "Polygon"]
@@ -1,10 +1,29 @@
 # %%
 from pathlib import Path
+import cvxpy as cp
 import numpy as np
 import pytest
 import random
 from monty.serialization import loadfn
-from entropic.liquidity import convex_model, exchange_fit_params, exchange_function, linear_model
+from entropic.liquidity import (
+    OutputTables,
+    SplitOptimizer,
+    collapse_path,
+    convex_model,
+    exchange_fit_params,
+    exchange_fit_params_batch,
+    exchange_function,
+    marginal_price,
+    marginal_split,
+    marginal_split_paths,
+    path_output,
+    price_impact,
+    iter_price_impact,
+    pools_over_impact,
+    price_impact_matrix,
+    quote_ladder,
+    solve_split,
+)
 
 TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
 
@@ -43,4 +62,175 @@ def test_convex_model():
     A, B, C, D = np.vstack([opt1, opt2]).T
     p1, p2 = convex_model(100, A, B, C, D, [0,0])
     assert pytest.approx(p1, 0.01) == pytest.approx(p2, 0.01)
-    
\ No newline at end of file
+
+
+def test_collapse_path():
+    """
+    A collapsed path should give the same output as swapping hop by hop
+    """
+    liq1 = np.array([100.0, 5e3, 40.0])
+    liq2 = np.array([2e3, 60.0, 900.0])
+    fees = np.array([0.003, 0.01, 0.0])
+    x = np.linspace(0, 500, 50)
+    y = x
+    for l1, l2, f in zip(liq1, liq2, fees):
+        y = exchange_function(y * (1 - f), l1, l2)
+    liq_in, liq_out = collapse_path(liq1, liq2, fees)
+    assert path_output(x, liq_in, liq_out) == pytest.approx(y)
+    eps = 1e-4
+    numeric = (path_output(x + eps, liq_in, liq_out) - path_output(x - eps, liq_in, liq_out)) / (2 * eps)
+    assert marginal_price(x, liq_in, liq_out) == pytest.approx(numeric, rel=1e-5)
+    spot = marginal_price(0, liq_in, liq_out)
+    assert price_impact(x[1:], liq_in, liq_out) == pytest.approx(1 - y[1:] / (x[1:] * spot))
+    # several paths of the same length at once
+    many_in, _ = collapse_path(np.stack([liq1, liq1 * 2]), np.stack([liq2, liq2 * 2]))
+    assert many_in.shape == (2,)
+
+
+def test_exchange_fit_params_batch():
+    """
+    The batched fit should match every curve at least as well as the curve_fit loop
+    """
+    x = np.linspace(0, 100, 100)
+    liq1 = np.array([100.0, 20.0, 5e3, 10.0])
+    liq2 = np.array([100.0, 3e3, 70.0, 10.0])
+    params, err = exchange_fit_params_batch(x, liq1, liq2)
+    assert params.shape == (4, 4)
+    for (A, B, C, D), e, l1, l2 in zip(params, err, liq1, liq2):
+        y = exchange_function(x, l1, l2)
+        fit = A * np.sqrt(B * x + C) + D
+        assert np.sqrt(np.mean((fit - y) ** 2)) == pytest.approx(e, abs=1e-9 * l2)
+        ref = exchange_fit_params(x, l1, l2)
+        ref_err = np.sqrt(np.mean((ref[0] * np.sqrt(ref[1] * x + ref[2]) + ref[3] - y) ** 2))
+        assert e <= ref_err * (1 + 1e-6) + 1e-12
+
+
+def test_split_optimizer():
+    """
+    A compiled optimizer should give the same split as a freshly built problem on re-solves
+    """
+    x = np.linspace(0, 100, 100)
+    params, _ = exchange_fit_params_batch(x, [100.0, 300.0, 60.0], [100.0, 250.0, 90.0])
+    A, B, C, D = params.T
+    optimizer = SplitOptimizer(3)
+    for amt in [50.0, 80.0]:
+        split = optimizer.solve(amt, A, B, C, D, np.zeros(3))
+        xv = cp.Variable(3)
+        y = cp.multiply(A, cp.sqrt(cp.multiply(B, xv) + C)) + D
+        cp.Problem(cp.Maximize(cp.sum(y)), [cp.sum(xv) == amt, y >= 0]).solve()
+        assert split == pytest.approx(xv.value, abs=1e-3 * amt)
+    assert optimizer.timings["solves"] == 2
+    assert optimizer.timings["compile"] > 0
+
+
+def test_marginal_split():
+    """
+    The native split should agree with convex_model, with and without binding slippage
+    """
+    x_grid = np.linspace(0, 100, 100)
+    params, _ = exchange_fit_params_batch(x_grid, [100.0, 100.0, 400.0], [100.0, 100.0, 150.0])
+    A, B, C, D = params.T
+    p1, p2, _ = marginal_split(100, A, B, C, D, [0, 0, 0])
+    assert p1 == pytest.approx(p2)
+    spot = A * B / (2 * np.sqrt(C))
+    for S in [np.zeros(3), [0, 0, 0.9 * spot[2]]]:
+        ref = convex_model(100, A, B, C, D, S)
+        assert marginal_split(100, A, B, C, D, S) == pytest.approx(ref, abs=0.05)
+
+    liq_in, liq_out = np.array([100.0, 300.0, 50.0]), np.array([120.0, 200.0, 90.0])
+    split = marginal_split_paths(150, liq_in, liq_out, S=[0, 0.6, 0])
+    assert sum(split) == pytest.approx(150)
+    assert path_output(split[1], liq_in[1], liq_out[1]) == pytest.approx(0.6 * split[1])
+    prices = marginal_price(np.array(split), liq_in, liq_out)
+    assert prices[0] == pytest.approx(prices[2])
+
+
+def test_quote_ladder():
+    """
+    Each rung of the ladder should be the split of its amount on its own
+    """
+    paths = (np.array([100.0, 300.0, 50.0]), np.array([120.0, 200.0, 90.0]))
+    amounts = np.linspace(0, 300, 31)
+    splits, outputs = quote_ladder(paths, amounts, S=[0, 0.6, 0])
+    for amt, split in zip(amounts[::5], splits[::5]):
+        assert split == pytest.approx(marginal_split_paths(amt, *paths, S=[0, 0.6, 0]), abs=1e-9)
+    assert np.all(np.diff(outputs) > 0)
+    assert np.all(np.diff(splits, axis=0) >= -1e-12)
+    # with every path capped the largest amounts cannot be placed
+    _, capped = quote_ladder(paths, [10.0, 1e4], S=[0.5, 0.5, 0.5])
+    assert np.isfinite(capped[0]) and np.isnan(capped[1])
+
+
+def test_solve_split_fallback():
+    """
+    Missing or unsuitable backends should be skipped and the winner recorded
+    """
+    x_grid = np.linspace(0, 100, 100)
+    params, _ = exchange_fit_params_batch(x_grid, [100.0, 300.0, 60.0], [100.0, 250.0, 90.0])
+    A, B, C, D = params.T
+    S = np.zeros(3)
+    split, report = solve_split(80, A, B, C, D, S)
+    assert report.backend == "native"
+    assert [a[0] for a in report.attempts] == ["native"]
+    ref, report = solve_split(80, A, B, C, D, S, backends=("NOT_A_SOLVER", "CLARABEL"))
+    assert report.backend == "CLARABEL"
+    assert report.attempts[0][1] == "unavailable"
+    assert split == pytest.approx(ref, abs=0.05)
+    # the native solver does not handle decreasing curves and nothing else is left to try
+    with pytest.raises(ValueError):
+        solve_split(80, -A, B, C, D, S, backends=("native",), time_limit=1.0)
+
+
+def test_price_impact_matrix():
+    """
+    The matrix should match price_impact pool by pool in every mode
+    """
+    rng = np.random.default_rng(0)
+    liq1, liq2 = rng.lognormal(5, 2, 50), rng.lognormal(5, 2, 50)
+    fees = rng.uniform(0, 0.01, 50)
+    amounts = np.array([1.0, 10.0, 1e3])
+    impact = price_impact_matrix(amounts, liq1, liq2, fees)
+    for row, l1, l2, f in zip(impact, liq1, liq2, fees):
+        # the output after fees against the spot price before fees
+        output = exchange_function(amounts * (1 - f), l1, l2)
+        assert row == pytest.approx(1 - output / (amounts * l2 / l1))
+    assert price_impact_matrix(amounts, liq1, liq2)[0] == pytest.approx(
+        price_impact(amounts, liq1[0], liq2[0])
+    )
+    # a pool keeping almost all of the input as fee is the worst, not the best
+    fee_impact = price_impact_matrix([1e-6], [1e3, 1e3, 1e3], 1e3, [0.0, 0.999, 1.0])
+    assert fee_impact[:, 0] == pytest.approx([1e-9, 0.999, 1.0], rel=1e-6)
+    blocks = list(iter_price_impact(amounts, liq1, liq2, fees, dtype=np.float32, chunk_size=7))
+    assert [start for start, _ in blocks] == list(range(0, 50, 7))
+    assert blocks[0][1].dtype == np.float32
+    assert blocks[-1][1] == pytest.approx(impact[49:], rel=1e-6)
+    pools, over = pools_over_impact(amounts, liq1, liq2, 0.5, fees, chunk_size=7)
+    assert pools.tolist() == np.flatnonzero((impact > 0.5).any(axis=1)).tolist()
+    assert over == pytest.approx(impact[pools])
+    # an empty pool cannot fill any order
+    assert price_impact_matrix(amounts, [10.0], [0.0])[0] == pytest.approx(1.0)
+
+
+def test_output_tables():
+    """
+    Table lookups should stay within their error bound, also after liquidity moves that are
+    too small to rebuild the tables
+    """
+    rng = np.random.default_rng(0)
+    liq1, liq2 = rng.lognormal(6, 2, 200), rng.lognormal(6, 2, 200)
+    fees = rng.uniform(0, 0.01, 200)
+    tables = OutputTables(liq1, liq2, fees)
+    rows = rng.integers(0, 200, 5000)
+    amounts = liq1[rows] * 10 ** rng.uniform(-6, 3, 5000)
+    y, bound = tables.output(rows, amounts)
+    exact = exchange_function(amounts * (1 - fees[rows]), liq1[rows], liq2[rows])
+    assert np.all(np.abs(exact - y) <= bound + 1e-9 * liq2[rows])
+    # a concave curve is never overestimated by its chords
+    assert np.all(y <= exact + 1e-9 * liq2[rows])
+
+    moved1, moved2 = liq1 * (1 + rng.uniform(-0.005, 0.005, 200)), liq2 * 1.5
+    assert len(tables.update(np.arange(200), moved1, moved2, fees)) == 0
+    y, bound = tables.output(rows, amounts)
+    exact = exchange_function(amounts * (1 - fees[rows]), moved1[rows], moved2[rows])
+    assert np.all(np.abs(exact - y) <= bound + 1e-9 * moved2[rows])
+    assert tables.update([3], liq1[3] * 2, liq2[3], fees[3]).tolist() == [3]
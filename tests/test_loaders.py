@@ -0,0 +1,74 @@
+# %%
+import gzip
+from pathlib import Path
+import pytest
+from monty.serialization import loadfn
+from entropic.loaders import iter_json_records
+
+TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
+
+
+@pytest.fixture
+def data():
+    return loadfn(TEST_FILES_DIR / "nodes_edges.json")
+
+
+def test_iter_json_records(data, tmp_path):
+    """
+    Streaming a compressed file in tiny chunks should give back every edge and node
+    """
+    filename = tmp_path / "nodes_edges.json.gz"
+    with gzip.open(filename, "wt") as fp:
+        fp.write((TEST_FILES_DIR / "nodes_edges.json").read_text())
+    records = list(iter_json_records(filename, chunk_size=7))
+    assert [item for key, item in records if key == "edges"] == data["edges"]
+    assert [item for key, item in records if key == "nodes"] == data["nodes"]
+
+
+@pytest.mark.parametrize("backend", ["networkx", "csr"])
+def test_liq_frac(data, backend):
+    """
+    The endpoint liquidity should be the node liquidity scaled by liq_frac
+    """
+    from entropic.core import DEXA
+
+    full = DEXA.from_list(data["edges"], data["nodes"], backend=backend)
+    half = DEXA.from_file(
+        TEST_FILES_DIR / "nodes_edges.json", liq_frac=0.5, backend=backend
+    )
+    for key in ("source_liquidity", "target_liquidity"):
+        assert half._view().edge_data[key] == pytest.approx(
+            0.5 * full._view().edge_data[key]
+        )
+
+
+def test_row_format():
+    """
+    The settings/data rows should become one edge per pool, parallel pools included
+    """
+    from entropic.core import DEXA
+
+    filename = TEST_FILES_DIR / "da_test_example_0.json"
+    raw = loadfn(filename)
+    dexa = DEXA.from_file(filename, liq_frac=0.5)
+    graph = dexa.csr
+    assert dexa.settings == raw["settings"]
+    assert graph.multi and graph.num_edges == len(raw["data"])
+    venue, source, destination, speed, fee, liquidity, rate = raw["data"][0]
+    assert graph.names([graph.u[0], graph.v[0]]) == [source, destination]
+    assert graph.edge_dict(0)["venue"] == venue
+    assert graph.edge_data["target_liquidity"][0] == pytest.approx(0.25 * liquidity)
+    assert graph.edge_data["source_liquidity"][0] == pytest.approx(
+        0.25 * liquidity / rate
+    )
+    assert len(graph.edge_ids(*graph.ids(["chain0", "chain1"]))) == sum(
+        {row[1], row[2]} == {"chain0", "chain1"} for row in raw["data"]
+    )
+    bridges = set(raw["settings"]["bridges"])
+    assert graph.edge_data["isBridge"].tolist() == [
+        row[0] in bridges for row in raw["data"]
+    ]
+    assert graph.node_dict(graph.node_index["chain1"]) == {
+        "kind": "chain",
+        "chain": "chain1",
+    }
@@ -0,0 +1,68 @@
+# %%
+import networkx as nx
+import numpy as np
+import pytest
+from entropic.graph import CSRGraph
+from entropic.overlay import ChainOverlay
+from entropic.paths import PathEngine
+
+
+@pytest.fixture
+def chains_graph():
+    """
+    Four random chains of 40 tokens joined by a few bridges
+    """
+    rng = np.random.default_rng(3)
+    edges = []
+    for c in range(4):
+        graph = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=c)
+        for a, b in graph.edges():
+            edges.append(
+                {"u": f"C{c}:T{a}", "v": f"C{c}:T{b}", "w": float(rng.integers(1, 20))}
+            )
+    for _ in range(10):
+        c1, c2 = rng.choice(4, 2, replace=False)
+        token = rng.integers(40)
+        edges.append(
+            {
+                "u": f"C{c1}:T{token}",
+                "v": f"C{c2}:T{token}",
+                "w": float(rng.integers(1, 20)),
+                "isBridge": True,
+            }
+        )
+    return CSRGraph.from_lists(edges, [])
+
+
+def test_overlay_paths(chains_graph):
+    """
+    The overlay should find the same shortest paths as a search over the whole graph and
+    valid alternatives
+    """
+    weights = chains_graph.edge_weights("w")
+    overlay = ChainOverlay(chains_graph, weights)
+    engine = PathEngine(chains_graph, weights)
+    rng = np.random.default_rng(0)
+    for source, target in rng.choice(chains_graph.num_nodes, (20, 2)):
+        expected = engine.k_shortest_paths(source, target, 5)
+        paths = overlay.k_shortest_paths(source, target, 5)
+        costs = [engine.path_cost(ip) for ip in paths]
+        assert len(paths) == 5 and costs == sorted(costs)
+        assert costs[0] == pytest.approx(engine.path_cost(expected[0]))
+        # the alternatives are searched in the chains of the best overlay paths only
+        assert all(c >= engine.path_cost(ip) - 1e-9 for c, ip in zip(costs, expected))
+        assert all(len(set(ip)) == len(ip) for ip in paths)
+        best = overlay.shortest_path(source, target)
+        assert engine.path_cost(best) == pytest.approx(costs[0])
+
+    # a change inside one chain only recomputes that chain
+    chain = chains_graph.chain_index().chain_ids["C2"]
+    (edge,) = np.flatnonzero(overlay.edge_chain == chain)[:1]
+    assert overlay.update([edge], [100.0]) == [chain]
+    assert overlay.builds == {0: 1, 1: 1, 2: 2, 3: 1}
+    weights[edge] = 100.0
+    engine = PathEngine(chains_graph, weights)
+    source, target = chains_graph.u[edge], chains_graph.v[edge]
+    assert engine.path_cost(overlay.shortest_path(source, target)) == pytest.approx(
+        engine.path_cost(engine.k_shortest_paths(source, target, 1)[0])
+    )
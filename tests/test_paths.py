@@ -0,0 +1,113 @@
+# %%
+from itertools import islice
+import networkx as nx
+import numpy as np
+import pytest
+from entropic.graph import CSRGraph
+from entropic.paths import PathEngine, RouteIndex
+
+
+@pytest.fixture
+def random_graph():
+    """
+    A random connected graph with positive edge weights
+    """
+    graph = nx.connected_watts_strogatz_graph(60, 4, 0.3, seed=7)
+    rng = np.random.default_rng(7)
+    for _, _, d in graph.edges(data=True):
+        d["weight"] = float(rng.integers(1, 20))
+    return nx.relabel_nodes(graph, {i: f"n{i}" for i in graph.nodes})
+
+
+def test_weighted_k_shortest_paths(random_graph):
+    """
+    The engine should find paths with the same costs as networkx
+    """
+    csr = CSRGraph.from_networkx(random_graph)
+    engine = PathEngine(csr, csr.edge_weights("weight"))
+    for source, target in [("n0", "n30"), ("n5", "n17"), ("n59", "n1")]:
+        expected = list(
+            islice(nx.shortest_simple_paths(random_graph, source, target, "weight"), 20)
+        )
+        paths = engine.k_shortest_paths(*csr.ids([source, target]), 20)
+        assert len(paths) == 20
+        assert len({tuple(ip) for ip in paths}) == 20
+        costs = [engine.path_cost(ip) for ip in paths]
+        assert costs == sorted(costs)
+        assert costs == pytest.approx(
+            [nx.path_weight(random_graph, ip, "weight") for ip in expected]
+        )
+        for ip in paths:
+            assert len(set(ip)) == len(ip)
+            assert nx.is_path(random_graph, csr.names(ip))
+
+
+def test_tree_cache_bound(random_graph):
+    """
+    Only the most recently used shortest-path trees should be kept
+    """
+    csr = CSRGraph.from_networkx(random_graph)
+    weights = csr.edge_weights("weight")
+    engine = PathEngine(csr, weights, max_trees=2)
+    for root in [0, 13, 42]:
+        engine.reverse_tree(root)
+    assert len(engine._trees) == 2
+    assert 0 not in engine._trees
+    weights[:3] = 50.0
+    engine.update_weights([0, 1, 2], weights[:3])
+    assert engine.reverse_tree(0)[0] == pytest.approx(
+        PathEngine(csr, weights).reverse_tree(0)[0]
+    )
+
+
+def test_update_weights(random_graph):
+    """
+    Repaired shortest-path trees should match the ones computed from scratch
+    """
+    csr = CSRGraph.from_networkx(random_graph)
+    weights = csr.edge_weights("weight")
+    engine = PathEngine(csr, weights)
+    roots = [0, 13, 42]
+    for root in roots:
+        engine.reverse_tree(root)
+    rng = np.random.default_rng(3)
+    for _ in range(10):
+        edges = rng.choice(csr.num_edges, 5, replace=False)
+        weights[edges] = rng.integers(0, 40, 5)
+        engine.update_weights(edges, weights[edges])
+        fresh = PathEngine(csr, weights)
+        for root in roots:
+            assert engine.reverse_tree(root)[0] == pytest.approx(
+                fresh.reverse_tree(root)[0]
+            )
+            dist, nxt = engine.reverse_tree(root)
+            for node in range(csr.num_nodes):
+                if node != root:
+                    assert dist[node] == pytest.approx(
+                        dist[nxt[node]] + fresh.matrix[node, nxt[node]]
+                    )
+
+
+def test_route_index(random_graph):
+    """
+    The index should agree with single-source searches, also after weight updates
+    """
+    csr = CSRGraph.from_networkx(random_graph)
+    weights = csr.edge_weights("weight")
+    engine = PathEngine(csr, weights)
+    index = RouteIndex.build(engine.matrix, chunk_size=16)
+    rng = np.random.default_rng(5)
+    for _ in range(2):
+        for source, target in rng.integers(0, csr.num_nodes, (20, 2)):
+            path = index.path(source, target)
+            assert path[0] == source and path[-1] == target
+            assert engine.path_cost(path) == pytest.approx(
+                index.distance(source, target)
+            )
+            assert index.distance(source, target) == pytest.approx(
+                engine.reverse_tree(target)[0][source]
+            )
+        edges = rng.choice(csr.num_edges, 5, replace=False)
+        weights[edges] = rng.integers(0, 40, 5)
+        index.update(engine.update_weights(edges, weights[edges]))
+        engine = PathEngine(csr, weights)
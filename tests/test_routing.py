@@ -0,0 +1,86 @@
+# %%
+from pathlib import Path
+import networkx as nx
+import pytest
+from entropic.core import DEXA
+from entropic.liquidity import exchange_function
+
+TEST_FILES_DIR = Path(__file__).parent.parent / "test_files"
+
+
+@pytest.fixture
+def dexa():
+    return DEXA.from_file(TEST_FILES_DIR / "nodes_edges.json", backend="csr")
+
+
+def path_output(graph, path, amount):
+    for a, b in zip(path[:-1], path[1:]):
+        d = graph.edges[a, b]
+        liq = (d["source_liquidity"], d["target_liquidity"])
+        liq1, liq2 = liq if (a, b) == (d["u"], d["v"]) else liq[::-1]
+        amount = exchange_function(amount, liq1, liq2)
+    return amount
+
+
+@pytest.mark.parametrize("amount", [1.0, 1e4])
+def test_best_routes_for_amount(dexa, amount):
+    """
+    The best route should be the simple path with the highest composed output
+    """
+    graph = nx.Graph()
+    view = dexa.csr
+    for e in range(view.num_edges):
+        u, v = view.names([view.u[e], view.v[e]])
+        graph.add_edge(u, v, u=u, v=v, **view.edge_dict(e))
+    outputs = sorted(
+        path_output(graph, ip, amount)
+        for ip in nx.all_simple_paths(graph, "Ethereum:SUSHI", "Polygon:BIFI")
+    )
+    routes = dexa.best_routes_for_amount(
+        "Ethereum:SUSHI", "Polygon:BIFI", amount, k=3, fee_scale=0
+    )
+    assert routes[0].amount_out == pytest.approx(outputs[-1])
+    for route in routes:
+        assert route.amount_out == pytest.approx(
+            path_output(graph, route.nodes, amount)
+        )
+    assert [r.amount_out for r in routes] == sorted(
+        [r.amount_out for r in routes], reverse=True
+    )
+    # a fee lowers the input of every hop
+    (taxed,) = dexa.best_routes_for_amount(
+        "Ethereum:SUSHI", "Polygon:BIFI", amount, fee_scale=1e-12
+    )
+    assert taxed.amount_out < routes[0].amount_out
+
+
+def test_quote(dexa):
+    """
+    A quote should spend the whole amount and report every stage
+    """
+    quote = dexa.quote("Ethereum:SUSHI", "Polygon:BIFI", 1e3, k=3, fee_scale=0)
+    assert len(quote.nodes) == 3
+    assert quote.split.sum() == pytest.approx(1e3)
+    assert set(quote.timings) == {"paths", "curves", "split", "estimate", "total"}
+    assert quote.amount_out == pytest.approx(quote.outputs.sum())
+    # a single path gets everything
+    best = dexa.quote("Ethereum:SUSHI", "Polygon:BIFI", 1e3, k=1, fee_scale=0)
+    graph = nx.Graph()
+    view = dexa.csr
+    for e in range(view.num_edges):
+        u, v = view.names([view.u[e], view.v[e]])
+        graph.add_edge(u, v, u=u, v=v, **view.edge_dict(e))
+    assert best.amount_out == pytest.approx(path_output(graph, best.nodes[0], 1e3))
+    assert quote.amount_out > best.amount_out
+
+
+def test_quote_after_assign_weight(dexa):
+    """
+    A new weighting should be used by the next quote
+    """
+    source, target = "Ethereum:SUSHI", "Polygon:BIFI"
+    dexa.assign_weight(lambda e: e["fee"])
+    dexa.quote(source, target, 1e3, k=1, fee_scale=0)
+    dexa.assign_weight(lambda e: 1 / (1 + e["target_liquidity"]))
+    quote = dexa.quote(source, target, 1e3, k=1, fee_scale=0)
+    assert quote.nodes == dexa.get_pathways(source, target, 1)